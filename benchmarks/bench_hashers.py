@@ -0,0 +1,87 @@
+"""
+Benchmark the password hashers registered in `auth`.
+
+Reports, for each scheme and set of parameters, the time a hash and
+a verification take, and the peak memory of the process doing them. scrypt
+trades memory for time, bcrypt and PBKDF2 take next to none.
+
+Each set of parameters is measured in a fresh process, so that its peak
+memory isn't that of a previous one. Run from the repository root with
+
+    PYTHONPATH=src python benchmarks/bench_hashers.py
+"""
+import multiprocessing
+import resource
+import sys
+import time
+
+import auth
+
+repeat = 5
+
+parameter_sets = [
+    ("bcrypt", {"workfactor": 10}),
+    ("bcrypt", {"workfactor": 12}),
+    ("scrypt", {"n": 2 ** 14, "r": 8, "p": 1}),
+    ("scrypt", {"n": 2 ** 15, "r": 8, "p": 1}),
+    ("scrypt", {"n": 2 ** 16, "r": 8, "p": 1}),
+    ("pbkdf2-sha256", {"iterations": 300000}),
+    ("pbkdf2-sha256", {"iterations": 600000}),
+]
+
+
+def _get_maxrss():
+    # in kilobytes on Linux, in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss * 1024 if sys.platform != "darwin" else maxrss
+
+
+def _time(func, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(scheme, params):
+    """
+    Return the time a hash and a verification take by argument scheme and
+    parameters, and the memory they take on top of the process' own.
+    """
+    hasher = auth.get_hasher(scheme, **params)
+    baseline = _get_maxrss()
+
+    hash = hasher.hash("y0u != n00b1e")
+    hash_seconds = _time(hasher.hash, "y0u != n00b1e")
+    verify_seconds = _time(auth.check_password_hash, "y0u != n00b1e", hash)
+    return hash_seconds, verify_seconds, _get_maxrss() - baseline
+
+
+def main():
+    context = multiprocessing.get_context("spawn")
+    print(
+        "{:15} {:24} {:>10} {:>10} {:>10}".format(
+            "scheme", "params", "hash", "verify", "peak mem"
+        )
+    )
+    for scheme, params in parameter_sets:
+        # a fresh process per set of parameters, maxrss only ever grows
+        with context.Pool(1) as pool:
+            hash_seconds, verify_seconds, peak = pool.apply(
+                measure, (scheme, params)
+            )
+        print(
+            "{:15} {:24} {:7.1f} ms {:7.1f} ms {:6.1f} MiB".format(
+                scheme,
+                ",".join("{}={}".format(*item) for item in params.items()),
+                hash_seconds * 1e3,
+                verify_seconds * 1e3,
+                peak / 2 ** 20,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
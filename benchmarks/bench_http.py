@@ -0,0 +1,390 @@
+"""
+Load test the app over HTTP, listing users and logging them in.
+
+Starts a test app on an ephemeral port, in process, seeds its database with
+users, and drives it with a number of concurrent clients, each sending
+requests drawn from a weighted mix of kinds:
+
+- "users", listing a page of users, with an access token,
+- "login", logging in one of the users seeded, with the right password.
+
+Reports the throughput, in requests per second, and the 50th, 95th and 99th
+percentiles of latency along with a histogram of it, overall and per kind,
+of the requests answered 200, and the number of the others, errors.
+The clients run on the same event loop as the app, so that latencies take in
+the time requests wait on one another, and throughput is noisy, by a few
+percent.
+
+Results may be saved as JSON, and compared against those of an earlier run,
+exiting with status 1 if throughput fell, or tail latency rose, by more than
+a tolerance, or errors were answered that weren't before. Runs are comparable
+on the same machine, at the same settings.
+
+Run from the repository root, which `testing.client_sessions` imports from,
+with
+
+    PYTHONPATH=src:. python benchmarks/bench_http.py --save before.json
+    PYTHONPATH=src:. python benchmarks/bench_http.py --compare before.json
+
+The app runs in test mode, and drops and recreates the users table of the
+test database, as the test suite does. The first user seeded is made an admin,
+for listing users.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import aiohttp
+import aiosqlite
+from aiohttp.test_utils import TestServer
+
+import config
+import routes  # noqa, registers the routes
+from app import demo_options, init_test_app
+from db import stmts
+from db.utils import get_db_path
+from testing.client_sessions import TestClientSession
+
+kinds = ("users", "login")
+password = "y0u != n00b1e"
+# upper bounds of the buckets of latency histograms, in seconds
+latency_buckets = tuple(0.0005 * 2 ** i for i in range(12))
+
+
+def parse_mix(mix):
+    """
+    Return a mapping of request kinds to their weights,
+    from argument mix as in "users=9,login=1".
+    """
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in kinds:
+            raise argparse.ArgumentTypeError(
+                "unknown request kind: {!r}, not one of {}".format(kind, kinds)
+            )
+        try:
+            weights[kind] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError("bad weight: {!r}".format(weight))
+    if not sum(weights.values()) > 0:
+        raise argparse.ArgumentTypeError("weights must add up to more than zero")
+    return weights
+
+
+def percentile(latencies, p):
+    """
+    Return the `p`th percentile of argument sorted latencies, by nearest rank.
+    """
+    if not latencies:
+        return None
+    rank = max(1, -(-len(latencies) * p // 100))
+    return latencies[int(rank) - 1]
+
+
+def summarize(latencies, errors, duration):
+    """
+    Return the throughput and latency stats of argument latencies,
+    of requests served over argument duration, in seconds,
+    along with argument number of errors.
+    """
+    latencies = sorted(latencies)
+    counts = [0] * (len(latency_buckets) + 1)
+    bucket = 0
+    for latency in latencies:
+        while bucket < len(latency_buckets) and latency > latency_buckets[bucket]:
+            bucket += 1
+        counts[bucket] += 1
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / duration,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1] if latencies else None,
+        "histogram": counts,
+    }
+
+
+db_path = str(get_db_path(config.basedir, mode="test"))
+
+
+async def reset_users_table():
+    _, table_drop_stmt = stmts.get_create_drop_stmts(
+        stmts.users_table_create_template, table_name="users", mode="test"
+    )
+    async with aiosqlite.connect(db_path) as conn:
+        await conn.execute(table_drop_stmt)
+        await conn.execute("DROP TABLE IF EXISTS test_schema_migrations;")
+        await conn.commit()
+    await config.migrate_db("test", "test")
+
+
+async def seed_users(session, server, number):
+    """
+    Create argument number of users, a few at a time, the first an admin,
+    and return the credentials of each.
+    """
+    url = server.make_url("/users/")
+    credentials = [
+        {"email": "user{}@example.com".format(i), "password": password}
+        for i in range(number)
+    ]
+    semaphore = asyncio.Semaphore(8)
+
+    async def _create(i):
+        payload = dict(credentials[i], username="user{}".format(i))
+        async with semaphore:
+            async with session.post(url, json=payload) as resp:
+                assert resp.status == 201, await resp.text()
+
+    await asyncio.gather(*[_create(i) for i in range(number)])
+    async with aiosqlite.connect(db_path) as conn:
+        await conn.execute("UPDATE test_users SET is_admin = 1 WHERE id = 1;")
+        await conn.commit()
+    return credentials
+
+
+async def run(options):
+    """
+    Return the results of a load test run at argument options.
+    """
+    await reset_users_table()
+    app = init_test_app(
+        **demo_options,
+        SETTINGS={"HASHER_WORKFACTOR": options.workfactor}
+    )
+    rng = random.Random(options.seed)
+    weights = options.mix
+    # listings are sent by the admin, logins anonymously, each session's pool
+    # of connections capping concurrency at 100 otherwise
+    admin_session = TestClientSession(
+        connector=aiohttp.TCPConnector(limit=options.concurrency)
+    ).force_authenticate({"id": 1})
+    anonymous_session = TestClientSession(
+        connector=aiohttp.TCPConnector(limit=options.concurrency)
+    )
+
+    async with TestServer(app) as server:
+        async with admin_session as admin, anonymous_session as anonymous:
+            credentials = await seed_users(anonymous, server, options.users)
+            users_url = server.make_url(
+                "/users/?limit={}".format(options.page_size)
+            )
+            login_url = server.make_url("/login/")
+
+            async def _send(kind):
+                """
+                Return True if the request of argument kind is answered 200.
+                """
+                if kind == "users":
+                    resp = await admin.get(users_url)
+                else:
+                    resp = await anonymous.post(
+                        login_url, json=rng.choice(credentials)
+                    )
+                async with resp:
+                    await resp.read()
+                    return resp.status == 200
+
+            async def _drive(total, latencies, errors):
+                remaining = total
+
+                async def _client():
+                    nonlocal remaining
+                    while remaining > 0:
+                        remaining -= 1
+                        [kind] = rng.choices(
+                            list(weights), weights=list(weights.values())
+                        )
+                        start = time.perf_counter()
+                        if await _send(kind):
+                            latencies[kind].append(time.perf_counter() - start)
+                        else:
+                            errors[kind] += 1
+
+                start = time.perf_counter()
+                await asyncio.gather(
+                    *[_client() for _ in range(options.concurrency)]
+                )
+                return time.perf_counter() - start
+
+            await _drive(
+                options.warmup,
+                {kind: [] for kind in kinds},
+                {kind: 0 for kind in kinds},
+            )
+            latencies = {kind: [] for kind in kinds}
+            errors = {kind: 0 for kind in kinds}
+            duration = await _drive(options.requests, latencies, errors)
+
+    results = {
+        "all": summarize(sum(latencies.values(), []), sum(errors.values()), duration)
+    }
+    for kind in weights:
+        results[kind] = summarize(latencies[kind], errors[kind], duration)
+    return {
+        "settings": {
+            "concurrency": options.concurrency,
+            "requests": options.requests,
+            "mix": weights,
+            "users": options.users,
+            "page_size": options.page_size,
+            "workfactor": options.workfactor,
+        },
+        "platform": {
+            "python": platform.python_version(),
+            "aiohttp": aiohttp.__version__,
+            "machine": platform.machine(),
+        },
+        "duration": duration,
+        "results": results,
+    }
+
+
+def compare(previous, current, tolerance):
+    """
+    Return descriptions of the regressions of argument current results
+    from argument previous ones, beyond argument tolerance, a fraction.
+    """
+    regressions = []
+    for name, stats in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        if stats["errors"] > before.get("errors", 0):
+            regressions.append(
+                "{}: errors rose from {} to {}".format(
+                    name, before.get("errors", 0), stats["errors"]
+                )
+            )
+        # kinds with no request answered have no throughput or latency to compare
+        if not (stats["requests"] and before["requests"]):
+            continue
+        if stats["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(
+                "{}: throughput fell from {:.0f} to {:.0f} req/s".format(
+                    name, before["rps"], stats["rps"]
+                )
+            )
+        for p in ("p95", "p99"):
+            if stats[p] > before[p] * (1 + tolerance):
+                regressions.append(
+                    "{}: {} latency rose from {:.2f} to {:.2f} ms".format(
+                        name, p, before[p] * 1e3, stats[p] * 1e3
+                    )
+                )
+    return regressions
+
+
+def _format_latency(seconds):
+    return "      -" if seconds is None else "{:7.2f}".format(seconds * 1e3)
+
+
+def format_results(run):
+    lines = []
+    for name, stats in run["results"].items():
+        lines.append(
+            "{:<6} {:6} requests {:6} errors {:10.0f} req/s   "
+            "p50 {} ms   p95 {} ms   p99 {} ms".format(
+                name,
+                stats["requests"],
+                stats["errors"],
+                stats["rps"],
+                _format_latency(stats["p50"]),
+                _format_latency(stats["p95"]),
+                _format_latency(stats["p99"]),
+            )
+        )
+    lines.append("")
+    lines.append("latency histogram, all requests:")
+    counts = run["results"]["all"]["histogram"]
+    widest = max(counts) or 1
+    labels = ["<= {:g} ms".format(bound * 1e3) for bound in latency_buckets]
+    labels.append("> {:g} ms".format(latency_buckets[-1] * 1e3))
+    for label, count in zip(labels, counts):
+        if count:
+            lines.append(
+                "{:>12} {:7} {}".format(label, count, "#" * (50 * count // widest))
+            )
+    return "\n".join(lines)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Load test the app over HTTP, listing users and logging them in."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="number of concurrent clients"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=5000, help="number of requests measured"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=500, help="number of requests sent beforehand"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("users=9,login=1"),
+        help='weights of the kinds of requests sent, as in "users=9,login=1"',
+    )
+    parser.add_argument(
+        "--users", type=int, default=200, help="number of users seeded"
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=10, help="number of users listed per page"
+    )
+    # logins of the default work factor take tenths of a second, each,
+    # measuring the hasher rather than the app
+    parser.add_argument(
+        "--workfactor", type=int, default=4, help="bcrypt work factor of the users"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the draws of requests"
+    )
+    parser.add_argument("--save", metavar="PATH", help="save results as JSON")
+    parser.add_argument(
+        "--compare", metavar="PATH", help="compare against results saved earlier"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="fraction of throughput or tail latency lost that is a regression",
+    )
+    return parser
+
+
+def main(argv=None):
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+    options = get_parser().parse_args(argv)
+    loop = asyncio.get_event_loop()
+    current = loop.run_until_complete(run(options))
+    print(format_results(current))
+
+    if options.save:
+        with open(options.save, "w") as file:
+            json.dump(current, file, indent=2)
+
+    if options.compare:
+        with open(options.compare) as file:
+            previous = json.load(file)
+        if previous["settings"] != current["settings"]:
+            print("\nwarning: runs compared are at different settings")
+        regressions = compare(previous, current, options.tolerance)
+        print()
+        print("\n".join(regressions) if regressions else "no regressions")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Benchmark the overhead of recording metrics.
+
+Measures the time the metrics middleware adds to a request, against a handler
+doing nothing, and the time recording adds to the use of a pooled connection.
+Then measures the throughput of an app listing users, with metrics turned on
+and off, in alternating rounds. The client runs on the same event loop as
+the app, so that the throughput measured is noisy, by a percent or so.
+
+Run from the repository root with
+
+    PYTHONPATH=src python benchmarks/bench_metrics.py
+
+The app runs in dev mode, on the dev database, listing users as an admin
+added to it if need be.
+"""
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import aiohttp
+import aiosqlite
+from aiohttp.test_utils import TestServer
+
+import auth
+import config
+import metrics
+import routes  # noqa, registers the routes
+from app import demo_options, init_dev_app
+from db.pool import ConnectionPool
+from db.utils import get_db_path
+
+number = 100000
+rounds = 7
+requests_per_round = 2000
+concurrency = 16
+
+
+async def _bench_middleware(app_metrics):
+    route = SimpleNamespace(resource=SimpleNamespace(canonical="/users/"))
+    request = SimpleNamespace(
+        config_dict={"METRICS": app_metrics},
+        method="GET",
+        match_info=SimpleNamespace(route=route),
+    )
+    response = SimpleNamespace(status=200)
+
+    async def handler(request):
+        return response
+
+    start = time.perf_counter()
+    for _ in range(number):
+        await metrics.metrics_middleware(request, handler)
+    return (time.perf_counter() - start) / number
+
+
+def bench_middleware(loop):
+    """
+    Return the seconds the middleware adds to a request.
+    """
+    without = loop.run_until_complete(_bench_middleware(None))
+    with_metrics = loop.run_until_complete(_bench_middleware(metrics.AppMetrics()))
+    return with_metrics - without
+
+
+async def _bench_pool(db_path, observe):
+    pool = ConnectionPool(db_path, readers=1, profile="test", observe=observe)
+    await pool.open()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            async with pool.reader():
+                pass
+        return (time.perf_counter() - start) / number
+    finally:
+        await pool.close()
+
+
+def bench_pool(loop):
+    """
+    Return the seconds recording adds to the use of a pooled connection.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = Path(tmpdir).joinpath("db.sqlite3")
+        without = loop.run_until_complete(_bench_pool(db_path, None))
+        with_metrics = loop.run_until_complete(
+            _bench_pool(db_path, metrics.AppMetrics().observe_db)
+        )
+    return with_metrics - without
+
+
+async def get_admin():
+    """
+    Return the id of an admin of the dev database, added if need be.
+    """
+    await config.migrate_db("dev", "dev")
+    email = "benchmark-admin@example.com"
+    async with aiosqlite.connect(str(get_db_path(config.basedir, mode="dev"))) as conn:
+        await conn.execute(
+            "INSERT OR IGNORE INTO dev_users (email, username, pwd_hash, is_admin) "
+            "VALUES (?, 'benchmark-admin', '', 1)",
+            [email],
+        )
+        await conn.execute("UPDATE dev_users SET is_admin = 1 WHERE email = ?", [email])
+        await conn.commit()
+        cursor = await conn.execute("SELECT id FROM dev_users WHERE email = ?", [email])
+        (uid,) = await cursor.fetchone()
+        await cursor.close()
+    return uid
+
+
+async def _bench_round(metrics_enabled, uid):
+    app = init_dev_app(
+        **demo_options,
+        SETTINGS={"METRICS_ENABLED": metrics_enabled, "HASHER_WORKFACTOR": 4}
+    )
+    headers = {"Authorization": "Bearer {}".format(auth.gen_access_token(uid=uid))}
+    async with TestServer(app) as server:
+        url = server.make_url("/users/?limit=10")
+        async with aiohttp.ClientSession(headers=headers) as session:
+            remaining = requests_per_round
+
+            async def _worker():
+                nonlocal remaining
+                while remaining > 0:
+                    remaining -= 1
+                    async with session.get(url) as resp:
+                        assert resp.status == 200
+                        await resp.read()
+
+            start = time.perf_counter()
+            await asyncio.gather(*[_worker() for _ in range(concurrency)])
+            return requests_per_round / (time.perf_counter() - start)
+
+
+def bench_throughput(loop):
+    """
+    Return the best throughput, in requests per second, of an app with metrics
+    turned off and of one with metrics turned on.
+    """
+    uid = loop.run_until_complete(get_admin())
+    results = {False: [], True: []}
+    for _ in range(rounds):
+        for metrics_enabled in (False, True):
+            results[metrics_enabled].append(
+                loop.run_until_complete(_bench_round(metrics_enabled, uid))
+            )
+    return max(results[False]), max(results[True])
+
+
+def main():
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+    loop = asyncio.get_event_loop()
+    middleware = bench_middleware(loop)
+    pool = bench_pool(loop)
+    # a request to the app takes a single connection
+    overhead = middleware + pool
+    without, with_metrics = bench_throughput(loop)
+
+    print("middleware, per request: {:10.2f} us".format(middleware * 1e6))
+    print("pool, per connection:    {:10.2f} us".format(pool * 1e6))
+    print("without metrics:         {:10.0f} req/s".format(without))
+    print("with metrics:            {:10.0f} req/s".format(with_metrics))
+    print(
+        "throughput cost:         {:10.2f} %".format(
+            (without - with_metrics) / without * 100
+        )
+    )
+    print(
+        "recording, of a request: {:10.2f} %".format(overhead * without * 100)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark the cost of throttling login attempts.
+
+Compares the work throttling adds to every login attempt with the bcrypt
+verification every unthrottled attempt pays for, measures the memory held
+by a limiter tracking a million distinct keys, and the longest it holds up
+the event loop sweeping those keys, or making room for more.
+
+Run from the repository root with
+
+    PYTHONPATH=src python benchmarks/bench_throttling.py
+"""
+import time
+import timeit
+import tracemalloc
+
+import auth
+from throttling import RateLimiter
+
+number = 100000
+distinct_keys = 1000000
+
+
+def bench_attempt_overhead():
+    limiter = RateLimiter(rate=1.0, burst=20)
+    keys = ["10.0.{}.{}".format(i // 256, i % 256) for i in range(number)]
+    iterator = iter(keys)
+
+    def attempt():
+        key = next(iterator)
+        limiter.check(key)
+        limiter.take(key)
+        limiter.give_back(key)
+
+    seconds = timeit.timeit(attempt, number=number)
+    return seconds / number
+
+
+def bench_unthrottled_attempt():
+    hash = auth.get_password_hash("y0u != n00b1e")
+    seconds = timeit.timeit(
+        lambda: auth.check_password_hash("wr0ngPa55w0rd!", hash), number=3
+    )
+    return seconds / 3
+
+
+def bench_memory():
+    tracemalloc.start()
+    limiter = RateLimiter(rate=0.1, burst=5, max_keys=distinct_keys)
+    for i in range(distinct_keys):
+        limiter.take("user{}@example.com".format(i))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+def bench_sweep():
+    """
+    Return the longest a slice of a sweep took, and the longest taking
+    a token took once the limiter was full, over a million keys.
+    """
+    limiter = RateLimiter(rate=0.1, burst=5, max_keys=distinct_keys)
+    for i in range(distinct_keys):
+        limiter.take("user{}@example.com".format(i))
+
+    longest_slice = 0.0
+    done = False
+    while not done:
+        start = time.perf_counter()
+        done = limiter.sweep(limiter.sweep_slice)
+        longest_slice = max(longest_slice, time.perf_counter() - start)
+
+    longest_take = 0.0
+    for i in range(1000):
+        start = time.perf_counter()
+        limiter.take("other{}@example.com".format(i))
+        longest_take = max(longest_take, time.perf_counter() - start)
+    return longest_slice, longest_take
+
+
+def main():
+    overhead = bench_attempt_overhead()
+    unthrottled = bench_unthrottled_attempt()
+    memory = bench_memory()
+    longest_slice, longest_take = bench_sweep()
+
+    print("throttling, per attempt:  {:10.2f} us".format(overhead * 1e6))
+    print("bcrypt check, per attempt: {:10.2f} us".format(unthrottled * 1e6))
+    print("overhead: {:.4%} of an unthrottled attempt".format(overhead / unthrottled))
+    print(
+        "memory for {} keys: {:.1f} MiB, {:.0f} bytes per key".format(
+            distinct_keys, memory / 2 ** 20, memory / distinct_keys
+        )
+    )
+    print("longest sweep slice:      {:10.2f} ms".format(longest_slice * 1e3))
+    print("longest take, when full:  {:10.2f} ms".format(longest_take * 1e3))
+
+
+if __name__ == "__main__":
+    main()
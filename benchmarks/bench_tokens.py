@@ -0,0 +1,64 @@
+"""
+Benchmark token issuance.
+
+Compares the tokens issued on every login by `auth.gen_access_token` and
+`auth.gen_refresh_token`, which go through `jwt.encode`, with the ones
+minted by a `TokenMinter`, one at a time and as a pair.
+
+Run from the repository root with
+
+    PYTHONPATH=src python benchmarks/bench_tokens.py
+"""
+import os
+import timeit
+
+import auth
+from tokens import TokenMinter
+
+number = 100000
+password_hash = "$2b$13$" + "x" * 53
+
+
+def bench(stmt):
+    seconds = min(timeit.repeat(stmt, number=number, repeat=3))
+    return seconds / number
+
+
+def main():
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+    minter = TokenMinter(os.environ["JWT_SECRET"])
+
+    def gen_access_token():
+        return auth.gen_access_token(uid=1024)
+
+    def gen_refresh_token():
+        return auth.gen_refresh_token(uid=1024, password_hash=password_hash)
+
+    def mint_refresh_token():
+        return minter.mint_refresh_token(1024, password_hash)
+
+    def mint_login_tokens():
+        return minter.mint_login_tokens(1024, password_hash)
+
+    results = [
+        ("access, pyjwt", bench(gen_access_token)),
+        ("access, minter", bench(lambda: minter.mint_access_token(1024))),
+        ("refresh, pyjwt", bench(gen_refresh_token)),
+        ("refresh, minter", bench(mint_refresh_token)),
+        ("login pair, pyjwt", bench(lambda: (gen_access_token(), gen_refresh_token()))),
+        ("login pair, minter", bench(mint_login_tokens)),
+    ]
+
+    for name, seconds in results:
+        print("{:20} {:10.2f} us".format(name, seconds * 1e6))
+    timings = dict(results)
+    for kind in ["access", "refresh", "login pair"]:
+        print(
+            "{}: {:.1f}x faster".format(
+                kind, timings[kind + ", pyjwt"] / timings[kind + ", minter"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark the validation of signup payloads.
+
+Compares, payload by payload, the validation pipeline of `auth` with the
+eager validation it replaced, reproduced below. The pipeline also rejects
+variants of common passwords, through the n-gram index, which the eager
+validation only looks up exactly.
+
+Run from the repository root with
+
+    PYTHONPATH=src python benchmarks/bench_validation.py
+"""
+import re
+import timeit
+from difflib import SequenceMatcher
+
+import auth
+import blocklist
+
+number = 20000
+
+payloads = [
+    ("valid", "y0u != n00b1e", "Tintin", "tintin@gmail.com"),
+    ("too short", "a5exyMe", "Tintin", "tintin@gmail.com"),
+    ("contains username", "tintin1234", "Tintin", "snowy@gmail.com"),
+    ("common", "bigpimpin1", "Tintin", "tintin@gmail.com"),
+    ("common variant", "b1gpimpin1", "Tintin", "tintin@gmail.com"),
+    ("similar to email", "pypylee1", "Tintin", "pypyleecious@gmail.com"),
+    (
+        "long email",
+        "y0u != n00b1e",
+        "Tintin",
+        "first.middle.last.department.team@mail.example-company.co.uk",
+    ),
+]
+
+
+def legacy_validate_username(name):
+    return all([re.compile(r"^[\w.@+-]+\Z").search(name), len(name) > 4])
+
+
+def legacy_check_password_similarity(password, other):
+    for part in re.split(r"\W+", other) + [other]:
+        if SequenceMatcher(a=password, b=part).quick_ratio() >= 0.7:
+            return False
+    return True
+
+
+def legacy_validate_password(password, username, email):
+    password = password.lower()
+    username = username.lower()
+    email.lower()
+    return all(
+        [
+            len(password) >= 8,
+            len(password) <= 64,
+            password not in username,
+            username not in password,
+            email not in password,
+            password not in email,
+            legacy_check_password_similarity(password, username),
+            legacy_check_password_similarity(password, email),
+            password not in blocklist.get_common_passwords(),
+        ]
+    )
+
+
+def bench(func, *args):
+    seconds = min(timeit.repeat(lambda: func(*args), number=number, repeat=3))
+    return seconds / number
+
+
+def main():
+    # load the common-password indexes up front
+    auth._check_password_commonness("")
+
+    print("{:20} {:>12} {:>12} {:>8}".format("payload", "before", "after", "speedup"))
+    for name, password, username, email in payloads:
+
+        def before():
+            legacy_validate_username(username)
+            legacy_validate_password(password, username, email)
+
+        def after():
+            auth.validate_username(username)
+            auth.check_password(password, username, email)
+
+        before_seconds, after_seconds = bench(before), bench(after)
+        print(
+            "{:20} {:9.2f} us {:9.2f} us {:7.1f}x".format(
+                name,
+                before_seconds * 1e6,
+                after_seconds * 1e6,
+                before_seconds / after_seconds,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Admission control for CPU-bound routes.
+
+Each limited route admits up to `concurrency` requests at a time. Requests
+in excess wait, first come first served, in a queue of at most `queue_size`,
+for no longer than `deadline` seconds. Requests finding the queue full, or
+running out of time in it, are turned away right away with a
+`503 Service Unavailable` and a `Retry-After` header, so that the latency of
+admitted requests stays flat under overload instead of growing without bound.
+
+Limits are keyed by method and route, as in "POST /login/".
+"""
+import asyncio
+import math
+from collections import deque, namedtuple
+
+from aiohttp import web
+
+RouteLimit = namedtuple("RouteLimit", ["concurrency", "queue_size", "deadline"])
+
+
+class RouteGate:
+    """
+    Admission state of a single limited route.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = deque()
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def queue_length(self):
+        return len(self._waiters)
+
+    async def enter(self):
+        """
+        Wait for a slot for a request.
+
+        Return True once it's admitted, False if it should be turned away.
+        """
+        if self.active < self.limit.concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+
+        if len(self._waiters) >= self.limit.queue_size:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.limit.deadline)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            # pass on a slot handed over just as the request was cancelled
+            if waiter.done() and not waiter.cancelled():
+                self.leave()
+            raise
+        finally:
+            # a waiter handed a slot is already out of the queue
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+        self.admitted += 1
+        return True
+
+    def leave(self):
+        """
+        Free the slot of a request, handing it over to the oldest waiter if any.
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            # skip waiters that gave up
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    """
+    Gates of the limited routes of an app.
+    """
+
+    def __init__(self, limits):
+        self.gates = {
+            key: RouteGate(RouteLimit(*limit)) for key, limit in limits.items()
+        }
+
+    def get_gate(self, request):
+        """
+        Return the gate of argument request's route, None if it isn't limited.
+        """
+        route = request.match_info.route
+        if route.resource is None:
+            return None
+        key = "{} {}".format(route.method, route.resource.canonical)
+        return self.gates.get(key)
+
+    @property
+    def stats(self):
+        return {
+            key: {
+                "active": gate.active,
+                "queue_length": gate.queue_length,
+                "admitted": gate.admitted,
+                "rejected": gate.rejected,
+                "timed_out": gate.timed_out,
+            }
+            for key, gate in self.gates.items()
+        }
+
+
+@web.middleware
+async def admission_control_middleware(request, handler):
+    """
+    Admit requests to limited routes as the app's admission controller allows.
+    """
+    controller = request.config_dict.get("ADMISSION")
+    gate = controller and controller.get_gate(request)
+    if gate is None:
+        return await handler(request)
+
+    if not await gate.enter():
+        return web.json_response(
+            {"error": "server is overloaded, try again later"},
+            status=503,
+            reason="Service Unavailable",
+            headers={"Retry-After": str(math.ceil(gate.limit.deadline))},
+        )
+
+    try:
+        return await handler(request)
+    finally:
+        gate.leave()
+
+
+async def manage_admission_control(app):
+    """
+    Initialize an admission controller for argument app.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    app["ADMISSION"] = AdmissionController(app["ADMISSION_LIMITS"])
+    yield
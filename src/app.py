@@ -1,11 +1,40 @@
 from aiohttp import web
 
+import admission
+import authentication
+import blocklist
+import caching
 import config
+import hashing
+import metrics
+import profiling
+import stalls
+import throttling
+import tokens
 
 demo_options = {
-    "CLEANUP_CTX": [config.manage_db_conn],
-    "ON_STARTUP": [config.create_tables],
+    "CLEANUP_CTX": [
+        metrics.manage_metrics,
+        config.manage_db_conn,
+        config.manage_db_writes,
+        config.manage_credentials_loader,
+        config.manage_pwd_hash_loader,
+        hashing.manage_hashing_service,
+        hashing.manage_password_rehashing,
+        caching.manage_credentials_cache,
+        caching.manage_refresh_keys_cache,
+        admission.manage_admission_control,
+        throttling.manage_login_throttling,
+        authentication.manage_token_verification,
+        tokens.manage_token_minter,
+    ],
+    "ON_STARTUP": [config.create_tables, blocklist.load_common_passwords],
     "ROUTER": config.routes,
+    "MIDDLEWARES": [
+        metrics.metrics_middleware,
+        authentication.jwt_authentication_middleware,
+        admission.admission_control_middleware,
+    ],
 }
 
 
@@ -13,10 +42,14 @@ def _init_app(**options):
     """
     Initialize an aiohttp web application.
     """
-    app = web.Application()
+    app = web.Application(middlewares=options.get("MIDDLEWARES") or [])
     app["DEV"] = False
     app["TEST"] = False
 
+    settings = {**config.default_settings, **options.get("SETTINGS", {})}
+    for key, value in settings.items():
+        app[key] = value
+
     if options.get("ROUTER") is not None:
         app.add_routes(options["ROUTER"])
 
@@ -40,10 +73,16 @@ def init_prod_app(**options):
 
 def init_dev_app(**options):
     """
-    Initialize a development app.
+    Initialize a development app, watched for event loop stalls,
+    whose requests may opt in to being profiled.
     """
     app = _init_app(**options)
     app["DEV"] = True
+    # first in, so that it watches the setup and cleanup of the rest
+    app.cleanup_ctx.insert(0, stalls.manage_stall_detection)
+    app.cleanup_ctx.append(profiling.manage_profiles)
+    # outermost, so that profiles take in every other middleware
+    app.middlewares.insert(0, profiling.profiling_middleware)
     return app
 
 
@@ -1,14 +1,16 @@
-import gzip
+import base64
 import hashlib
+import hmac
 import os
 import re
+from collections import Counter
 from datetime import datetime, timedelta
-from difflib import SequenceMatcher
 
 import bcrypt
 import jwt
 
-from config import basedir, token_lifetime
+import blocklist
+from config import token_lifetime
 
 email_username_regex = re.compile(
     r"(^[-!#$%&'*+/=?^_`{}|~0-9A-Z]+(\.[-!#$%&'*+/=?^_`{}|~0-9A-Z]+)*\Z"
@@ -22,6 +24,286 @@ email_domain_regex = re.compile(
 )
 
 
+bcrypt_cost_regex = re.compile(r"\$2[aby]\$(\d\d)\$")
+
+# maps the names of hashing schemes to their hashers, and the identifiers
+# their hashes start with, as in "$2b$...", to the same hashers
+hashers_by_scheme = {}
+hashers_by_identifier = {}
+
+
+def register_hasher(cls):
+    """
+    Register argument class of password hasher under its scheme,
+    and under the identifiers of the hashes it writes.
+    """
+    hashers_by_scheme[cls.scheme] = cls
+    for identifier in cls.identifiers:
+        hashers_by_identifier[identifier] = cls
+    return cls
+
+
+def get_hasher(scheme, **params):
+    """
+    Return a password hasher for argument scheme, with argument parameters.
+    """
+    try:
+        cls = hashers_by_scheme[scheme]
+    except KeyError:
+        raise ValueError("unknown hashing scheme: {!r}".format(scheme)) from None
+    return cls(**params)
+
+
+def _get_hash_identifier(hash):
+    return hash[1:].partition("$")[0] if hash.startswith("$") else None
+
+
+def identify_hash(hash):
+    """
+    Return the class of password hasher that wrote argument hash,
+    None if it isn't a well-formed hash of a registered scheme,
+    at parameters within the bounds the scheme can be computed at.
+    """
+    cls = hashers_by_identifier.get(_get_hash_identifier(hash))
+    if cls is None or cls.parse_params(hash) is None:
+        return None
+    return cls
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _is_b64(text):
+    # no number of unpadded base64 characters leaves a single one over
+    return len(text) % 4 != 1
+
+
+# the largest memory budget, in bytes, hashlib takes for scrypt
+max_scrypt_memory = 2 ** 31 - 1
+
+
+@register_hasher
+class BcryptHasher:
+    """
+    Hash passwords with bcrypt, at argument work factor.
+    """
+
+    scheme = "bcrypt"
+    identifiers = ("2a", "2b", "2y")
+    # hashes as written by `get_password_hash`, and by other bcrypt libraries
+    hash_regex = re.compile(r"\$2[aby]\$(0[4-9]|[12][0-9]|3[01])\$[./A-Za-z0-9]{53}\Z")
+
+    def __init__(self, workfactor=13):
+        self.workfactor = workfactor
+
+    @property
+    def params(self):
+        return {"workfactor": self.workfactor}
+
+    def hash(self, plaintext):
+        return get_password_hash(plaintext, self.workfactor)
+
+    @classmethod
+    def parse_params(cls, hash):
+        """
+        Return the parameters of argument hash, None if it isn't well-formed.
+        """
+        match = cls.hash_regex.match(hash)
+        return None if match is None else {"workfactor": int(match.group(1))}
+
+    @staticmethod
+    def get_work(params):
+        """
+        Return the work of a hash at argument parameters,
+        in units comparable between hashes of the scheme.
+        """
+        return 2 ** params["workfactor"]
+
+    def verify(self, plaintext, hash):
+        if self.parse_params(hash) is None:
+            return False
+        return bcrypt.checkpw(plaintext.encode("utf-8"), hash.encode("utf-8"))
+
+    def needs_rehash(self, hash):
+        # hashes at a higher cost are kept, lest a calibration that came out
+        # lower than the last one downgrade them
+        workfactor = get_hash_workfactor(hash)
+        return workfactor is None or workfactor < self.workfactor
+
+
+@register_hasher
+class ScryptHasher:
+    """
+    Hash passwords with scrypt, at argument cost n, a power of 2, block size r,
+    and parallelization p. Each hash takes up about 128 * r * n bytes.
+
+    Hashes read "$scrypt$ln=<log2 of n>,r=<r>,p=<p>$<salt>$<key>",
+    with salt and key in unpadded base64.
+    """
+
+    scheme = "scrypt"
+    identifiers = ("scrypt",)
+    # bounds of the parameters of hashes verified, well past any in use
+    max_r = 32
+    max_p = 16
+    hash_regex = re.compile(
+        r"\$scrypt\$ln=(\d{1,2}),r=(\d{1,3}),p=(\d{1,3})"
+        r"\$([A-Za-z0-9+/]+)\$([A-Za-z0-9+/]+)\Z"
+    )
+
+    def __init__(self, n=2 ** 14, r=8, p=1, salt_size=16, key_size=32):
+        if n < 2 or n & (n - 1):
+            raise ValueError("n must be a power of 2 greater than 1")
+        self.n = n
+        self.r = r
+        self.p = p
+        self.salt_size = salt_size
+        self.key_size = key_size
+
+    @property
+    def params(self):
+        return {"n": self.n, "r": self.r, "p": self.p}
+
+    @staticmethod
+    def _get_maxmem(n, r, p):
+        # scrypt turns down any work past maxmem, 32MiB by default
+        return 128 * r * (n + 2 * p) + 2 ** 20
+
+    @classmethod
+    def parse_params(cls, hash):
+        """
+        Return the parameters of argument hash, None if it isn't well-formed,
+        is at parameters out of bounds, or takes more memory than scrypt
+        can be given.
+        """
+        match = cls.hash_regex.match(hash)
+        if match is None or not all(map(_is_b64, match.group(4, 5))):
+            return None
+        ln, r, p = (int(group) for group in match.group(1, 2, 3))
+        # n must also fall short of 2 ** (16 * r)
+        if not (1 <= r <= cls.max_r and 1 <= p <= cls.max_p and 1 <= ln < 16 * r):
+            return None
+        if cls._get_maxmem(2 ** ln, r, p) > max_scrypt_memory:
+            return None
+        return {"n": 2 ** ln, "r": r, "p": p}
+
+    @staticmethod
+    def get_work(params):
+        """
+        Return the work of a hash at argument parameters,
+        in units comparable between hashes of the scheme.
+        """
+        return params["n"] * params["r"] * params["p"]
+
+    @classmethod
+    def _derive(cls, plaintext, salt, n, r, p, key_size):
+        return hashlib.scrypt(
+            plaintext.encode("utf-8"),
+            salt=salt,
+            n=n,
+            r=r,
+            p=p,
+            maxmem=cls._get_maxmem(n, r, p),
+            dklen=key_size,
+        )
+
+    def hash(self, plaintext):
+        salt = os.urandom(self.salt_size)
+        key = self._derive(plaintext, salt, self.n, self.r, self.p, self.key_size)
+        return "$scrypt$ln={},r={},p={}${}${}".format(
+            self.n.bit_length() - 1, self.r, self.p, _b64encode(salt), _b64encode(key)
+        )
+
+    def verify(self, plaintext, hash):
+        params = self.parse_params(hash)
+        if params is None:
+            return False
+        match = self.hash_regex.match(hash)
+        salt, key = _b64decode(match.group(4)), _b64decode(match.group(5))
+        return hmac.compare_digest(
+            self._derive(plaintext, salt, key_size=len(key), **params), key
+        )
+
+    def needs_rehash(self, hash):
+        return self.parse_params(hash) != self.params
+
+
+@register_hasher
+class PBKDF2Hasher:
+    """
+    Hash passwords with PBKDF2-HMAC-SHA256, at argument number of iterations.
+
+    Hashes read "$pbkdf2-sha256$i=<iterations>$<salt>$<key>",
+    with salt and key in unpadded base64.
+    """
+
+    scheme = "pbkdf2-sha256"
+    identifiers = ("pbkdf2-sha256",)
+    # bound of the iterations of hashes verified, well past any in use
+    max_iterations = 10 ** 8
+    hash_regex = re.compile(
+        r"\$pbkdf2-sha256\$i=(\d{1,10})\$([A-Za-z0-9+/]+)\$([A-Za-z0-9+/]+)\Z"
+    )
+
+    def __init__(self, iterations=600000, salt_size=16):
+        self.iterations = iterations
+        self.salt_size = salt_size
+
+    @property
+    def params(self):
+        return {"iterations": self.iterations}
+
+    def hash(self, plaintext):
+        salt = os.urandom(self.salt_size)
+        key = hashlib.pbkdf2_hmac(
+            "sha256", plaintext.encode("utf-8"), salt, self.iterations
+        )
+        return "$pbkdf2-sha256$i={}${}${}".format(
+            self.iterations, _b64encode(salt), _b64encode(key)
+        )
+
+    @classmethod
+    def parse_params(cls, hash):
+        """
+        Return the parameters of argument hash, None if it isn't well-formed,
+        or its iterations are out of bounds.
+        """
+        match = cls.hash_regex.match(hash)
+        if match is None or not all(map(_is_b64, match.group(2, 3))):
+            return None
+        iterations = int(match.group(1))
+        if not 1 <= iterations <= cls.max_iterations:
+            return None
+        return {"iterations": iterations}
+
+    @staticmethod
+    def get_work(params):
+        """
+        Return the work of a hash at argument parameters,
+        in units comparable between hashes of the scheme.
+        """
+        return params["iterations"]
+
+    def verify(self, plaintext, hash):
+        params = self.parse_params(hash)
+        if params is None:
+            return False
+        match = self.hash_regex.match(hash)
+        salt, key = _b64decode(match.group(2)), _b64decode(match.group(3))
+        derived_key = hashlib.pbkdf2_hmac(
+            "sha256", plaintext.encode("utf-8"), salt, params["iterations"], len(key)
+        )
+        return hmac.compare_digest(derived_key, key)
+
+    def needs_rehash(self, hash):
+        return self.parse_params(hash) != self.params
+
+
 def get_password_hash(plaintext, workfactor=13):
     byte_encoded_plaintext = plaintext.encode("utf-8")
     byte_encoded_hash = bcrypt.hashpw(
@@ -30,31 +312,145 @@ def get_password_hash(plaintext, workfactor=13):
     return byte_encoded_hash.decode("utf-8")
 
 
+def get_hash_workfactor(hash):
+    """
+    Return the work factor of a bcrypt hash, None if it isn't one.
+    """
+    match = bcrypt_cost_regex.match(hash)
+    return int(match.group(1)) if match else None
+
+
 def check_password_hash(plaintext, hash):
-    byte_encoded_plaintext = plaintext.encode("utf-8")
-    byte_encoded_hash = hash.encode("utf-8")
-    return bcrypt.checkpw(byte_encoded_plaintext, byte_encoded_hash)
+    """
+    Return True if argument plaintext checks out with argument hash,
+    whichever of the registered schemes it's of.
+
+    Hashes of no registered scheme, malformed, or at parameters out of bounds,
+    check out with no plaintext.
+    """
+    cls = identify_hash(hash)
+    if cls is None:
+        return False
+    return cls().verify(plaintext, hash)
+
+
+username_regex = re.compile(r"^[\w.@+-]+\Z")
+
+email_separator_regex = re.compile(r"\W+")
 
 
 def validate_username(name):
-    return all([re.compile(r"^[\w.@+-]+\Z").search(name), len(name) > 4])
+    return len(name) > 4 and username_regex.search(name) is not None
 
 
 def _check_password_similarity(password, other):
-    for part in re.split(r"\W+", other) + [other]:
-        if SequenceMatcher(a=password, b=part).quick_ratio() >= 0.7:
+    """
+    Return True if password is not strongly similar to other, nor to any of
+    its word fragments.
+
+    Similarity is the quick ratio of `difflib.SequenceMatcher`: twice the
+    number of characters two strings have in common, counted with
+    multiplicity, over their total length. It's counted straight from the
+    characters, skipping fragments whose lengths alone bound the ratio below
+    the threshold, and stopping as soon as the threshold is reached or out
+    of reach.
+    """
+    password_counts = None
+    for part in email_separator_regex.split(other) + [other]:
+        total = len(password) + len(part)
+        if not total:
+            # two empty strings are as alike as can be
             return False
+        # the ratio can't exceed what the shorter string allows
+        if 2.0 * min(len(password), len(part)) / total < 0.7:
+            continue
+
+        if password_counts is None:
+            password_counts = Counter(password)
+        available = dict(password_counts)
+        common = 0
+        remaining = len(part)
+        for char in part:
+            remaining -= 1
+            if available.get(char, 0) > 0:
+                available[char] -= 1
+                common += 1
+                if 2.0 * common / total >= 0.7:
+                    return False
+            elif 2.0 * (common + remaining) / total < 0.7:
+                break
     return True
 
 
+# number of edits a password must be away from every common password
+common_password_min_distance = 2
+
+
 def _check_password_commonness(password):
-    with gzip.open(
-        basedir.joinpath("common-passwords.txt.gz"), "rt", encoding="utf-8"
-    ) as file:
-        for line in file:
-            if password == line.strip():
-                return False
-    return True
+    return password not in blocklist.get_common_passwords()
+
+
+def _check_password_likeness_to_common(password):
+    return (
+        blocklist.get_common_password_ngrams().find_within(
+            password, max_distance=common_password_min_distance - 1
+        )
+        is None
+    )
+
+
+# rules a password must abide by, by name, from the cheapest to check to
+# the most expensive, each checked on the lowercased password, username
+# and email
+password_rules = [
+    ("too_short", lambda password, username, email: len(password) >= 8),
+    ("too_long", lambda password, username, email: len(password) <= 64),
+    (
+        "contains_username",
+        lambda password, username, email: (
+            password not in username and username not in password
+        ),
+    ),
+    (
+        "contains_email",
+        lambda password, username, email: (
+            email not in password and password not in email
+        ),
+    ),
+    ("common", lambda password, username, email: _check_password_commonness(password)),
+    (
+        "similar_to_username",
+        lambda password, username, email: _check_password_similarity(
+            password, username
+        ),
+    ),
+    (
+        "similar_to_email",
+        lambda password, username, email: _check_password_similarity(password, email),
+    ),
+    (
+        "similar_to_common",
+        lambda password, username, email: _check_password_likeness_to_common(
+            password
+        ),
+    ),
+]
+
+
+def check_password(password, username, email):
+    """
+    Check a password against a username and an email.
+
+    Return the name of the first rule the password breaks,
+    None if it breaks none.
+    """
+    password = password.lower()
+    username = username.lower()
+    email = email.lower()
+    for name, rule in password_rules:
+        if not rule(password, username, email):
+            return name
+    return None
 
 
 def validate_password(password, username, email):
@@ -63,22 +459,7 @@ def validate_password(password, username, email):
 
     Return True if password is not strongly similar to either of the rest.
     """
-    password = password.lower()
-    username = username.lower()
-    email.lower()
-    return all(
-        [
-            len(password) >= 8,
-            len(password) <= 64,
-            password not in username,
-            username not in password,
-            email not in password,
-            password not in email,
-            _check_password_similarity(password, username),
-            _check_password_similarity(password, email),
-            _check_password_commonness(password),
-        ]
-    )
+    return check_password(password, username, email) is None
 
 
 def validate_email(email):
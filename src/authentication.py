@@ -0,0 +1,144 @@
+import functools
+import os
+import time
+
+import jwt
+from aiohttp import web
+
+from caching import TTLCache
+
+
+def verify_access_token(token, secret):
+    """
+    Return the claims of an access token, having checked its signature,
+    its expiry and its type.
+
+    Raise `jwt.InvalidTokenError` if the token doesn't check out.
+    """
+    claims = jwt.decode(token, secret, algorithms=["HS256"])
+    if claims.get("type") != "access" or "uid" not in claims or "exp" not in claims:
+        raise jwt.InvalidTokenError("not an access token")
+    return claims
+
+
+def verify_refresh_token(token, secret):
+    """
+    Return the claims of a refresh token, having checked its signature
+    and its type.
+
+    Raise `jwt.InvalidTokenError` if the token doesn't check out.
+    """
+    claims = jwt.decode(token, secret, algorithms=["HS256"])
+    if claims.get("type") != "refresh" or "uid" not in claims or "key" not in claims:
+        raise jwt.InvalidTokenError("not a refresh token")
+    return claims
+
+
+def _unauthorized(error):
+    return web.json_response(
+        {"error": error},
+        status=401,
+        reason="Unauthorized",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def authentication_required(handler):
+    """
+    Turn away requests to argument handler bearing no access token.
+    """
+
+    @functools.wraps(handler)
+    async def _handler(request):
+        if request.get("uid") is None:
+            return _unauthorized(request.get("auth_error", "authentication required"))
+        return await handler(request)
+
+    return _handler
+
+
+async def is_admin(request, uid):
+    """
+    Return True if the user with argument uid is an admin.
+    """
+    async with request.config_dict["DB_POOL"].reader() as conn:
+        cursor = await conn.execute(
+            request.config_dict["STMTS"]["users_select_is_admin"], [uid]
+        )
+        row = await cursor.fetchone()
+        await cursor.close()
+    return bool(row and row["is_admin"])
+
+
+def admin_required(handler):
+    """
+    Turn away requests to argument handler but those of admins.
+    """
+
+    @functools.wraps(handler)
+    async def _handler(request):
+        uid = request.get("uid")
+        if uid is None:
+            return _unauthorized(request.get("auth_error", "authentication required"))
+        if not await is_admin(request, uid):
+            return web.json_response(
+                {"error": "admin required"}, status=403, reason="Forbidden"
+            )
+        return await handler(request)
+
+    return _handler
+
+
+@web.middleware
+async def jwt_authentication_middleware(request, handler):
+    """
+    Authenticate requests bearing an access token.
+
+    The uid of the authenticated user is attached to the request as
+    `request["uid"]`, which is None for requests bearing no token, or a token
+    which doesn't check out. Those are served as anonymous requests, so that
+    clients with an expired token can still reach the routes open to anyone,
+    such as the one refreshing tokens, and are turned away from the others
+    by `authentication_required`, with the reason as `request["auth_error"]`.
+    """
+    request["uid"] = None
+
+    header = request.headers.get("Authorization")
+    if header is None:
+        return await handler(request)
+
+    scheme, _, token = header.partition(" ")
+    if scheme != "Bearer" or not token:
+        request["auth_error"] = "malformed authorization header"
+        return await handler(request)
+
+    # tokens verified once are trusted until they expire,
+    # sparing hot clients the decoding and signature check
+    cache = request.config_dict["VERIFIED_TOKENS"]
+    uid = cache.get(token)
+    if uid is None:
+        try:
+            claims = verify_access_token(token, request.config_dict["JWT_SECRET"])
+        except jwt.InvalidTokenError:
+            request["auth_error"] = "invalid access token"
+            return await handler(request)
+        uid = claims["uid"]
+        cache.set(token, uid, expires_at=claims["exp"])
+
+    request["uid"] = uid
+    return await handler(request)
+
+
+async def manage_token_verification(app):
+    """
+    Read the secret signing tokens for argument app once, and initialize
+    a cache of verified access tokens.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    app["JWT_SECRET"] = os.getenv("JWT_SECRET")
+    # entries expire at the tokens' own expiry, which is wall clock time
+    cache = TTLCache(maxsize=app["VERIFIED_TOKENS_CACHE_MAXSIZE"], clock=time.time)
+    app["VERIFIED_TOKENS"] = cache
+    yield
+    cache.clear()
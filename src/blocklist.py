@@ -0,0 +1,361 @@
+"""
+Compact, memory-mapped index over the list of common passwords.
+
+The gzipped list is turned, once, into an index file of sorted fixed-width
+records which is mapped into memory and binary searched. Nothing is parsed
+at startup, and every worker process mapping the same file shares its pages.
+
+Passwords a few edits away from a common one are found through a second,
+n-gram index file, mapped into memory likewise.
+
+Build both indexes ahead of deployment with
+
+    python blocklist.py [SOURCE] [TARGET]
+
+which writes the n-gram index next to TARGET, with the suffix ".ngrams".
+"""
+import bisect
+import gzip
+import mmap
+import sys
+import tempfile
+import zlib
+from array import array
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+
+from config import basedir
+
+default_source_path = basedir.joinpath("common-passwords.txt.gz")
+default_index_path = basedir.joinpath("common-passwords.idx")
+default_ngram_index_path = default_index_path.with_suffix(".ngrams")
+
+# an index file starts with a line "<magic> <version> <width> <count>",
+# followed by <count> sorted records of <width> bytes each, padded with NULs
+index_magic = b"QPWIDX"
+index_version = 1
+
+
+def build_index(source_path=default_source_path, index_path=default_index_path):
+    """
+    Build an index file from a gzipped list of passwords, one per line.
+
+    Return the number of passwords in the index.
+    """
+    with gzip.open(str(source_path), "rt", encoding="utf-8") as file:
+        words = sorted({line.strip().encode("utf-8") for line in file} - {b""})
+
+    width = max((len(word) for word in words), default=1)
+    header = b"%s %d %d %d\n" % (index_magic, index_version, width, len(words))
+    _write_atomically(
+        index_path, [header] + [word.ljust(width, b"\0") for word in words]
+    )
+    return len(words)
+
+
+def _write_atomically(path, chunks):
+    # write to a scratch file of its own first, so that readers never map
+    # a half-written index, even with several processes building at once
+    with tempfile.NamedTemporaryFile(
+        dir=str(path.parent), prefix=path.name, delete=False
+    ) as file:
+        scratch_path = Path(file.name)
+        try:
+            for chunk in chunks:
+                file.write(chunk)
+        except BaseException:
+            scratch_path.unlink()
+            raise
+    # scratch files are private to their owner, the index is not
+    scratch_path.chmod(0o644)
+    scratch_path.replace(path)
+
+
+class PasswordBlocklist:
+    """
+    Read-only set of passwords backed by a memory-mapped index file.
+    """
+
+    def __init__(self, index_path):
+        with open(str(index_path), "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header_end = self._mmap.find(b"\n") + 1
+        magic, version, width, count = self._mmap[:header_end].split()
+        if magic != index_magic or int(version) != index_version:
+            raise ValueError("{} is not a password index".format(index_path))
+
+        self._offset = header_end
+        self._width = int(width)
+        self._count = int(count)
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, position):
+        start = self._offset + position * self._width
+        return self._mmap[start:start + self._width]
+
+    def __getitem__(self, position):
+        """
+        Return the password at argument position, in sorted order.
+        """
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        return self._record(position).rstrip(b"\0").decode("utf-8")
+
+    def __contains__(self, password):
+        key = password.encode("utf-8")
+        if len(key) > self._width:
+            return False
+        key = key.ljust(self._width, b"\0")
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            record = self._record(middle)
+            if record < key:
+                low = middle + 1
+            elif record > key:
+                high = middle
+            else:
+                return True
+        return False
+
+    def close(self):
+        self._mmap.close()
+
+
+# an n-gram index file starts with a line
+# "<magic> <version> <n> <keys> <postings> <words>", padded to 8 bytes,
+# followed by arrays of native unsigned 32-bit integers: the sorted keys,
+# each the hash of an n-gram and of the length of the passwords holding it,
+# the offsets of their postings, and the postings, which are positions
+# of passwords in the index
+ngram_index_magic = b"QPWNGR"
+ngram_index_version = 1
+ngram_size = 2
+
+
+def _get_ngrams(password, n=ngram_size):
+    """
+    Return the set of n-grams of argument password, encoded, padded so that
+    its first and last characters make n-grams of their own.
+    """
+    padded = "\x02" * (n - 1) + password + "\x03" * (n - 1)
+    return {padded[i:i + n].encode("utf-8") for i in range(len(padded) - n + 1)}
+
+
+def _get_ngram_key(gram, length):
+    return zlib.crc32(b"%d:%s" % (length, gram))
+
+
+def get_edit_distance(a, b):
+    """
+    Return the Levenshtein distance between arguments a and b.
+
+    Runs the bit-parallel algorithm of Myers, a column of the dynamic
+    programming matrix at a time.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return len(a)
+
+    masks = {}
+    for i, char in enumerate(b):
+        masks[char] = masks.get(char, 0) | 1 << i
+    full = (1 << len(b)) - 1
+    last = 1 << (len(b) - 1)
+
+    positive, negative, distance = full, 0, len(b)
+    for char in a:
+        eq = masks.get(char, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        hp = negative | (~(xh | positive) & full)
+        hn = positive & xh
+        if hp & last:
+            distance += 1
+        elif hn & last:
+            distance -= 1
+        hp = (hp << 1 | 1) & full
+        hn = (hn << 1) & full
+        positive = hn | (~(xv | hp) & full)
+        negative = hp & xv
+    return distance
+
+
+def build_ngram_index(passwords, ngram_index_path=default_ngram_index_path):
+    """
+    Build an n-gram index file over argument passwords, a `PasswordBlocklist`.
+
+    Return the number of keys in the index.
+    """
+    postings = {}
+    for position in range(len(passwords)):
+        password = passwords[position]
+        for gram in _get_ngrams(password):
+            key = _get_ngram_key(gram, len(password))
+            postings.setdefault(key, array("I")).append(position)
+
+    keys = array("I", sorted(postings))
+    offsets = array("I", [0])
+    for key in keys:
+        offsets.append(offsets[-1] + len(postings[key]))
+
+    header = b"%s %d %d %d %d %d" % (
+        ngram_index_magic,
+        ngram_index_version,
+        ngram_size,
+        len(keys),
+        offsets[-1],
+        len(passwords),
+    )
+    # pad the header so that the arrays after it are aligned
+    header = header.ljust(-(-(len(header) + 1) // 8) * 8 - 1) + b"\n"
+    _write_atomically(
+        ngram_index_path,
+        [header, keys.tobytes(), offsets.tobytes()]
+        + [postings[key].tobytes() for key in keys],
+    )
+    return len(keys)
+
+
+class NgramIndex:
+    """
+    Finds the passwords of a `PasswordBlocklist` within a few edits of
+    a password, through a memory-mapped n-gram index file.
+
+    Postings are keyed by n-gram and by password length, so that only the
+    passwords of lengths within reach are ever looked at. A password within
+    k edits of another shares all but at most k * n of its distinct n-grams
+    with it, so only the passwords holding enough of them are checked for
+    their edit distance.
+    """
+
+    def __init__(self, ngram_index_path, passwords):
+        with open(str(ngram_index_path), "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header_end = self._mmap.find(b"\n") + 1
+        magic, version, n, keys, postings, words = self._mmap[:header_end].split()
+        if magic != ngram_index_magic or int(version) != ngram_index_version:
+            raise ValueError("{} is not an n-gram index".format(ngram_index_path))
+        if int(words) != len(passwords):
+            raise ValueError("{} indexes other passwords".format(ngram_index_path))
+
+        self.n = int(n)
+        self.passwords = passwords
+        keys, postings = int(keys), int(postings)
+
+        view = memoryview(self._mmap)
+        itemsize = array("I").itemsize
+        start = header_end
+        self._keys = view[start:start + keys * itemsize].cast("I")
+        start += keys * itemsize
+        self._offsets = view[start:start + (keys + 1) * itemsize].cast("I")
+        start += (keys + 1) * itemsize
+        self._postings = view[start:start + postings * itemsize].cast("I")
+
+    def _get_postings(self, key):
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return ()
+        return self._postings[self._offsets[i]:self._offsets[i + 1]]
+
+    def find_within(self, password, max_distance=1):
+        """
+        Return a password of the blocklist within argument max_distance edits
+        of argument password, None if there's none.
+        """
+        grams = _get_ngrams(password, self.n)
+        needed = len(grams) - max_distance * self.n
+
+        for length in range(
+            max(len(password) - max_distance, 0), len(password) + max_distance + 1
+        ):
+            counts = Counter()
+            for gram in grams:
+                counts.update(self._get_postings(_get_ngram_key(gram, length)))
+
+            for position, count in counts.items():
+                if count < needed:
+                    continue
+                candidate = self.passwords[position]
+                if get_edit_distance(password, candidate) <= max_distance:
+                    return candidate
+
+            if needed <= 0:
+                # passwords sharing no n-gram at all may be within reach too
+                for position in range(len(self.passwords)):
+                    candidate = self.passwords[position]
+                    if position not in counts and len(candidate) == length:
+                        if get_edit_distance(password, candidate) <= max_distance:
+                            return candidate
+        return None
+
+    def close(self):
+        self._keys.release()
+        self._offsets.release()
+        self._postings.release()
+        self._mmap.close()
+
+
+def _index_is_stale(source_path, index_path):
+    return (
+        not index_path.exists()
+        or index_path.stat().st_mtime < source_path.stat().st_mtime
+    )
+
+
+@lru_cache(maxsize=None)
+def get_common_passwords():
+    """
+    Return the blocklist of common passwords, shared across the process.
+
+    The index is built on the fly if it is missing or older than the list.
+    """
+    if _index_is_stale(default_source_path, default_index_path):
+        build_index()
+    return PasswordBlocklist(default_index_path)
+
+
+@lru_cache(maxsize=None)
+def get_common_password_ngrams():
+    """
+    Return the n-gram index over the blocklist of common passwords, shared
+    across the process.
+
+    The index is built on the fly if it is missing or older than the blocklist.
+    """
+    passwords = get_common_passwords()
+    if _index_is_stale(default_index_path, default_ngram_index_path):
+        build_ngram_index(passwords)
+    return NgramIndex(default_ngram_index_path, passwords)
+
+
+async def load_common_passwords(app):
+    """
+    Load the blocklist of common passwords, and its n-gram index, at the
+    beginning of app's lifecycle, so that the first signup doesn't pay for them.
+    Useful as a subscriber to app's on_startup signal.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.on_startup
+    """
+    get_common_passwords()
+    get_common_password_ngrams()
+
+
+if __name__ == "__main__":
+    source_path = Path(sys.argv[1]) if len(sys.argv) > 1 else default_source_path
+    index_path = Path(sys.argv[2]) if len(sys.argv) > 2 else default_index_path
+    count = build_index(source_path, index_path)
+    print("indexed {} passwords into {}".format(count, index_path))
+
+    ngram_index_path = index_path.with_suffix(".ngrams")
+    passwords = PasswordBlocklist(index_path)
+    count = build_ngram_index(passwords, ngram_index_path)
+    passwords.close()
+    print("indexed {} n-grams into {}".format(count, ngram_index_path))
@@ -0,0 +1,124 @@
+import time
+from collections import OrderedDict
+
+# marks a key cached as known to have no value
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded mapping with least-recently-used eviction and per-entry expiry.
+
+    Entries expire `ttl` seconds after they are set, or at the deadline given
+    to `set`. Once `maxsize` entries are held, setting a new one evicts the
+    least recently used.
+
+    A key can be cached as known to have no value by setting it to `MISSING`,
+    so that lookups of nonexistent things are answered from the cache too.
+
+    Every invalidation bumps the cache's `generation`. A value looked up
+    elsewhere while an invalidation happened may be stale, so `set` drops
+    it when handed the generation read before the lookup began.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        # maps keys to pairs of value and expiry time, least recently used first
+        self._entries = OrderedDict()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Return the value cached for argument key, `MISSING` if it's cached as
+        having none, or argument default if it isn't cached at all.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, expires_at = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, expires_at=None, generation=None):
+        """
+        Cache value for argument key, until argument expires_at if given,
+        for the cache's ttl otherwise.
+
+        Do nothing if argument generation is given and the cache has been
+        invalidated since.
+        """
+        if generation is not None and generation != self.generation:
+            return
+
+        if expires_at is None:
+            expires_at = self._clock() + self.ttl
+
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self.generation += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.generation += 1
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+async def manage_credentials_cache(app):
+    """
+    Initialize a cache of user credentials for argument app, keyed by email.
+    Clear it at end of app's lifecycle.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    cache = TTLCache(
+        maxsize=app["CREDENTIALS_CACHE_MAXSIZE"], ttl=app["CREDENTIALS_CACHE_TTL"]
+    )
+    app["CREDENTIALS_CACHE"] = cache
+    yield
+    cache.clear()
+
+
+async def manage_refresh_keys_cache(app):
+    """
+    Initialize a cache of the refresh keys of users for argument app, keyed by uid.
+    Clear it at end of app's lifecycle.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    cache = TTLCache(
+        maxsize=app["REFRESH_KEYS_CACHE_MAXSIZE"], ttl=app["REFRESH_KEYS_CACHE_TTL"]
+    )
+    app["REFRESH_KEYS_CACHE"] = cache
+    yield
+    cache.clear()
@@ -0,0 +1,101 @@
+import asyncio
+
+
+class BatchLoader:
+    """
+    Load values by key, coalescing concurrent loads.
+
+    Loads of a key already being loaded await the load in flight, rather than
+    starting their own. Loads of distinct keys requested within `window`
+    seconds of one another, up to `max_batch_size` of them, are handed
+    together to `load_many`, a coroutine function taking a list of keys and
+    returning a mapping of the keys found to their values.
+
+    ```
+    loader = BatchLoader(load_many)
+    value = await loader.load(key)  # None if load_many didn't find key
+    ```
+
+    A load in flight is shared by every caller asking for its key until it
+    completes. Call `forget` on a key whose value changed, so that callers
+    coming after the change start a load of their own.
+    """
+
+    def __init__(self, load_many, window=0.001, max_batch_size=100):
+        self.load_many = load_many
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        # maps keys to the futures of their loads in flight
+        self._in_flight = {}
+        self._pending = []
+        self._timer = None
+        self._batches_in_flight = set()
+
+        self.loads = 0
+        self.coalesced = 0
+        self.batches = 0
+
+    async def load(self, key):
+        self.loads += 1
+        future = self._in_flight.get(key)
+
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            self._in_flight[key] = future
+            self._pending.append((key, future))
+
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+
+        # one caller giving up mustn't cancel the load for the others
+        return await asyncio.shield(future)
+
+    def forget(self, key):
+        """
+        Stop handing argument key's load in flight to new callers.
+        """
+        self._in_flight.pop(key, None)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            load = asyncio.ensure_future(self._load(batch))
+            self._batches_in_flight.add(load)
+            load.add_done_callback(self._batches_in_flight.discard)
+
+    async def _load(self, batch):
+        keys = [key for key, _ in batch]
+        futures = [future for _, future in batch]
+        self.batches += 1
+        try:
+            values = await self.load_many(keys)
+        except Exception as exc:
+            for future in futures:
+                future.set_exception(exc)
+                # mark the exception retrieved, even if no caller awaits it
+                future.exception()
+        else:
+            for key, future in zip(keys, futures):
+                future.set_result(values.get(key))
+        finally:
+            for key, future in zip(keys, futures):
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+
+    async def close(self):
+        """
+        Start pending loads, and wait for loads in flight.
+        """
+        self._flush()
+        if self._batches_in_flight:
+            await asyncio.wait(list(self._batches_in_flight))
@@ -4,51 +4,261 @@ import aiosqlite
 from aiohttp import web
 from dotenv import load_dotenv
 
-from db import stmts
+from coalescing import BatchLoader
+from db import migrations, pragmas, stmts
+from db.batching import WriteBatcher
+from db.pool import ConnectionPool
 from db.utils import get_db_path
 
 basedir = Path(__file__).absolute().parent
 routes = web.RouteTableDef()
 token_lifetime = 15 * 60
 
+# settings every app starts out with,
+# override any of them through the SETTINGS option of `app._init_app`
+default_settings = {
+    # None means one worker per core
+    "HASHER_MAX_WORKERS": None,
+    # either "thread" or "process"
+    "HASHER_EXECUTOR": "thread",
+    # scheme of new hashes, any registered in `auth`, users are moved over
+    # to it as they log in, and its parameters, by scheme
+    "HASHER_SCHEME": "bcrypt",
+    "HASHER_PARAMS": {
+        "scrypt": {"n": 2 ** 14, "r": 8, "p": 1},
+        "pbkdf2-sha256": {"iterations": 600000},
+    },
+    # bcrypt work factor of new hashes, None to calibrate it at startup
+    # to the highest within range whose hashes fit the time budget, in seconds
+    "HASHER_WORKFACTOR": None,
+    "HASHER_WORKFACTOR_RANGE": (10, 16),
+    "HASHER_TIME_BUDGET": 0.5,
+    # number of passwords rehashed to the current scheme at once at most
+    "REHASH_MAX_BACKLOG": 1000,
+    # seconds the event loop of development and test apps may go without
+    # yielding before it's reported stalled, and seconds between samples
+    # of the stack of a stalled loop
+    "STALL_THRESHOLD": 0.1,
+    "STALL_SAMPLE_INTERVAL": 0.01,
+    # number of the latest request profiles development and test apps keep
+    "PROFILES_MAXLEN": 20,
+    # whether apps record metrics, and expose them on /metrics
+    "METRICS_ENABLED": True,
+    # whether apps apply pending migrations at startup, turned off where
+    # a launcher applies them once for all its workers
+    "DB_MIGRATE_ON_STARTUP": True,
+    # number of read-only connections next to the single writer connection
+    "DB_POOL_READERS": 4,
+    # seconds to wait for a connection before giving up
+    "DB_POOL_ACQUIRE_TIMEOUT": 5.0,
+    # seconds a connection may sit idle before being checked on next use
+    "DB_POOL_HEALTH_CHECK_INTERVAL": 30.0,
+    # seconds to gather concurrent writes for, before committing them together
+    "DB_WRITE_BATCH_WINDOW": 0.002,
+    # number of gathered writes that triggers a commit without waiting further
+    "DB_WRITE_BATCH_MAX_SIZE": 64,
+    # name of the pragma profile tuning every database connection,
+    # one of "prod", "dev" and "test", None to go with the app's kind
+    "DB_PROFILE": None,
+    # number of emails whose credentials, or lack thereof, are kept in memory
+    "CREDENTIALS_CACHE_MAXSIZE": 10000,
+    # seconds cached credentials are trusted for
+    "CREDENTIALS_CACHE_TTL": 60.0,
+    # seconds to gather lookups of distinct emails for, before querying them together
+    "CREDENTIALS_BATCH_WINDOW": 0.001,
+    # number of gathered lookups that triggers a query without waiting further
+    "CREDENTIALS_BATCH_MAX_SIZE": 100,
+    # maps routes to their admission limits, as triples of the number of
+    # requests served at once, the number of requests allowed to wait and
+    # the number of seconds they may wait for
+    "ADMISSION_LIMITS": {
+        "POST /users/": (16, 64, 2.0),
+        "POST /login/": (16, 64, 2.0),
+        # a single import at a time, hogging the hasher as it does
+        "POST /users/import/": (1, 0, 30.0),
+    },
+    # login attempts allowed per client address and per email, as pairs of
+    # the number of attempts per second and the number allowed in a burst,
+    # successful attempts are not counted
+    "LOGIN_THROTTLE_CLIENT_RATE": (1.0, 20),
+    "LOGIN_THROTTLE_EMAIL_RATE": (0.1, 5),
+    # number of keys each limiter keeps track of at most
+    "LOGIN_THROTTLE_MAX_KEYS": 1000000,
+    # seconds between sweeps of the keys limiters need not keep track of
+    "LOGIN_THROTTLE_SWEEP_INTERVAL": 60.0,
+    # number of users whose refresh keys, or lack thereof, are kept in memory
+    "REFRESH_KEYS_CACHE_MAXSIZE": 100000,
+    # seconds cached refresh keys are trusted for
+    "REFRESH_KEYS_CACHE_TTL": 300.0,
+    # number of records of a bulk import written in a single transaction
+    "IMPORT_CHUNK_SIZE": 256,
+    # most work verifying a password hashed beforehand, and imported, may take,
+    # in times the work of hashes at HASHER_PARAMS, bcrypt hashes being
+    # bound by HASHER_WORKFACTOR_RANGE instead
+    "IMPORT_HASH_MAX_WORK": 4,
+    # number of users listed per page, unless asked for otherwise,
+    # and the most that may be asked for
+    "USERS_PAGE_SIZE": 100,
+    "USERS_PAGE_SIZE_MAX": 1000,
+    # number of verified access tokens kept in memory until they expire
+    "VERIFIED_TOKENS_CACHE_MAXSIZE": 100000,
+}
+
 load_dotenv(dotenv_path=basedir.joinpath(".env"))
 
 
+def get_db_mode(app):
+    """
+    Return the mode prefixing argument app's database and tables.
+    """
+    if app["TEST"]:
+        return "test"
+    if app["DEV"]:
+        return "dev"
+    return ""
+
+
+def get_db_profile(app):
+    """
+    Return the name of the pragma profile for argument app's database connections.
+    """
+    if app["DB_PROFILE"] is not None:
+        return app["DB_PROFILE"]
+    if app["TEST"]:
+        return "test"
+    if app["DEV"]:
+        return "dev"
+    return "prod"
+
+
 async def manage_db_conn(app):
     """
-    Initialize a database connection for argument app.
-    Cleanup connection at end of app's lifecycle.
+    Initialize a pool of database connections for argument app.
+    Cleanup connections at end of app's lifecycle.
 
     https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
     """
-    mode = "test" if app["TEST"] else ""
-    db_path = str(get_db_path(basedir, mode=mode))
+    mode = get_db_mode(app)
+    db_path = get_db_path(basedir, mode=mode)
 
-    async with aiosqlite.connect(db_path) as conn:
-        conn.row_factory = aiosqlite.Row
-        app["DB_CONN"] = conn
-        yield
+    pool = ConnectionPool(
+        db_path,
+        readers=app["DB_POOL_READERS"],
+        acquire_timeout=app["DB_POOL_ACQUIRE_TIMEOUT"],
+        health_check_interval=app["DB_POOL_HEALTH_CHECK_INTERVAL"],
+        profile=get_db_profile(app),
+        observe=app.get("METRICS") and app["METRICS"].observe_db,
+    )
+    await pool.open()
+    app["DB_POOL"] = pool
+    app["STMTS"] = stmts.StatementRegistry(mode=mode)
+    yield
+    await pool.close()
+
+
+async def manage_db_writes(app):
+    """
+    Initialize a batcher of database writes for argument app.
+    Commit writes still pending at end of app's lifecycle.
+
+    Relies on the pool set up by `manage_db_conn`.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    batcher = WriteBatcher(
+        app["DB_POOL"],
+        window=app["DB_WRITE_BATCH_WINDOW"],
+        max_batch_size=app["DB_WRITE_BATCH_MAX_SIZE"],
+    )
+    app["DB_WRITES"] = batcher
+    yield
+    await batcher.close()
+
+
+async def manage_credentials_loader(app):
+    """
+    Initialize a loader of user credentials by email for argument app,
+    coalescing concurrent lookups into shared queries.
+    Wait for lookups in flight at end of app's lifecycle.
+
+    Relies on the pool set up by `manage_db_conn`.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+
+    async def load_credentials(emails):
+        async with app["DB_POOL"].reader() as conn:
+            cursor = await conn.execute(
+                app["STMTS"].expand("users_select_credentials_many", len(emails)),
+                emails,
+            )
+            rows = await cursor.fetchall()
+            await cursor.close()
+        return {row["email"]: row for row in rows}
+
+    app["CREDENTIALS_LOADER"] = BatchLoader(
+        load_credentials,
+        window=app["CREDENTIALS_BATCH_WINDOW"],
+        max_batch_size=app["CREDENTIALS_BATCH_MAX_SIZE"],
+    )
+    yield
+    await app["CREDENTIALS_LOADER"].close()
+
+
+async def manage_pwd_hash_loader(app):
+    """
+    Initialize a loader of the password hashes of users by uid for argument app,
+    coalescing concurrent lookups into shared queries.
+    Wait for lookups in flight at end of app's lifecycle.
+
+    Relies on the pool set up by `manage_db_conn`.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+
+    async def load_pwd_hashes(uids):
+        async with app["DB_POOL"].reader() as conn:
+            cursor = await conn.execute(
+                app["STMTS"].expand("users_select_pwd_hash_many", len(uids)), uids
+            )
+            rows = await cursor.fetchall()
+            await cursor.close()
+        return {row["id"]: row["pwd_hash"] for row in rows}
+
+    app["PWD_HASH_LOADER"] = BatchLoader(
+        load_pwd_hashes,
+        window=app["CREDENTIALS_BATCH_WINDOW"],
+        max_batch_size=app["CREDENTIALS_BATCH_MAX_SIZE"],
+    )
+    yield
+    await app["PWD_HASH_LOADER"].close()
 
 
 async def create_tables(app):
     """
-    Create required tables at the beginning of app's lifecycle.
+    Bring the database schema up to date at the beginning of app's lifecycle,
+    by applying pending migrations.
     Useful as a subscriber to app's on_startup signal.
 
+    Test databases are set up by the test suite itself, and the databases
+    of workers by the launcher that starts them, see `runprodserver`.
+
     https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.on_startup
     """
-    if app["TEST"]:
+    if app["TEST"] or not app["DB_MIGRATE_ON_STARTUP"]:
         return
 
-    mode = "dev" if app["DEV"] else ""
-    db_path = str(get_db_path(basedir, mode=mode))
+    await migrate_db(get_db_mode(app), get_db_profile(app))
 
-    users_table_create_stmt, users_table_drop_stmt = stmts.get_create_drop_stmts(
-        stmts.users_table_create_template, table_name="users", mode=mode
-    )
 
-    # execute CREATE statements
+async def migrate_db(mode, profile):
+    """
+    Apply pending migrations to the database of argument mode,
+    over a connection set up by argument pragma profile.
+    """
+    db_path = str(get_db_path(basedir, mode=mode))
+
     async with aiosqlite.connect(db_path) as conn:
-        cursor = await conn.cursor()
-        await cursor.execute(users_table_create_stmt)
-        await conn.commit()
+        await pragmas.apply_profile(conn, profile)
+        await migrations.migrate(conn, mode=mode)
+        await pragmas.optimize(conn)
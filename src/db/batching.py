@@ -0,0 +1,127 @@
+import asyncio
+import sqlite3
+from collections import Counter, namedtuple
+
+from db.utils import execute_and_close
+
+# the rowid of the last row inserted by a write, and the first row it returned
+WriteResult = namedtuple("WriteResult", ["lastrowid", "row"])
+
+
+class WriteBatcher:
+    """
+    Group concurrent writes into shared transactions.
+
+    Every commit pays for an fsync, which dominates the latency of small
+    writes. The batcher gathers the writes submitted within `window` seconds
+    of one another, or up to `max_batch_size` of them, and runs them on the
+    pool's writer connection in a single transaction.
+
+    Each write runs under a savepoint of its own, so a write violating a
+    constraint is rolled back alone and its caller gets its own
+    `sqlite3.IntegrityError`, while the rest of the batch is committed.
+    """
+
+    def __init__(self, pool, window=0.002, max_batch_size=64):
+        self.pool = pool
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self._pending = []
+        self._timer = None
+        self._flushes = set()
+
+        self.commits = 0
+        self.writes = 0
+        # maps the size of committed batches to the number of such batches
+        self.batch_sizes = Counter()
+
+    @property
+    def mean_batch_size(self):
+        return self.writes / self.commits if self.commits else 0.0
+
+    async def execute(self, sql, parameters=()):
+        """
+        Execute a write statement as part of the next batch.
+
+        Return a `WriteResult` once the batch is committed, holding the rowid
+        of the last row the statement inserted, and the first row it returned,
+        as with `INSERT ... RETURNING`.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((sql, parameters, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            flush = asyncio.ensure_future(self._commit(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _commit(self, batch):
+        results = []
+        try:
+            async with self.pool.writer() as conn:
+                await execute_and_close(conn, "BEGIN")
+                for sql, parameters, future in batch:
+                    results.append(await self._run(conn, sql, parameters))
+                await conn.commit()
+        except Exception as exc:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        self.commits += 1
+        self.writes += len(batch)
+        self.batch_sizes[len(batch)] += 1
+
+        for (_, _, future), (result, exc) in zip(batch, results):
+            # the caller may have given up waiting
+            if future.done():
+                continue
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    async def _run(self, conn, sql, parameters):
+        """
+        Run a single write under a savepoint.
+
+        Return a pair of its `WriteResult` and its integrity error, if any.
+        """
+        await execute_and_close(conn, "SAVEPOINT batched_write")
+        try:
+            cursor = await conn.execute(sql, parameters)
+            # with RETURNING, a constraint may only fail as rows are read
+            row = await cursor.fetchone()
+        except sqlite3.IntegrityError as exc:
+            await execute_and_close(conn, "ROLLBACK TO batched_write")
+            await execute_and_close(conn, "RELEASE batched_write")
+            return None, exc
+
+        result = WriteResult(cursor.lastrowid, row)
+        await cursor.close()
+        await execute_and_close(conn, "RELEASE batched_write")
+        return result, None
+
+    async def close(self):
+        """
+        Commit pending writes, and wait for batches in flight.
+        """
+        self._flush()
+        if self._flushes:
+            await asyncio.wait(list(self._flushes))
@@ -0,0 +1,123 @@
+"""
+Versioned schema migrations.
+
+Each migration is a list of statement templates, rendered with the table
+prefix of a mode like the templates in `db.stmts`. Applied versions are
+recorded in a `schema_migrations` table, and every pending migration is
+applied in a single transaction, so a database is never left half migrated.
+
+Indexes can be added to a populated database with a plain `CREATE INDEX`:
+in WAL mode, readers keep on reading while the index is built, and only
+writers wait for the migration to commit.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from db import stmts
+from db.utils import execute_and_close
+
+Migration = namedtuple("Migration", ["version", "name", "statements"])
+
+migrations_table_create_template = """
+    CREATE TABLE IF NOT EXISTS {prefix}schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TEXT NOT NULL);
+    """
+
+migrations = [
+    Migration(1, "create users table", [stmts.users_table_create_template]),
+    Migration(
+        2,
+        "index emails case-insensitively",
+        [
+            """
+            CREATE INDEX IF NOT EXISTS {prefix}users_email_nocase
+            ON {prefix}users (email COLLATE NOCASE);
+            """
+        ],
+    ),
+    Migration(
+        3,
+        "cover login lookups",
+        # the rowid is part of every index, so looking credentials up by email
+        # is answered from this index alone, without a visit to the table,
+        # see the statements "users_select_credentials*" in `db.stmts`
+        [
+            """
+            CREATE INDEX IF NOT EXISTS {prefix}users_email_credentials
+            ON {prefix}users (email, pwd_hash);
+            """
+        ],
+    ),
+    Migration(
+        4,
+        "drop case-insensitive email index",
+        # emails are looked up by exact match, so the index only slowed writes
+        ["DROP INDEX IF EXISTS {prefix}users_email_nocase;"],
+    ),
+    Migration(
+        5,
+        "add admin flag",
+        # granted by operators, straight on the database
+        ["ALTER TABLE {prefix}users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0;"],
+    ),
+]
+
+
+def _render(template, mode):
+    prefix = "" if mode is None else "{}_".format(mode)
+    return template.format(prefix=prefix, table_name="users")
+
+
+async def get_applied_versions(conn, mode=None):
+    """
+    Return the set of migration versions applied to the database of argument conn.
+    """
+    cursor = await conn.execute(
+        _render("SELECT version FROM {prefix}schema_migrations;", mode)
+    )
+    rows = await cursor.fetchall()
+    await cursor.close()
+    return {row[0] for row in rows}
+
+
+async def migrate(conn, mode=None, migrations=migrations):
+    """
+    Apply pending migrations to the database of argument conn, in one transaction.
+
+    Return the versions applied, in order.
+    """
+    await execute_and_close(conn, _render(migrations_table_create_template, mode))
+    await conn.commit()
+
+    # take the write lock straight away, so that concurrent migrators
+    # queue up here rather than applying the same migrations twice
+    await execute_and_close(conn, "BEGIN IMMEDIATE")
+    try:
+        applied_versions = await get_applied_versions(conn, mode=mode)
+        pending = sorted(
+            (m for m in migrations if m.version not in applied_versions),
+            key=lambda migration: migration.version,
+        )
+
+        for migration in pending:
+            for template in migration.statements:
+                await execute_and_close(conn, _render(template, mode))
+            await execute_and_close(
+                conn,
+                _render(
+                    """
+                    INSERT INTO {prefix}schema_migrations (version, name, applied_at)
+                    VALUES (?,?,?);
+                    """,
+                    mode,
+                ),
+                [migration.version, migration.name, datetime.utcnow().isoformat()],
+            )
+    except BaseException:
+        await conn.rollback()
+        raise
+
+    await conn.commit()
+    return [migration.version for migration in pending]
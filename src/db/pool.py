@@ -0,0 +1,209 @@
+import asyncio
+import time
+
+import aiosqlite
+
+from db import pragmas
+from db.utils import execute_and_close
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection could be acquired from a pool in time.
+    """
+
+
+class _Acquisition:
+    """
+    Async context manager over a connection acquired from a pool.
+    """
+
+    def __init__(self, acquire, release, kind, observe=None):
+        self._acquire = acquire
+        self._release = release
+        self._kind = kind
+        self._observe = observe
+        self._conn = None
+        self._waited = 0.0
+        self._acquired_at = None
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        self._conn = await self._acquire()
+        self._acquired_at = time.perf_counter()
+        self._waited = self._acquired_at - start
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._release(self._conn, failed=exc_type is not None)
+        if self._observe is not None:
+            self._observe(
+                self._kind, self._waited, time.perf_counter() - self._acquired_at
+            )
+
+
+class ConnectionPool:
+    """
+    Pool of connections to a SQLite database, with read/write separation.
+
+    SQLite allows a single writer at a time, so the pool holds exactly one
+    writer connection, handed out to one task at a time, next to a number of
+    read-only reader connections. The database is put in WAL mode, in which
+    readers neither block nor are blocked by the writer.
+
+    ```
+    async with pool.reader() as conn:
+        ...
+
+    async with pool.writer() as conn:
+        ...
+    ```
+
+    An idle connection is health checked before being handed out if it has
+    not been used for `health_check_interval` seconds, and replaced if the
+    check fails.
+
+    Every connection is tuned with the pragmas of the `profile` named
+    as it's opened, and optimized as it's closed.
+
+    If given, `observe` is called every time a connection is released, with
+    its kind, "reader" or "writer", the seconds it was waited for, and
+    the seconds it was held for.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        readers=4,
+        acquire_timeout=5.0,
+        health_check_interval=30.0,
+        profile="prod",
+        observe=None,
+    ):
+        self.db_path = str(db_path)
+        # fail early on an unknown profile
+        pragmas.get_profile(profile)
+        self.profile = profile
+        self.size = readers
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.observe = observe
+
+        self._writer = None
+        self._writer_lock = None
+        self._readers = None
+        # maps connections to the time they were last released
+        self._last_used = {}
+
+    async def _connect(self, readonly=False):
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = aiosqlite.Row
+        await pragmas.apply_profile(conn, self.profile)
+        # readers and writer can't go without WAL, whatever the profile
+        await execute_and_close(conn, "PRAGMA journal_mode = WAL")
+        if readonly:
+            await execute_and_close(conn, "PRAGMA query_only = ON")
+        self._last_used[conn] = time.monotonic()
+        return conn
+
+    async def _disconnect(self, conn, optimize=False):
+        self._last_used.pop(conn, None)
+        try:
+            if optimize:
+                # optimizing may write to the database
+                await execute_and_close(conn, "PRAGMA query_only = OFF")
+                await pragmas.optimize(conn)
+        finally:
+            await conn.close()
+
+    async def open(self):
+        # the writer comes first: it creates the database and switches it
+        # to WAL mode before any reader connects
+        self._writer = await self._connect()
+        self._writer_lock = asyncio.Lock()
+        self._readers = asyncio.LifoQueue()
+        for _ in range(self.size):
+            self._readers.put_nowait(await self._connect(readonly=True))
+
+    async def close(self):
+        while not self._readers.empty():
+            await self._disconnect(self._readers.get_nowait(), optimize=True)
+        await self._disconnect(self._writer, optimize=True)
+
+    @property
+    def idle_readers(self):
+        return self._readers.qsize()
+
+    async def _check_health(self, conn, readonly):
+        """
+        Return argument conn if it is usable, a fresh connection otherwise.
+        """
+        idle_time = time.monotonic() - self._last_used[conn]
+        if idle_time < self.health_check_interval:
+            return conn
+
+        try:
+            await execute_and_close(conn, "SELECT 1")
+        except Exception:
+            try:
+                await self._disconnect(conn)
+            except Exception:
+                pass
+            conn = await self._connect(readonly=readonly)
+        return conn
+
+    async def _acquire_reader(self):
+        try:
+            conn = await asyncio.wait_for(self._readers.get(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout("timed out acquiring a reader connection")
+        try:
+            return await self._check_health(conn, readonly=True)
+        except Exception:
+            # hand the broken connection back, to be checked anew on next use,
+            # so that a failed reconnection doesn't shrink the pool
+            self._last_used[conn] = float("-inf")
+            self._readers.put_nowait(conn)
+            raise
+
+    async def _release_reader(self, conn, failed=False):
+        self._last_used[conn] = time.monotonic()
+        self._readers.put_nowait(conn)
+
+    async def _acquire_writer(self):
+        try:
+            await asyncio.wait_for(self._writer_lock.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout("timed out acquiring the writer connection")
+        try:
+            self._writer = await self._check_health(self._writer, readonly=False)
+        except Exception:
+            self._last_used[self._writer] = float("-inf")
+            self._writer_lock.release()
+            raise
+        return self._writer
+
+    async def _release_writer(self, conn, failed=False):
+        try:
+            # never hand a half-done transaction over to the next task
+            if failed:
+                await conn.rollback()
+        finally:
+            self._last_used[conn] = time.monotonic()
+            self._writer_lock.release()
+
+    def reader(self):
+        """
+        Return a context manager acquiring a read-only connection.
+        """
+        return _Acquisition(
+            self._acquire_reader, self._release_reader, "reader", self.observe
+        )
+
+    def writer(self):
+        """
+        Return a context manager acquiring the writer connection.
+        """
+        return _Acquisition(
+            self._acquire_writer, self._release_writer, "writer", self.observe
+        )
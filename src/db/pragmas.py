@@ -0,0 +1,77 @@
+from db.utils import execute_and_close
+
+# tuning profiles, applied to every connection as it's opened
+profiles = {
+    # durable across application crashes, fast enough for the request path:
+    # with WAL, synchronous NORMAL only risks the last commits on power loss
+    "prod": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        # negative sizes are in KiB, so 64 MiB of page cache
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "dev": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    # nothing in a test database is worth an fsync
+    "test": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -8000,
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+        "busy_timeout": 1000,
+    },
+}
+
+# order in which pragmas are applied: the busy timeout comes first, so that
+# switching the journal mode waits on other connections instead of failing
+pragma_order = [
+    "busy_timeout",
+    "journal_mode",
+    "synchronous",
+    "cache_size",
+    "mmap_size",
+    "temp_store",
+]
+
+
+def get_profile(name):
+    """
+    Return the tuning profile of argument name.
+    """
+    try:
+        return profiles[name]
+    except KeyError:
+        raise ValueError("unknown tuning profile: {!r}".format(name))
+
+
+async def apply_profile(conn, name):
+    """
+    Apply the pragmas of a tuning profile to argument conn.
+    """
+    profile = get_profile(name)
+    for pragma in pragma_order:
+        if pragma in profile:
+            await execute_and_close(
+                conn, "PRAGMA {} = {}".format(pragma, profile[pragma])
+            )
+
+
+async def optimize(conn):
+    """
+    Let SQLite refresh the statistics its query planner relies on, as it
+    deems fit from the queries run on argument conn.
+    Meant to be run just before closing a connection.
+
+    https://www.sqlite.org/pragma.html#pragma_optimize
+    """
+    await execute_and_close(conn, "PRAGMA optimize")
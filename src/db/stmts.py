@@ -1,3 +1,5 @@
+import sqlite3
+
 users_table_create_template = """
     CREATE TABLE IF NOT EXISTS {prefix}{table_name} (
     id INTEGER PRIMARY KEY,
@@ -18,3 +20,123 @@ def get_create_drop_stmts(creation_template, table_name, mode=None):
             prefix=prefix, table_name=table_name
         ),
     )
+
+
+# whether the linked SQLite can return the rows it writes
+supports_returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+users_insert_template = """
+    INSERT INTO {prefix}users
+    (email, username, pwd_hash)
+    VALUES
+    (?,?,?)
+    """ + (
+    "RETURNING id, username, email;" if supports_returning else ";"
+)
+
+# executemany can't run statements returning rows
+users_insert_many_template = """
+    INSERT INTO {prefix}users
+    (email, username, pwd_hash)
+    VALUES
+    (?,?,?);
+    """
+
+# only replaces the hash it's handed, so as not to undo a concurrent change
+users_update_pwd_hash_template = """
+    UPDATE {prefix}users
+    SET pwd_hash = ?
+    WHERE id = ? AND pwd_hash = ?;
+    """
+
+# the planner would rather go through the index of the UNIQUE constraint
+# on email and then visit the table, than answer from the covering index
+# added by migration 3 alone
+users_select_credentials_template = """
+    SELECT id, pwd_hash FROM {prefix}users
+    INDEXED BY {prefix}users_email_credentials
+    WHERE email = (?);
+    """
+
+users_select_credentials_many_template = """
+    SELECT email, id, pwd_hash FROM {prefix}users
+    INDEXED BY {prefix}users_email_credentials
+    WHERE email IN (?*);
+    """
+
+# looked up by rowid, which is as direct as an index lookup gets
+users_select_pwd_hash_many_template = """
+    SELECT id, pwd_hash FROM {prefix}users
+    WHERE id IN (?*);
+    """
+
+# pages through users by id, which is the rowid, so that every page starts
+# with a seek however deep it lies, filters left null match every user
+users_select_page_template = r"""
+    SELECT id, username, email FROM {prefix}users
+    WHERE id > :after
+    AND (:username_prefix IS NULL
+        OR substr(username, 1, length(:username_prefix)) = :username_prefix)
+    AND (:email_pattern IS NULL OR email LIKE :email_pattern ESCAPE '\')
+    ORDER BY id
+    LIMIT :limit;
+    """
+
+users_select_is_admin_template = """
+    SELECT is_admin FROM {prefix}users
+    WHERE id = (?);
+    """
+
+# templates of the statements run on the request path, by name,
+# the marker (?*) stands for a list of as many placeholders as values
+statement_templates = {
+    "users_insert": users_insert_template,
+    "users_insert_many": users_insert_many_template,
+    "users_update_pwd_hash": users_update_pwd_hash_template,
+    "users_select_credentials": users_select_credentials_template,
+    "users_select_credentials_many": users_select_credentials_many_template,
+    "users_select_pwd_hash_many": users_select_pwd_hash_many_template,
+    "users_select_page": users_select_page_template,
+    "users_select_is_admin": users_select_is_admin_template,
+}
+
+
+class StatementRegistry:
+    """
+    Statements rendered once for a mode, and looked up by name.
+
+    Handing sqlite3 the very same string on every execution lets it reuse
+    the statement it compiled the first time, from its statement cache.
+
+    ```
+    registry = StatementRegistry(mode="test")
+    await conn.execute(registry["users_insert"], params)
+    ```
+    """
+
+    def __init__(self, mode=None, templates=None):
+        self.prefix = "" if mode is None else "{}_".format(mode)
+        self._stmts = {}
+        self._expanded = {}
+        if templates is None:
+            templates = statement_templates
+        for name, template in templates.items():
+            self.register(name, template)
+
+    def register(self, name, template):
+        self._stmts[name] = template.format(prefix=self.prefix)
+
+    def __getitem__(self, name):
+        return self._stmts[name]
+
+    def expand(self, name, count):
+        """
+        Return the statement of argument name, with its marker (?*) expanded
+        to a list of count placeholders.
+        """
+        key = (name, count)
+        if key not in self._expanded:
+            self._expanded[key] = self._stmts[name].replace(
+                "(?*)", "({})".format(",".join("?" * count))
+            )
+        return self._expanded[key]
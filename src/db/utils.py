@@ -14,3 +14,13 @@ def get_table_fullname(table_name, mode=None):
     return "{prefix}{table_name}".format(
         prefix="" if mode is None else "{}_".format(mode), table_name=table_name
     )
+
+
+async def execute_and_close(conn, sql, parameters=None):
+    """
+    Execute a statement on argument conn, and close its cursor right away.
+
+    A statement left unfinished holds on to a lock on the database.
+    """
+    cursor = await conn.execute(sql, parameters or [])
+    await cursor.close()
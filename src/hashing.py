@@ -0,0 +1,277 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+
+import auth
+
+executor_classes = {
+    "process": ProcessPoolExecutor,
+    "thread": ThreadPoolExecutor,
+}
+
+
+class HashingService:
+    """
+    Run password hashing and verification off the event loop.
+
+    Password hashes are deliberately slow, so every call is handed to
+    a bounded pool of workers and awaited, leaving the loop free to serve
+    other requests. bcrypt, scrypt and PBKDF2 all release the GIL, so
+    a thread pool scales across cores as well as a process pool does,
+    without the cost of pickling arguments around.
+
+    New hashes are written by argument hasher, one of those registered
+    in `auth`, bcrypt at its default work factor if None. Hashes of any
+    registered scheme are verified.
+
+    If given, `observe` is called as every call completes, with its operation,
+    "hash" or "verify", and the seconds it took, queueing included.
+    """
+
+    def __init__(self, max_workers=None, executor="thread", hasher=None, observe=None):
+        if executor not in executor_classes:
+            raise ValueError("unknown executor kind: {!r}".format(executor))
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor_kind = executor
+        self.hasher = hasher or auth.BcryptHasher()
+        self.observe = observe
+        self._executor = None
+        self._pending = 0
+
+    def start(self):
+        self._executor = executor_classes[self.executor_kind](
+            max_workers=self.max_workers
+        )
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    @property
+    def pending(self):
+        """
+        Return the number of calls submitted and not yet completed.
+        """
+        return self._pending
+
+    @property
+    def queue_depth(self):
+        """
+        Return the number of calls waiting for a free worker.
+        """
+        return max(0, self._pending - self.max_workers)
+
+    async def _run(self, operation, func, *args):
+        assert self._executor is not None, "hashing service is not started"
+        loop = asyncio.get_event_loop()
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, partial(func, *args))
+        finally:
+            self._pending -= 1
+            if self.observe is not None:
+                self.observe(operation, time.perf_counter() - start)
+
+    async def hash(self, plaintext):
+        """
+        Return a salted hash of argument plaintext, by the service's hasher.
+        """
+        return await self._run("hash", self.hasher.hash, plaintext)
+
+    async def verify(self, plaintext, hash):
+        """
+        Return True if argument plaintext checks out with argument hash.
+        """
+        return await self._run("verify", auth.check_password_hash, plaintext, hash)
+
+    def needs_rehash(self, hash):
+        """
+        Return True if argument hash isn't of the scheme and parameters
+        of the service's hasher.
+        """
+        return self.hasher.needs_rehash(hash)
+
+    @property
+    def stats(self):
+        return {
+            "scheme": self.hasher.scheme,
+            "params": self.hasher.params,
+            "pending": self.pending,
+            "queue_depth": self.queue_depth,
+        }
+
+
+@lru_cache(maxsize=None)
+def calibrate_workfactor(budget, minimum=10, maximum=16):
+    """
+    Return the highest bcrypt work factor, between argument minimum and
+    maximum, whose hashes take no longer than argument budget seconds
+    on this machine.
+
+    Each step up the work factor doubles the time a hash takes, so only
+    hashes at the minimum are timed, and the rest is extrapolated.
+    """
+    seconds = min(_time_hash(minimum) for _ in range(3))
+    workfactor = minimum
+    while workfactor < maximum and seconds * 2 <= budget:
+        workfactor += 1
+        seconds *= 2
+    return workfactor
+
+
+def needs_calibration(settings):
+    """
+    Return True if hashes by argument settings are bcrypt hashes
+    at a work factor left to calibrate.
+    """
+    scheme = settings["HASHER_SCHEME"]
+    return (
+        scheme == "bcrypt"
+        and "workfactor" not in settings["HASHER_PARAMS"].get(scheme, {})
+        and settings["HASHER_WORKFACTOR"] is None
+    )
+
+
+def _time_hash(workfactor):
+    start = time.perf_counter()
+    auth.get_password_hash("calibration", workfactor)
+    return time.perf_counter() - start
+
+
+class Rehasher:
+    """
+    Rehash passwords whose hash isn't of the scheme and parameters of
+    a hashing service, in the background, moving users over to them.
+
+    Users are rehashed as they log in, the only time their plaintext password
+    is at hand. The new hash is written through a batcher of writes, only
+    if the stored hash hasn't changed in the meantime. Rehashes beyond
+    `max_backlog` are dropped, to be tried again at a later login.
+
+    Refresh keys derive from the hash, so the refresh token handed out at
+    the login that triggered a rehash stops working once it's written, and
+    the user logs in anew when their access token expires. That happens
+    once per change of scheme or parameters.
+    """
+
+    def __init__(self, hasher, writes, update_stmt, max_backlog=1000):
+        self.hasher = hasher
+        self.writes = writes
+        self.update_stmt = update_stmt
+        self.max_backlog = max_backlog
+        # maps uids to their rehashes in flight
+        self._tasks = {}
+
+        self.rehashed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def backlog(self):
+        return len(self._tasks)
+
+    def submit(self, uid, plaintext, hash, on_rehashed=None):
+        """
+        Rehash the password of user uid in the background if needed,
+        calling argument on_rehashed once the new hash is written.
+
+        Return True if a rehash is under way.
+        """
+        if not self.hasher.needs_rehash(hash):
+            return False
+        if uid in self._tasks:
+            return True
+        if len(self._tasks) >= self.max_backlog:
+            self.dropped += 1
+            return False
+
+        task = asyncio.ensure_future(self._rehash(uid, plaintext, hash, on_rehashed))
+        self._tasks[uid] = task
+        task.add_done_callback(lambda _: self._tasks.pop(uid, None))
+        return True
+
+    async def _rehash(self, uid, plaintext, hash, on_rehashed):
+        try:
+            new_hash = await self.hasher.hash(plaintext)
+            await self.writes.execute(self.update_stmt, (new_hash, uid, hash))
+        except Exception:
+            self.failed += 1
+            return
+        self.rehashed += 1
+        if on_rehashed is not None:
+            on_rehashed()
+
+    @property
+    def stats(self):
+        return {
+            "backlog": self.backlog,
+            "rehashed": self.rehashed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    async def close(self):
+        """
+        Wait for the rehashes in flight.
+        """
+        if self._tasks:
+            await asyncio.wait(list(self._tasks.values()))
+
+
+async def manage_hashing_service(app):
+    """
+    Start a hashing service for argument app, hashing by the scheme and
+    parameters set for it. bcrypt hashes are at the work factor set for it,
+    or else at the one calibrated for the time budget set for it.
+    Shut its workers down at end of app's lifecycle.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    scheme = app["HASHER_SCHEME"]
+    params = dict(app["HASHER_PARAMS"].get(scheme, {}))
+    if needs_calibration(app):
+        loop = asyncio.get_event_loop()
+        params["workfactor"] = await loop.run_in_executor(
+            None,
+            calibrate_workfactor,
+            app["HASHER_TIME_BUDGET"],
+            *app["HASHER_WORKFACTOR_RANGE"]
+        )
+    elif scheme == "bcrypt" and "workfactor" not in params:
+        params["workfactor"] = app["HASHER_WORKFACTOR"]
+
+    service = HashingService(
+        max_workers=app["HASHER_MAX_WORKERS"],
+        executor=app["HASHER_EXECUTOR"],
+        hasher=auth.get_hasher(scheme, **params),
+        observe=app.get("METRICS") and app["METRICS"].observe_hashing,
+    )
+    service.start()
+    app["HASHER"] = service
+    yield
+    service.shutdown()
+
+
+async def manage_password_rehashing(app):
+    """
+    Initialize a rehasher of passwords for argument app.
+    Wait for rehashes in flight at end of app's lifecycle.
+
+    Relies on the hashing service set up by `manage_hashing_service`, and
+    the batcher of writes set up by `config.manage_db_writes`.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    rehasher = Rehasher(
+        app["HASHER"],
+        app["DB_WRITES"],
+        app["STMTS"]["users_update_pwd_hash"],
+        max_backlog=app["REHASH_MAX_BACKLOG"],
+    )
+    app["REHASHER"] = rehasher
+    yield
+    await rehasher.close()
@@ -0,0 +1,286 @@
+"""
+Bulk import of user accounts.
+
+Records come as lines of JSON objects (NDJSON), each holding an email, a
+username, and either a plaintext password or the hash of one, of any
+scheme registered in `auth`:
+
+    {"email": "tintin@gmail.com", "username": "Tintin", "password": "..."}
+    {"email": "snowy@gmail.com", "username": "Snowy", "pwd_hash": "$2b$13$..."}
+
+Records are validated as accounts created one at a time are, plaintext
+passwords are hashed across every worker of a hashing service, and records
+are written in chunks, each in a single transaction. Passwords hashed
+beforehand are turned down if verifying them at login would take more work
+than the app is set up for, see `get_hash_bounds`. Every record gets a
+result, in input order, holding either the id of the user created or the
+reason the record was turned down.
+
+Import a file from the command line with
+
+    python importing.py [--mode MODE] [--chunk-size N] [--executor KIND] FILE
+
+which writes the results to stdout. Accounts imported while the app runs
+may be reported missing by its caches until their entries expire.
+"""
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+from collections import namedtuple
+
+import auth
+import config
+from db import migrations, stmts
+from db.pool import ConnectionPool
+from db.utils import execute_and_close, get_db_path
+from hashing import HashingService
+
+Record = namedtuple("Record", ["line", "email", "username", "password", "pwd_hash"])
+
+
+def get_hash_bounds(settings):
+    """
+    Return a mapping of hashing schemes to the least and the most work
+    verifying imported hashes of theirs may take, by argument settings.
+    """
+    bounds = {}
+    for scheme, cls in auth.hashers_by_scheme.items():
+        if scheme == "bcrypt":
+            bounds[scheme] = tuple(
+                cls.get_work({"workfactor": workfactor})
+                for workfactor in settings["HASHER_WORKFACTOR_RANGE"]
+            )
+        else:
+            params = cls(**settings["HASHER_PARAMS"].get(scheme, {})).params
+            most = settings["IMPORT_HASH_MAX_WORK"] * cls.get_work(params)
+            bounds[scheme] = (0, most)
+    return bounds
+
+
+def _check_hash_work(pwd_hash, hash_bounds):
+    cls = auth.identify_hash(pwd_hash)
+    if cls is None:
+        return False
+    least, most = hash_bounds[cls.scheme]
+    return least <= cls.get_work(cls.parse_params(pwd_hash)) <= most
+
+
+def parse_record(line_number, line, hash_bounds=None):
+    """
+    Return a pair of the record on argument line and None if it's valid,
+    of None and the reason it isn't otherwise.
+
+    Hashes are checked against argument hash_bounds, as returned by
+    `get_hash_bounds`, the bounds of the default settings if None.
+    """
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None, "invalid json"
+    if not isinstance(data, dict):
+        return None, "invalid record"
+
+    fields = {}
+    for name in ["email", "username", "password", "pwd_hash"]:
+        value = data.get(name)
+        if value is not None and not isinstance(value, str):
+            return None, "invalid {}".format(name)
+        fields[name] = value if value is None else value.strip()
+
+    if not fields["username"] or not auth.validate_username(fields["username"]):
+        return None, "invalid username"
+
+    if not fields["email"] or not auth.validate_email(fields["email"]):
+        return None, "invalid email"
+
+    if (fields["password"] is None) == (fields["pwd_hash"] is None):
+        return None, "either password or pwd_hash required"
+
+    if fields["pwd_hash"] is not None:
+        if auth.identify_hash(fields["pwd_hash"]) is None:
+            return None, "invalid pwd_hash"
+        if hash_bounds is None:
+            hash_bounds = get_hash_bounds(config.default_settings)
+        if not _check_hash_work(fields["pwd_hash"], hash_bounds):
+            return None, "pwd_hash out of bounds"
+    elif not auth.validate_password(
+        fields["password"], username=fields["username"], email=fields["email"]
+    ):
+        return None, "bad password"
+
+    return Record(line_number, **fields), None
+
+
+def _describe_integrity_error(exc):
+    if "email" in str(exc):
+        return "user with that email already exists"
+    if "username" in str(exc):
+        return "user with that username already exists"
+    return "integrity error"
+
+
+async def hash_passwords(records, hasher):
+    """
+    Return argument records, with the plaintext passwords hashed.
+
+    No more hashes than the hasher has workers are in flight at once, so that
+    requests for the same hasher are never queued behind a whole chunk.
+    """
+    semaphore = asyncio.Semaphore(hasher.max_workers)
+
+    async def _hash(record):
+        if record.pwd_hash is not None:
+            return record
+        async with semaphore:
+            pwd_hash = await hasher.hash(record.password)
+        return record._replace(password=None, pwd_hash=pwd_hash)
+
+    return await asyncio.gather(*[_hash(record) for record in records])
+
+
+async def write_records(conn, registry, records):
+    """
+    Insert argument records in a single transaction.
+
+    Return the id of each record's user, or the integrity error it ran into.
+    Records are inserted with a single `executemany`, and only when one of
+    them violates a constraint are they inserted one by one, each under
+    a savepoint of its own.
+    """
+    rows = [(record.email, record.username, record.pwd_hash) for record in records]
+    errors = [None] * len(rows)
+
+    await execute_and_close(conn, "BEGIN")
+    await execute_and_close(conn, "SAVEPOINT bulk_import")
+    try:
+        cursor = await conn.executemany(registry["users_insert_many"], rows)
+        await cursor.close()
+    except sqlite3.IntegrityError:
+        await execute_and_close(conn, "ROLLBACK TO bulk_import")
+        for position, row in enumerate(rows):
+            await execute_and_close(conn, "SAVEPOINT bulk_import_row")
+            try:
+                await execute_and_close(conn, registry["users_insert_many"], row)
+            except sqlite3.IntegrityError as exc:
+                await execute_and_close(conn, "ROLLBACK TO bulk_import_row")
+                errors[position] = exc
+            await execute_and_close(conn, "RELEASE bulk_import_row")
+    await execute_and_close(conn, "RELEASE bulk_import")
+
+    emails = [record.email for record in records]
+    cursor = await conn.execute(
+        registry.expand("users_select_credentials_many", len(emails)), emails
+    )
+    ids = {row["email"]: row["id"] for row in await cursor.fetchall()}
+    await cursor.close()
+    await conn.commit()
+
+    return [
+        (None, exc) if exc is not None else (ids[record.email], None)
+        for record, exc in zip(records, errors)
+    ]
+
+
+async def _import_chunk(chunk, pool, registry, hasher):
+    records = [record for record in chunk if isinstance(record, Record)]
+    records = await hash_passwords(records, hasher)
+    if records:
+        async with pool.writer() as conn:
+            outcomes = iter(await write_records(conn, registry, records))
+
+    results = []
+    for item in chunk:
+        if not isinstance(item, Record):
+            results.append(item)
+            continue
+        uid, exc = next(outcomes)
+        if exc is not None:
+            results.append(
+                {
+                    "line": item.line,
+                    "email": item.email,
+                    "error": _describe_integrity_error(exc),
+                }
+            )
+        else:
+            results.append({"line": item.line, "email": item.email, "id": uid})
+    return results
+
+
+async def import_users(
+    lines, pool, registry, hasher, chunk_size=256, hash_bounds=None
+):
+    """
+    Import the records on argument lines, an async iterable of lines of
+    NDJSON, and yield their results in order, a chunk at a time.
+
+    Blank lines are skipped, and line numbers start at 1. Hashes are checked
+    against argument hash_bounds, see `parse_record`.
+    """
+    if hash_bounds is None:
+        hash_bounds = get_hash_bounds(config.default_settings)
+    chunk = []
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        if not line.strip():
+            continue
+
+        record, error = parse_record(line_number, line, hash_bounds)
+        chunk.append(record or {"line": line_number, "error": error})
+        if len(chunk) >= chunk_size:
+            for result in await _import_chunk(chunk, pool, registry, hasher):
+                yield result
+            chunk = []
+
+    if chunk:
+        for result in await _import_chunk(chunk, pool, registry, hasher):
+            yield result
+
+
+async def _iterate(iterable):
+    for item in iterable:
+        yield item
+
+
+async def _main(path, mode, chunk_size, executor):
+    pool = ConnectionPool(
+        get_db_path(config.basedir, mode=mode), readers=1, profile=mode or "prod"
+    )
+    hasher = HashingService(executor=executor)
+    hasher.start()
+    await pool.open()
+    try:
+        async with pool.writer() as conn:
+            await migrations.migrate(conn, mode=mode)
+
+        with open(path, encoding="utf-8") as file:
+            results = import_users(
+                _iterate(file),
+                pool,
+                stmts.StatementRegistry(mode=mode),
+                hasher,
+                chunk_size=chunk_size,
+            )
+            async for result in results:
+                sys.stdout.write(json.dumps(result) + "\n")
+    finally:
+        await pool.close()
+        hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import user accounts from NDJSON.")
+    parser.add_argument("path", metavar="FILE")
+    parser.add_argument("--mode", default="", choices=["", "dev", "test"])
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--executor", default="thread", choices=["thread", "process"])
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(
+        _main(args.path, args.mode, args.chunk_size, args.executor)
+    )
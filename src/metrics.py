@@ -0,0 +1,480 @@
+"""
+Instrumentation of the app, exposed in the Prometheus text format.
+
+The metrics middleware records, per route, the latency and status of every
+request, and the number of requests in flight. The connection pool records
+how long connections are waited for and held, that is, the time spent in
+SQLite, and the hashing service how long each hash and verification takes.
+Stats kept by the other components, caches, loaders, limiters and so on,
+are collected as they are rendered.
+
+Recording is cheap. Metrics are only ever updated from the event loop,
+so counters are plain numbers needing no lock, and each histogram keeps
+one list of bucket counts per set of labels, allocated once, whose
+bucket is found by bisection.
+
+Metrics are kept per process: each worker of `runprodserver` reports its own.
+"""
+import asyncio
+import bisect
+import math
+from time import perf_counter
+
+from aiohttp import web
+
+# upper bounds of latency buckets, in seconds
+default_buckets = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# content type of the Prometheus text exposition format
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [
+        '{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)
+    ]
+    if extra is not None:
+        pairs.append(extra)
+    return "{{{}}}".format(",".join(pairs)) if pairs else ""
+
+
+class Counter:
+    """
+    Number only ever going up, one per tuple of values of argument labels.
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # maps tuples of label values to values
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, labels, value):
+        self._values[labels] = value
+
+    def get(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    """
+    Number going up and down, one per tuple of values of argument labels.
+    """
+
+    type = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class _Buckets:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, one per tuple
+    of values of argument labels.
+
+    Counts are kept per bucket, and only made cumulative as they're rendered.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # maps tuples of label values to their buckets
+        self._buckets = {}
+
+    def observe(self, value, labels=()):
+        buckets = self._buckets.get(labels)
+        if buckets is None:
+            # one more bucket, for values past the last bound
+            buckets = self._buckets[labels] = _Buckets(len(self.buckets) + 1)
+        buckets.counts[bisect.bisect_left(self.buckets, value)] += 1
+        buckets.sum += value
+
+    def get_count(self, labels=()):
+        buckets = self._buckets.get(labels)
+        return sum(buckets.counts) if buckets is not None else 0
+
+    def samples(self):
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, buckets in self._buckets.items():
+            count = 0
+            for bound, bucket_count in zip(bounds, buckets.counts):
+                count += bucket_count
+                yield (
+                    self.name + "_bucket",
+                    _format_labels(self.labels, labels, 'le="{}"'.format(bound)),
+                    count,
+                )
+            formatted_labels = _format_labels(self.labels, labels)
+            yield self.name + "_sum", formatted_labels, buckets.sum
+            yield self.name + "_count", formatted_labels, count
+
+
+class MetricsRegistry:
+    """
+    Metrics to render, next to collectors of metrics built as they're rendered.
+
+    A collector is a callable returning an iterable of metrics.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        self.collectors.append(collect)
+
+    def collect(self):
+        yield from self.metrics
+        for collect in self.collectors:
+            yield from collect()
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text format.
+        """
+        lines = []
+        for metric in self.collect():
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append("{}{} {}".format(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+class AppMetrics:
+    """
+    Metrics recorded while an app serves requests.
+    """
+
+    def __init__(self, buckets=default_buckets):
+        self.registry = MetricsRegistry()
+        # a plain number, rendered by `_collect_in_flight`,
+        # saves the middleware a couple of calls per request
+        self.requests_in_flight = 0
+        self.registry.add_collector(self._collect_in_flight)
+        self.request_duration = self.registry.register(
+            Histogram(
+                "http_request_duration_seconds",
+                "Time taken to serve requests, by route.",
+                labels=("method", "route"),
+                buckets=buckets,
+            )
+        )
+        self.responses = self.registry.register(
+            Counter(
+                "http_responses_total",
+                "Responses sent, by route and status.",
+                labels=("method", "route", "status"),
+            )
+        )
+        self.db_wait = self.registry.register(
+            Histogram(
+                "sqlite_connection_wait_seconds",
+                "Time spent waiting for a database connection, by kind.",
+                labels=("kind",),
+                buckets=buckets,
+            )
+        )
+        self.db_held = self.registry.register(
+            Histogram(
+                "sqlite_connection_held_seconds",
+                "Time a database connection was held for, by kind.",
+                labels=("kind",),
+                buckets=buckets,
+            )
+        )
+        self.hashing = self.registry.register(
+            Histogram(
+                "password_hashing_seconds",
+                "Time taken to hash and verify passwords, queueing included.",
+                labels=("operation",),
+                buckets=buckets,
+            )
+        )
+
+    def _collect_in_flight(self):
+        gauge = Gauge("http_requests_in_flight", "Requests being served.")
+        gauge.set((), self.requests_in_flight)
+        return [gauge]
+
+    def observe_db(self, kind, waited, held):
+        self.db_wait.observe(waited, (kind,))
+        self.db_held.observe(held, (kind,))
+
+    def observe_hashing(self, operation, seconds):
+        self.hashing.observe(seconds, (operation,))
+
+    def render(self):
+        return self.registry.render()
+
+
+def _stats_metric(cls, name, help, label, stats_by_label, stat):
+    metric = cls(name, help, labels=(label,))
+    for value, stats in stats_by_label.items():
+        metric.set((value,), stats[stat])
+    return metric
+
+
+def collect_app_stats(app):
+    """
+    Return metrics of the stats kept by the components of argument app,
+    for those it's set up with.
+    """
+    metrics = []
+
+    pool = app.get("DB_POOL")
+    if pool is not None:
+        gauge = Gauge("sqlite_idle_readers", "Reader connections idle in the pool.")
+        gauge.set((), pool.idle_readers)
+        metrics.append(gauge)
+
+    writes = app.get("DB_WRITES")
+    if writes is not None:
+        for name, help, value in [
+            ("sqlite_writes_total", "Writes committed.", writes.writes),
+            (
+                "sqlite_write_commits_total",
+                "Batches of writes committed.",
+                writes.commits,
+            ),
+        ]:
+            counter = Counter(name, help)
+            counter.set((), value)
+            metrics.append(counter)
+
+    hasher = app.get("HASHER")
+    if hasher is not None:
+        stats = {hasher.stats["scheme"]: hasher.stats}
+        metrics.append(
+            _stats_metric(
+                Gauge, "hasher_pending", "Hashes in flight.", "scheme", stats, "pending"
+            )
+        )
+        metrics.append(
+            _stats_metric(
+                Gauge,
+                "hasher_queue_depth",
+                "Hashes waiting for a worker.",
+                "scheme",
+                stats,
+                "queue_depth",
+            )
+        )
+        # the log2 of the work of a hash, which bcrypt's cost is,
+        # comparable between schemes
+        gauge = Gauge(
+            "hasher_workfactor",
+            "Work factor new hashes are made at.",
+            labels=("scheme",),
+        )
+        gauge.set(
+            (hasher.stats["scheme"],),
+            math.log2(hasher.hasher.get_work(hasher.stats["params"])),
+        )
+        metrics.append(gauge)
+
+    rehasher = app.get("REHASHER")
+    if rehasher is not None:
+        gauge = Gauge("rehash_backlog", "Rehashes in flight.")
+        gauge.set((), rehasher.backlog)
+        counter = Counter("rehashes_total", "Rehashes by outcome.", labels=("outcome",))
+        for outcome in ["rehashed", "dropped", "failed"]:
+            counter.set((outcome,), rehasher.stats[outcome])
+        metrics.extend([gauge, counter])
+
+    caches = {
+        name: app[key].stats
+        for name, key in [
+            ("credentials", "CREDENTIALS_CACHE"),
+            ("refresh_keys", "REFRESH_KEYS_CACHE"),
+            ("verified_tokens", "VERIFIED_TOKENS"),
+        ]
+        if app.get(key) is not None
+    }
+    if caches:
+        metrics.append(
+            _stats_metric(
+                Gauge, "cache_entries", "Entries cached.", "cache", caches, "size"
+            )
+        )
+        for stat in ["hits", "misses", "evictions"]:
+            metrics.append(
+                _stats_metric(
+                    Counter,
+                    "cache_{}_total".format(stat),
+                    "Cache {}.".format(stat),
+                    "cache",
+                    caches,
+                    stat,
+                )
+            )
+
+    loaders = {
+        name: {
+            "loads": app[key].loads,
+            "coalesced": app[key].coalesced,
+            "batches": app[key].batches,
+        }
+        for name, key in [
+            ("credentials", "CREDENTIALS_LOADER"),
+            ("pwd_hashes", "PWD_HASH_LOADER"),
+        ]
+        if app.get(key) is not None
+    }
+    if loaders:
+        for stat, help in [
+            ("loads", "Loads requested."),
+            ("coalesced", "Loads sharing a load in flight."),
+            ("batches", "Batches of loads queried."),
+        ]:
+            metrics.append(
+                _stats_metric(
+                    Counter,
+                    "loader_{}_total".format(stat),
+                    help,
+                    "loader",
+                    loaders,
+                    stat,
+                )
+            )
+
+    admission = app.get("ADMISSION")
+    if admission is not None and admission.gates:
+        stats = admission.stats
+        for cls, stat, help in [
+            (Gauge, "active", "Requests admitted and being served."),
+            (Gauge, "queue_length", "Requests waiting for admission."),
+            (Counter, "admitted", "Requests admitted."),
+            (Counter, "rejected", "Requests turned away."),
+            (Counter, "timed_out", "Requests turned away after waiting."),
+        ]:
+            name = "admission_{}{}".format(stat, "_total" if cls is Counter else "")
+            metrics.append(_stats_metric(cls, name, help, "route", stats, stat))
+
+    limiters = {
+        name: {"keys": len(app[key]), "throttled": app[key].throttled}
+        for name, key in [
+            ("client", "LOGIN_THROTTLE_BY_CLIENT"),
+            ("email", "LOGIN_THROTTLE_BY_EMAIL"),
+        ]
+        if app.get(key) is not None
+    }
+    if limiters:
+        metrics.append(
+            _stats_metric(
+                Gauge,
+                "login_throttle_keys",
+                "Keys tracked by login throttling.",
+                "by",
+                limiters,
+                "keys",
+            )
+        )
+        metrics.append(
+            _stats_metric(
+                Counter,
+                "login_throttled_total",
+                "Login attempts throttled.",
+                "by",
+                limiters,
+                "throttled",
+            )
+        )
+
+    return metrics
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """
+    Record the latency and status of requests, by route, and the number
+    of requests in flight.
+    """
+    metrics = request.config_dict.get("METRICS")
+    if metrics is None:
+        return await handler(request)
+
+    route = request.match_info.route
+    key = (
+        request.method,
+        route.resource.canonical if route.resource is not None else "unmatched",
+    )
+    status = 500
+    metrics.requests_in_flight += 1
+    start = perf_counter()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    except asyncio.CancelledError:
+        # the client went away, told apart from server errors by convention
+        status = 499
+        raise
+    finally:
+        metrics.requests_in_flight -= 1
+        metrics.request_duration.observe(perf_counter() - start, key)
+        metrics.responses.inc(key + (status,))
+
+
+async def manage_metrics(app):
+    """
+    Initialize the metrics of argument app, unless they're turned off.
+
+    Must come before the components it instruments, in the app's cleanup context.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    metrics = None
+    if app["METRICS_ENABLED"]:
+        metrics = AppMetrics()
+        metrics.registry.add_collector(lambda: collect_app_stats(app))
+    app["METRICS"] = metrics
+    yield
@@ -0,0 +1,271 @@
+"""
+Profiling of single requests, for development and tests.
+
+A request opts in with an `X-Profile` header, or a `profile` query parameter,
+naming the kind of profile to take:
+
+- "wall", cProfile timing functions by wall-clock time,
+- "cpu", cProfile timing functions by CPU time of the process,
+- "memory", tracemalloc tracking the memory allocated and not yet freed.
+
+The response carries the id of the profile in an `X-Profile-Id` header, unless
+it was streamed, and the profile is kept among the latest few, to be listed on
+/debug/profiles/ and downloaded from /debug/profiles/{id}.
+
+Profiles are of everything the event loop runs while the request is served,
+requests served alongside it included, so they are best taken on an otherwise
+idle app. Only one profile is taken at a time, other requests opting in are
+turned away with a `409 Conflict`. Requests not opting in are served as usual.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict, defaultdict
+
+from aiohttp import web
+
+modes = ("wall", "cpu", "memory")
+
+# number of frames of tracebacks of memory allocations kept
+memory_traceback_limit = 25
+# number of the largest sources of allocated memory kept per memory profile
+memory_top = 200
+
+
+class Profile:
+    """
+    Profile of a request.
+
+    The stats of cProfile profiles are kept as `pstats.Stats`, and those of
+    memory profiles as a list of pairs of traceback, outermost frame first,
+    and the size in bytes of the memory allocated there and not yet freed.
+    """
+
+    def __init__(self, id, mode, method, path):
+        self.id = id
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.status = None
+        self.duration = None
+        self.taken_at = time.time()
+        self.stats = None
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration": self.duration,
+            "taken_at": self.taken_at,
+        }
+
+
+class ProfileStore:
+    """
+    Latest `maxlen` profiles taken, by id.
+    """
+
+    def __init__(self, maxlen=20):
+        self.maxlen = maxlen
+        self.busy = False
+        self._profiles = OrderedDict()
+        self._last_id = 0
+
+    def new(self, mode, method, path):
+        self._last_id += 1
+        profile = Profile(self._last_id, mode, method, path)
+        self._profiles[profile.id] = profile
+        while len(self._profiles) > self.maxlen:
+            self._profiles.popitem(last=False)
+        return profile
+
+    def get(self, id):
+        return self._profiles.get(id)
+
+    def __iter__(self):
+        return iter(self._profiles.values())
+
+
+def _format_pstats_func(func):
+    filename, lineno, name = func
+    return "{}:{}({})".format(filename, lineno, name) if lineno else name
+
+
+def _collapse_pstats(stats, max_depth=64):
+    """
+    Return argument stats as collapsed stacks, weighted in microseconds.
+
+    cProfile records calls between pairs of functions, not whole stacks, so
+    stacks are rebuilt walking down from the functions no one called, sharing
+    each function's own time among its callers by the time of their calls.
+    """
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, call in callers.items():
+            callees[caller].append((func, call[3]))
+
+    weights = defaultdict(float)
+
+    def _walk(func, stack, share):
+        _, _, own_time, total_time, _ = stats.stats[func]
+        stack = stack + (_format_pstats_func(func),)
+        weights[stack] += own_time * share
+        if len(stack) >= max_depth:
+            return
+        for callee, call_time in callees[func]:
+            callee_total_time = stats.stats[callee][3]
+            label = _format_pstats_func(callee)
+            if callee_total_time > 0 and label not in stack:
+                _walk(callee, stack, share * call_time / callee_total_time)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            _walk(func, (), 1.0)
+
+    return "".join(
+        "{} {}\n".format(";".join(stack), round(weight * 1e6))
+        for stack, weight in weights.items()
+        if round(weight * 1e6) > 0
+    )
+
+
+def _collapse_memory(stats):
+    return "".join(
+        "{} {}\n".format(";".join(frames), size) for frames, size in stats if size > 0
+    )
+
+
+def render_profile(profile, format):
+    """
+    Return a pair of the body and content type of argument profile
+    in argument format, "text", "pstats" or "collapsed".
+
+    Raise ValueError if the profile can't be had in that format.
+    """
+    if profile.mode == "memory":
+        if format == "collapsed":
+            return _collapse_memory(profile.stats).encode("utf-8"), "text/plain"
+        if format == "text":
+            lines = [
+                "{:>12} B  {}".format(size, frames[-1])
+                for frames, size in profile.stats
+            ]
+            return "\n".join(lines).encode("utf-8"), "text/plain"
+        raise ValueError("memory profiles come as text or collapsed stacks")
+
+    if format == "pstats":
+        # as written by `pstats.Stats.dump_stats`, for loading with `pstats.Stats`
+        return marshal.dumps(profile.stats.stats), "application/octet-stream"
+    if format == "collapsed":
+        return _collapse_pstats(profile.stats).encode("utf-8"), "text/plain"
+    if format == "text":
+        stream = io.StringIO()
+        stats = pstats.Stats(stream=stream)
+        stats.add(profile.stats)
+        stats.sort_stats("cumulative").print_stats(50)
+        return stream.getvalue().encode("utf-8"), "text/plain"
+    raise ValueError("unknown format: {!r}".format(format))
+
+
+def _get_mode(request):
+    mode = request.headers.get("X-Profile")
+    if mode is None and "profile=" in request.query_string:
+        mode = request.query.get("profile")
+    return mode
+
+
+async def _run_profiled(profile, request, handler):
+    if profile.mode == "memory":
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(memory_traceback_limit)
+        before = tracemalloc.take_snapshot()
+        try:
+            return await handler(request)
+        finally:
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            profile.stats = []
+            for diff in after.compare_to(before, "traceback")[:memory_top]:
+                frames = [
+                    "{}:{}".format(frame.filename, frame.lineno)
+                    for frame in diff.traceback
+                ]
+                # tracebacks come most recent frame first before Python 3.7
+                if sys.version_info < (3, 7):
+                    frames.reverse()
+                profile.stats.append((frames, diff.size_diff))
+
+    # cProfile times by wall-clock time unless handed another timer
+    if profile.mode == "cpu":
+        profiler = cProfile.Profile(time.process_time)
+    else:
+        profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return await handler(request)
+    finally:
+        profiler.disable()
+        profile.stats = pstats.Stats(profiler)
+
+
+@web.middleware
+async def profiling_middleware(request, handler):
+    """
+    Profile requests opting in, as described in the docs of the module.
+    """
+    mode = _get_mode(request)
+    profiles = request.config_dict.get("PROFILES")
+    if mode is None or profiles is None:
+        return await handler(request)
+
+    if mode not in modes:
+        return web.json_response(
+            {"error": "unknown profile mode", "modes": modes},
+            status=400,
+            reason="Bad Request",
+        )
+    if profiles.busy:
+        return web.json_response(
+            {"error": "a profile is being taken already"},
+            status=409,
+            reason="Conflict",
+        )
+
+    profile = profiles.new(mode, request.method, request.path)
+    profiles.busy = True
+    start = time.perf_counter()
+    try:
+        response = await _run_profiled(profile, request, handler)
+    except web.HTTPException as exc:
+        profile.status = exc.status
+        exc.headers["X-Profile-Id"] = str(profile.id)
+        raise
+    finally:
+        profile.duration = time.perf_counter() - start
+        profiles.busy = False
+
+    profile.status = response.status
+    if not response.prepared:
+        response.headers["X-Profile-Id"] = str(profile.id)
+    return response
+
+
+async def manage_profiles(app):
+    """
+    Initialize the store of request profiles of argument app.
+
+    Set up for development and test apps only, see `app.init_dev_app`.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    app["PROFILES"] = ProfileStore(maxlen=app["PROFILES_MAXLEN"])
+    yield
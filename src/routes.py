@@ -1,10 +1,109 @@
+import asyncio
+import csv
+import hmac
+import io
+import json
+import math
+import re
 import sqlite3
 
+import jwt
 from aiohttp import web
 
 import auth
+import authentication
+import importing
+import metrics
+import profiling
+from caching import MISSING
 from config import routes
-from db.utils import get_table_fullname
+
+
+def _get_credentials_cache_key(email):
+    # credentials are looked up by exact email, so the cache must not fold
+    # emails differing in case, lest one's credentials be served for another's
+    return email.strip()
+
+
+async def get_credentials(request, email):
+    """
+    Return the id and password hash of the user with argument email,
+    None if there's no such user.
+    """
+    cache = request.config_dict["CREDENTIALS_CACHE"]
+    key = _get_credentials_cache_key(email)
+    row = cache.get(key)
+
+    if row is None:
+        generation = cache.generation
+        # concurrent lookups of an email share a query,
+        # and lookups of distinct emails are queried together
+        row = await request.config_dict["CREDENTIALS_LOADER"].load(email)
+        # unknown emails are cached too, so floods of them stay off the database
+        cache.set(key, MISSING if row is None else row, generation=generation)
+
+    return None if row is MISSING else row
+
+
+def invalidate_credentials(request, email):
+    """
+    Drop cached credentials of argument email.
+    Must be called whenever a user's email or password hash changes.
+    """
+    request.config_dict["CREDENTIALS_CACHE"].invalidate(
+        _get_credentials_cache_key(email)
+    )
+    request.config_dict["CREDENTIALS_LOADER"].forget(email)
+
+
+async def get_refresh_key(request, uid):
+    """
+    Return the key refresh tokens of the user with argument uid must carry,
+    None if there's no such user.
+    """
+    cache = request.config_dict["REFRESH_KEYS_CACHE"]
+    key = cache.get(uid)
+
+    if key is None:
+        generation = cache.generation
+        pwd_hash = await request.config_dict["PWD_HASH_LOADER"].load(uid)
+        # only the key derived from the password hash is kept around
+        key = MISSING if pwd_hash is None else auth._gen_refresh_key(uid, pwd_hash)
+        cache.set(uid, key, generation=generation)
+
+    return None if key is MISSING else key
+
+
+def invalidate_refresh_key(request, uid):
+    """
+    Drop the cached refresh key of argument uid.
+    Must be called whenever a user's password hash changes.
+    """
+    request.config_dict["REFRESH_KEYS_CACHE"].invalidate(uid)
+    request.config_dict["PWD_HASH_LOADER"].forget(uid)
+
+
+async def _insert_user(request, email, username, pwd_hash):
+    result = await request.config_dict["DB_WRITES"].execute(
+        request.config_dict["STMTS"]["users_insert"], (email, username, pwd_hash)
+    )
+    # without RETURNING, the new row is made of what was just inserted
+    row = result.row or {"id": result.lastrowid, "username": username, "email": email}
+
+    invalidate_credentials(request, email)
+    invalidate_refresh_key(request, row["id"])
+    return row
+
+
+async def create_user(request, email, username, pwd_hash):
+    """
+    Insert a user, and return their row.
+
+    Shielded from cancellation, since a write once queued is committed
+    whether its caller waits or not, and its email must then be dropped
+    from the cache, lest it be taken for unknown until the entry expires.
+    """
+    return await asyncio.shield(_insert_user(request, email, username, pwd_hash))
 
 
 @routes.post("/users/")
@@ -24,31 +123,17 @@ async def handle_user_create(request):
             {"error": "invalid email"}, status=400, reason="Bad Request"
         )
 
-    if not auth.validate_password(password, username=username, email=email):
+    rule = auth.check_password(password, username=username, email=email)
+    if rule is not None:
         return web.json_response(
-            {"error": "bad password"}, status=400, reason="Bad Request"
+            {"error": "bad password", "rule": rule}, status=400, reason="Bad Request"
         )
 
-    mode = "test" if request.config_dict["TEST"] else ""
-    users_table = get_table_fullname("users", mode)
-
-    conn = request.config_dict["DB_CONN"]
-    cursor = await conn.cursor()
+    pwd_hash = await request.config_dict["HASHER"].hash(password)
 
     try:
-        await cursor.execute(
-            """
-            INSERT INTO {table_fullname}
-            (email, username, pwd_hash)
-            VALUES
-            (?,?,?)
-            """.format(
-                table_fullname=users_table
-            ),
-            (email, username, auth.get_password_hash(password)),
-        )
+        row = await create_user(request, email, username, pwd_hash)
     except sqlite3.IntegrityError as exc:
-        await conn.rollback()
         if "email" in str(exc):
             return web.json_response(
                 {"error": "user with that email already exists"},
@@ -61,17 +146,7 @@ async def handle_user_create(request):
                 status=409,
                 reason="Conflict",
             )
-
-    await conn.commit()
-    await cursor.execute(
-        """
-        SELECT id, username, email FROM {table_fullname} WHERE id = (?)
-        """.format(
-            table_fullname=users_table
-        ),
-        [cursor.lastrowid],
-    )
-    row = await cursor.fetchone()
+        raise
 
     return web.json_response(
         {
@@ -86,37 +161,222 @@ async def handle_user_create(request):
     )
 
 
+@routes.post("/users/import/")
+@authentication.admin_required
+async def handle_users_import(request):
+    response = web.StreamResponse(
+        status=200, reason="Ok", headers={"Content-Type": "application/x-ndjson"}
+    )
+    await response.prepare(request)
+
+    results = importing.import_users(
+        request.content,
+        request.config_dict["DB_POOL"],
+        request.config_dict["STMTS"],
+        request.config_dict["HASHER"],
+        chunk_size=request.config_dict["IMPORT_CHUNK_SIZE"],
+        hash_bounds=importing.get_hash_bounds(request.config_dict),
+    )
+    async for result in results:
+        if "id" in result:
+            invalidate_credentials(request, result["email"])
+            invalidate_refresh_key(request, result["id"])
+        await response.write(json.dumps(result).encode("utf-8") + b"\n")
+
+    await response.write_eof()
+    return response
+
+
+user_fields = ["id", "username", "email"]
+
+
+def _parse_users_query(request):
+    """
+    Return the parameters of the users page argument request asks for,
+    None if any of them is invalid.
+    """
+    query = request.query
+    max_limit = request.config_dict["USERS_PAGE_SIZE_MAX"]
+    try:
+        after = int(query.get("after", 0))
+        limit = int(
+            query.get("limit", min(request.config_dict["USERS_PAGE_SIZE"], max_limit))
+        )
+    except ValueError:
+        return None
+    if not 0 < limit <= max_limit:
+        return None
+
+    email_pattern = None
+    if "email_domain" in query:
+        # wildcards in the domain are taken literally
+        domain = re.sub(r"([\\%_])", r"\\\1", query["email_domain"].strip())
+        email_pattern = "%@" + domain
+
+    return {
+        "after": after,
+        "limit": limit,
+        "username_prefix": query.get("username_prefix"),
+        "email_pattern": email_pattern,
+    }
+
+
+async def iter_users_pages(request, params):
+    """
+    Yield the pages of users matching argument params, from the page they
+    start at on, each page read by a query of its own.
+
+    No reader is held, and no read transaction kept open, between pages.
+    """
+    params = dict(params)
+    while True:
+        async with request.config_dict["DB_POOL"].reader() as conn:
+            cursor = await conn.execute(
+                request.config_dict["STMTS"]["users_select_page"], params
+            )
+            rows = await cursor.fetchall()
+            await cursor.close()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < params["limit"]:
+            return
+        params["after"] = rows[-1]["id"]
+
+
+def _format_ndjson(rows, header=False):
+    return "".join(
+        json.dumps({field: row[field] for field in user_fields}) + "\n"
+        for row in rows
+    )
+
+
+def _format_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(user_fields)
+    writer.writerows([[row[field] for field in user_fields] for row in rows])
+    return buffer.getvalue()
+
+
+export_formats = {
+    "ndjson": ("application/x-ndjson", _format_ndjson),
+    "csv": ("text/csv", _format_csv),
+}
+
+
+@routes.get("/users/")
+@authentication.admin_required
+async def handle_users_list(request):
+    params = _parse_users_query(request)
+    if params is None:
+        return web.json_response(
+            {"error": "invalid query"}, status=400, reason="Bad Request"
+        )
+
+    export_format = request.query.get("format", "json")
+    if export_format != "json":
+        if export_format not in export_formats:
+            return web.json_response(
+                {"error": "invalid format"}, status=400, reason="Bad Request"
+            )
+        return await _export_users(request, params, *export_formats[export_format])
+
+    # one more user than asked for tells whether there's a next page
+    page_params = dict(params, limit=params["limit"] + 1)
+    async with request.config_dict["DB_POOL"].reader() as conn:
+        cursor = await conn.execute(
+            request.config_dict["STMTS"]["users_select_page"], page_params
+        )
+        rows = await cursor.fetchall()
+        await cursor.close()
+
+    rows, more = rows[: params["limit"]], len(rows) > params["limit"]
+    next_url = None
+    if more:
+        next_url = str(request.rel_url.update_query(after=rows[-1]["id"]))
+
+    return web.json_response(
+        {
+            "data": [{field: row[field] for field in user_fields} for row in rows],
+            "next": next_url,
+        },
+        status=200,
+        reason="Ok",
+    )
+
+
+async def _export_users(request, params, content_type, format_rows):
+    """
+    Stream every user matching argument params, a page at a time,
+    so that memory stays flat however many there are.
+    """
+    params = dict(params, limit=request.config_dict["USERS_PAGE_SIZE_MAX"])
+    response = web.StreamResponse(
+        status=200, reason="Ok", headers={"Content-Type": content_type}
+    )
+    await response.prepare(request)
+
+    await response.write(format_rows([], header=True).encode("utf-8"))
+    async for rows in iter_users_pages(request, params):
+        await response.write(format_rows(rows).encode("utf-8"))
+
+    await response.write_eof()
+    return response
+
+
 @routes.post("/login/")
 async def handle_user_login(request):
     data = await request.json()
     email = data["email"].strip()
     password = data["password"].strip()
 
-    mode = "test" if request.config_dict["TEST"] else ""
-    users_table = get_table_fullname("users", mode)
-
-    conn = request.config_dict["DB_CONN"]
-    cursor = await conn.cursor()
+    # throttle clients and emails with too many failed attempts,
+    # before spending any database or hashing work on them
+    throttles = [
+        (request.config_dict["LOGIN_THROTTLE_BY_CLIENT"], request.remote),
+        (request.config_dict["LOGIN_THROTTLE_BY_EMAIL"], email),
+    ]
+    retry_after = max(limiter.check(key) for limiter, key in throttles)
+    if retry_after:
+        return web.json_response(
+            {"error": "too many login attempts, try again later"},
+            status=429,
+            reason="Too Many Requests",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    # every attempt is counted up front, so that concurrent attempts can't
+    # slip through before the first ones fail
+    for limiter, key in throttles:
+        limiter.take(key)
 
-    await cursor.execute(
-        """
-        SELECT id, pwd_hash FROM {table_fullname} WHERE email = (?)
-        """.format(
-            table_fullname=users_table
-        ),
-        [email],
-    )
-    row = await cursor.fetchone()
+    row = await get_credentials(request, email)
 
-    if not (row and auth.check_password_hash(password, row["pwd_hash"])):
+    hasher = request.config_dict["HASHER"]
+    if not (row and await hasher.verify(password, row["pwd_hash"])):
         return web.json_response(
             {"error": "user with given credentials not found"},
             status=404,
             reason="Not Found",
         )
 
-    access_token = auth.gen_access_token(uid=row["id"])
-    refresh_token = auth.gen_refresh_token(uid=row["id"], password_hash=row["pwd_hash"])
+    for limiter, key in throttles:
+        limiter.give_back(key)
+
+    def on_rehashed():
+        invalidate_credentials(request, email)
+        invalidate_refresh_key(request, row["id"])
+
+    # the hash is brought to the current work factor in the background,
+    # the plaintext being at hand, without holding the login up
+    request.config_dict["REHASHER"].submit(
+        row["id"], password, row["pwd_hash"], on_rehashed=on_rehashed
+    )
+
+    access_token, refresh_token = request.config_dict["TOKENS"].mint_login_tokens(
+        row["id"], row["pwd_hash"]
+    )
 
     return web.json_response(
         {
@@ -129,3 +389,97 @@ async def handle_user_login(request):
         status=200,
         reason="Ok",
     )
+
+
+@routes.post("/token/refresh/")
+async def handle_token_refresh(request):
+    data = await request.json()
+    token = data.get("refresh_token")
+
+    if not isinstance(token, str):
+        return web.json_response(
+            {"error": "refresh token required"}, status=400, reason="Bad Request"
+        )
+
+    try:
+        claims = authentication.verify_refresh_token(
+            token, request.config_dict["JWT_SECRET"]
+        )
+    except jwt.InvalidTokenError:
+        claims = None
+
+    # refresh tokens issued before the user's password hash changed,
+    # or to users who are no more, carry a key that doesn't match
+    key = claims and await get_refresh_key(request, claims["uid"])
+    if not (key and hmac.compare_digest(key, claims["key"])):
+        return web.json_response(
+            {"error": "invalid refresh token"}, status=401, reason="Unauthorized"
+        )
+
+    access_token = request.config_dict["TOKENS"].mint_access_token(claims["uid"])
+
+    return web.json_response(
+        {"data": {"id": claims["uid"], "access_token": access_token}},
+        status=200,
+        reason="Ok",
+    )
+
+
+@routes.get("/metrics")
+async def handle_metrics(request):
+    app_metrics = request.config_dict.get("METRICS")
+    if app_metrics is None:
+        raise web.HTTPNotFound()
+
+    return web.Response(
+        body=app_metrics.render().encode("utf-8"),
+        headers={"Content-Type": metrics.content_type},
+    )
+
+
+@routes.get("/debug/stalls")
+async def handle_stalls(request):
+    detector = request.config_dict.get("STALLS")
+    if detector is None:
+        raise web.HTTPNotFound()
+
+    return web.json_response({"data": detector.report()}, status=200, reason="Ok")
+
+
+@routes.get("/debug/profiles/")
+async def handle_profiles_list(request):
+    profiles = request.config_dict.get("PROFILES")
+    if profiles is None:
+        raise web.HTTPNotFound()
+
+    return web.json_response(
+        {"data": [profile.summary() for profile in profiles]}, status=200, reason="Ok"
+    )
+
+
+@routes.get(r"/debug/profiles/{id:\d+}")
+async def handle_profile_download(request):
+    profiles = request.config_dict.get("PROFILES")
+    profile = profiles and profiles.get(int(request.match_info["id"]))
+    if profile is None:
+        raise web.HTTPNotFound()
+    if profile.stats is None:
+        return web.json_response(
+            {"error": "profile is being taken"}, status=409, reason="Conflict"
+        )
+
+    format = request.query.get("format", "text")
+    try:
+        body, content_type = profiling.render_profile(profile, format)
+    except ValueError as exc:
+        return web.json_response({"error": str(exc)}, status=400, reason="Bad Request")
+
+    return web.Response(
+        body=body,
+        content_type=content_type,
+        headers={
+            "Content-Disposition": 'attachment; filename="profile-{}.{}"'.format(
+                profile.id, "txt" if format == "text" else format
+            )
+        },
+    )
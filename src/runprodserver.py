@@ -0,0 +1,331 @@
+"""
+Serve the production app from several worker processes at once.
+
+Every worker builds its own app from `demo_options`, and binds the same host
+and port with SO_REUSEPORT, so that the kernel spreads connections across
+them. Workers share one WAL-mode database, whose migrations are applied once,
+by the supervising process, before any worker starts. So is the bcrypt work
+factor calibrated, when none is set, so that every worker hashes at the same
+one, timed on an idle machine.
+
+The supervisor respawns workers that exit, and kills and respawns workers
+whose event loop stops beating. On SIGHUP it restarts workers one at a time,
+starting each replacement and waiting for it to listen before stopping the
+worker it replaces, which finishes the requests it's serving first. Workers
+are spawned rather than forked, so restarted workers run the code on disk.
+On SIGTERM or SIGINT it stops every worker the same way, and exits.
+
+Caches are kept per worker, so a worker may answer from an entry another
+worker has invalidated, until the entry expires. Connections still queued
+on a worker's socket as it stops listening may be reset, as SO_REUSEPORT
+doesn't hand them over to the other workers.
+
+Run from the src directory with
+
+    python runprodserver.py [--host HOST] [--port PORT] [--workers N]
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from aiohttp import web
+
+import blocklist
+import config
+import hashing
+
+logger = logging.getLogger("runprodserver")
+
+# database mode and pragma profile of production apps,
+# see `config.get_db_mode` and `config.get_db_profile`
+db_mode = ""
+db_profile = "prod"
+
+
+async def _serve(heartbeat, host, port, shutdown_timeout, settings, heartbeat_interval):
+    # have to import the routes file
+    # so that the routes will be registered
+    import routes  # noqa
+    from app import demo_options, init_prod_app
+
+    loop = asyncio.get_event_loop()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    app = init_prod_app(
+        **demo_options, SETTINGS=dict(settings or {}, DB_MIGRATE_ON_STARTUP=False)
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(
+        runner, host, port, shutdown_timeout=shutdown_timeout, reuse_port=True
+    )
+    await site.start()
+    try:
+        while not stopping.is_set():
+            heartbeat.value = time.time()
+            try:
+                await asyncio.wait_for(stopping.wait(), heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await runner.cleanup()
+
+
+def serve(
+    heartbeat, host, port, shutdown_timeout=60.0, settings=None, heartbeat_interval=1.0
+):
+    """
+    Serve a production app on argument host and port, next to the other
+    workers, until sent SIGTERM or SIGINT, with argument settings over
+    the default ones.
+
+    Argument heartbeat, a shared double, is set to the time every
+    heartbeat_interval seconds once the app listens.
+    """
+    # hangups are for the supervisor to act on
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    asyncio.get_event_loop().run_until_complete(
+        _serve(heartbeat, host, port, shutdown_timeout, settings, heartbeat_interval)
+    )
+
+
+class Worker:
+    """
+    Process running argument target, with a shared heartbeat as first argument.
+    """
+
+    def __init__(self, context, target, args=()):
+        self.heartbeat = context.Value("d", 0.0, lock=False)
+        self.process = context.Process(target=target, args=(self.heartbeat, *args))
+        self.started_at = None
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def start(self):
+        self.started_at = time.time()
+        self.process.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def is_ready(self):
+        """
+        Return True if the worker beat at least once, that is, it listens.
+        """
+        return self.heartbeat.value > 0.0
+
+    def is_unresponsive(self, timeout):
+        """
+        Return True if the worker didn't beat for argument timeout seconds,
+        or, still booting, didn't beat at all since then.
+        """
+        last_beat = self.heartbeat.value or self.started_at
+        return time.time() - last_beat > timeout
+
+    def wait_ready(self, timeout, poll_interval=0.05):
+        """
+        Return True once the worker is ready, False if it exits
+        or argument timeout seconds run out first.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.is_ready():
+                return True
+            if not self.is_alive():
+                return False
+            time.sleep(poll_interval)
+        return self.is_ready()
+
+    def stop(self, timeout):
+        """
+        Ask the worker to finish its requests and exit, and kill it if it
+        hasn't within argument timeout seconds.
+        """
+        if self.is_alive():
+            os.kill(self.pid, signal.SIGTERM)
+            self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.is_alive():
+            os.kill(self.pid, signal.SIGKILL)
+        self.process.join()
+
+
+class Supervisor:
+    """
+    Keep argument number of workers running argument target, and restart them.
+
+    Workers that exit are respawned, and workers that go without a heartbeat
+    for heartbeat_timeout seconds, or boot_timeout seconds while booting,
+    are killed and respawned. Stopping workers get shutdown_timeout seconds
+    to finish their requests.
+    """
+
+    def __init__(
+        self,
+        target,
+        args=(),
+        workers=None,
+        shutdown_timeout=60.0,
+        boot_timeout=60.0,
+        heartbeat_timeout=10.0,
+        check_interval=1.0,
+    ):
+        self.target = target
+        self.args = args
+        self.size = workers or os.cpu_count() or 1
+        self.shutdown_timeout = shutdown_timeout
+        self.boot_timeout = boot_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.check_interval = check_interval
+        self.workers = []
+        self.respawned = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._restart_requested = False
+        self._stop_requested = False
+
+    def _spawn(self):
+        worker = Worker(self._context, self.target, self.args)
+        worker.start()
+        return worker
+
+    def start(self):
+        """
+        Start the workers, and return True once all of them are ready,
+        False, with none left running, if any of them didn't make it.
+        """
+        self.workers = [self._spawn() for _ in range(self.size)]
+        if all(worker.wait_ready(self.boot_timeout) for worker in self.workers):
+            logger.info("%d workers ready", self.size)
+            return True
+        logger.error("workers failed to start")
+        self.stop()
+        return False
+
+    def check(self):
+        """
+        Respawn workers that exited or stopped beating.
+        """
+        for slot, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                logger.warning(
+                    "worker %d exited with code %s", worker.pid, worker.process.exitcode
+                )
+            elif worker.is_unresponsive(
+                self.heartbeat_timeout if worker.is_ready() else self.boot_timeout
+            ):
+                logger.warning("worker %d is unresponsive, killing it", worker.pid)
+                worker.kill()
+            else:
+                continue
+            self.workers[slot] = self._spawn()
+            self.respawned += 1
+
+    def restart(self):
+        """
+        Replace the workers one at a time, each only once its replacement
+        is ready. Return False if a replacement didn't make it, leaving
+        the workers not yet replaced running.
+        """
+        for slot, worker in enumerate(self.workers):
+            replacement = self._spawn()
+            if not replacement.wait_ready(self.boot_timeout):
+                logger.error("replacement worker failed to start, restart aborted")
+                replacement.kill()
+                return False
+            self.workers[slot] = replacement
+            worker.stop(self.shutdown_timeout)
+        logger.info("%d workers restarted", self.size)
+        return True
+
+    def stop(self):
+        """
+        Stop every worker, all at once.
+        """
+        for worker in self.workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+        deadline = time.time() + self.shutdown_timeout
+        for worker in self.workers:
+            worker.process.join(max(0.0, deadline - time.time()))
+            worker.kill()
+        self.workers = []
+
+    def _request_restart(self, signum, frame):
+        self._restart_requested = True
+
+    def _request_stop(self, signum, frame):
+        self._stop_requested = True
+
+    def run(self):
+        """
+        Start the workers, and supervise them until sent SIGTERM or SIGINT,
+        restarting them on SIGHUP.
+
+        Return False if they failed to start.
+        """
+        signal.signal(signal.SIGHUP, self._request_restart)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        if not self.start():
+            return False
+
+        while not self._stop_requested:
+            time.sleep(self.check_interval)
+            if self._restart_requested:
+                self._restart_requested = False
+                self.restart()
+            self.check()
+
+        self.stop()
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the production app.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shutdown-timeout", type=float, default=60.0)
+    parser.add_argument("--boot-timeout", type=float, default=60.0)
+    parser.add_argument("--heartbeat-timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s[%(process)d] %(message)s"
+    )
+
+    # once, ahead of the workers, so that they don't race to
+    asyncio.get_event_loop().run_until_complete(config.migrate_db(db_mode, db_profile))
+    blocklist.get_common_password_ngrams()
+    settings = {}
+    if hashing.needs_calibration(config.default_settings):
+        settings["HASHER_WORKFACTOR"] = hashing.calibrate_workfactor(
+            config.default_settings["HASHER_TIME_BUDGET"],
+            *config.default_settings["HASHER_WORKFACTOR_RANGE"]
+        )
+        logger.info("hashing at bcrypt work factor %d", settings["HASHER_WORKFACTOR"])
+
+    supervisor = Supervisor(
+        serve,
+        args=(args.host, args.port, args.shutdown_timeout, settings),
+        workers=args.workers,
+        shutdown_timeout=args.shutdown_timeout,
+        boot_timeout=args.boot_timeout,
+        heartbeat_timeout=args.heartbeat_timeout,
+    )
+    logger.info("serving on %s:%d", args.host, args.port)
+    return 0 if supervisor.run() else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,203 @@
+"""
+Detection of event loop stalls, for development and tests.
+
+A callback on the loop ticks every `interval` seconds, and a watchdog thread
+checks on the time of its last tick. Once the loop has gone `threshold`
+seconds without ticking, something is running without yielding, and the
+watchdog samples the stack of the loop's thread every `interval` seconds,
+until the loop ticks again.
+
+Each stall is put down to the call site sampled most during it, the innermost
+frame of code under `root`, so that a blocking call is reported where the app
+makes it rather than deep in a library. Stalls are ranked by the total time
+they blocked the loop, per call site.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+import config
+
+# call site of stalls that ended before the watchdog sampled them
+unsampled = "<unsampled>"
+
+logger = logging.getLogger("stalls")
+
+
+class StallStats:
+    """
+    Stalls put down to a single call site.
+    """
+
+    def __init__(self, site):
+        self.site = site
+        self.stalls = 0
+        self.total = 0.0
+        self.max = 0.0
+        # stack sampled at the site during its latest stall, innermost last
+        self.stack = []
+
+    def add(self, duration, stack):
+        self.stalls += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if stack:
+            self.stack = stack
+
+    def as_dict(self):
+        return {
+            "site": self.site,
+            "stalls": self.stalls,
+            "total": round(self.total, 6),
+            "max": round(self.max, 6),
+            "stack": self.stack,
+        }
+
+
+class StallDetector:
+    """
+    Watch an event loop for stalls longer than `threshold` seconds.
+    """
+
+    def __init__(self, threshold=0.1, interval=0.01, root=None, clock=time.monotonic):
+        self.threshold = threshold
+        self.interval = interval
+        self.root = None if root is None else str(root)
+        self._clock = clock
+
+        self._loop = None
+        self._thread_id = None
+        self._handle = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+        self._last_tick = None
+        # maps call sites to their stats, updated by the watchdog
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def start(self, loop):
+        """
+        Start watching argument loop. Must be called from the loop's thread.
+        """
+        self._loop = loop
+        self._thread_id = threading.get_ident()
+        self._tick()
+        self._watchdog = threading.Thread(
+            target=self._watch, name="stall-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+        if self._handle is not None:
+            self._handle.cancel()
+
+    def _tick(self):
+        self._last_tick = self._clock()
+        self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def _get_site(self, stack):
+        """
+        Return the innermost frame of argument stack, outermost first,
+        whose code is under root, or else the innermost frame.
+        """
+        for frame in reversed(stack):
+            if self.root is None or frame.filename.startswith(self.root):
+                return frame
+        return stack[-1] if stack else None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return None, []
+        stack = traceback.extract_stack(frame)
+        return (
+            _format_frame(self._get_site(stack)),
+            [_format_frame(frame) for frame in stack],
+        )
+
+    def _watch(self):
+        last_tick = self._last_tick
+        # maps the call sites sampled during the stall in progress to their
+        # number of samples, and to the latest stack sampled there
+        samples = Counter()
+        stacks = {}
+
+        while not self._stopping.wait(self.interval):
+            tick = self._last_tick
+            if tick != last_tick:
+                # the loop ticked since last checked, ending any stall
+                duration = tick - last_tick - self.interval
+                if duration >= self.threshold:
+                    self._record(duration, samples, stacks)
+                samples.clear()
+                stacks.clear()
+                last_tick = tick
+            elif self._clock() - tick >= self.threshold:
+                site, stack = self._sample()
+                if site is not None:
+                    samples[site] += 1
+                    stacks[site] = stack
+
+    def _record(self, duration, samples, stacks):
+        site = samples.most_common(1)[0][0] if samples else unsampled
+        with self._stats_lock:
+            stats = self._stats.get(site)
+            if stats is None:
+                stats = self._stats[site] = StallStats(site)
+            stats.add(duration, stacks.get(site, []))
+
+    def report(self):
+        """
+        Return stats of the stalls detected, by call site,
+        in decreasing order of time blocked.
+        """
+        with self._stats_lock:
+            ranked = sorted(self._stats.values(), key=lambda stats: -stats.total)
+            return [stats.as_dict() for stats in ranked]
+
+    def format_report(self, limit=10):
+        """
+        Return the report as text, with the stack of the top `limit` call sites.
+        """
+        lines = []
+        for entry in self.report()[:limit]:
+            lines.append(
+                "{total:.3f}s blocked over {stalls} stalls, at most {max:.3f}s, "
+                "at {site}".format(**entry)
+            )
+            lines.extend("    " + frame for frame in entry["stack"])
+        return "\n".join(lines)
+
+
+def _format_frame(frame):
+    return "{}:{} in {}".format(frame.filename, frame.lineno, frame.name)
+
+
+async def manage_stall_detection(app):
+    """
+    Watch the event loop of argument app for stalls, and log a report
+    of those detected at end of app's lifecycle.
+
+    Set up for development and test apps only, see `app.init_dev_app`.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    detector = StallDetector(
+        threshold=app["STALL_THRESHOLD"],
+        interval=app["STALL_SAMPLE_INTERVAL"],
+        root=config.basedir,
+    )
+    detector.start(asyncio.get_event_loop())
+    app["STALLS"] = detector
+    yield
+    detector.stop()
+    report = detector.format_report()
+    if report:
+        logger.warning("event loop stalls, worst first:\n%s", report)
@@ -47,8 +47,7 @@ class TestClientSession:
         self.client_session = aiohttp.ClientSession(**kwargs)
 
     async def __aenter__(self) -> aiohttp.ClientSession:
-        async with self.client_session as session:
-            return session
+        return await self.client_session.__aenter__()
 
     async def __aexit__(self, *args) -> None:
         await self.client_session.close()
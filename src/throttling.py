@@ -0,0 +1,173 @@
+"""
+Compact in-memory rate limiting.
+
+Limiters implement token buckets with the generic cell rate algorithm, which
+boils each bucket down to a single float: the time at which the bucket will
+be full again. A key whose bucket is full is indistinguishable from a key
+never seen, so it's simply dropped by the periodic sweep, and memory only
+grows with the keys that have been active within the last `burst / rate`
+seconds.
+"""
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    Token buckets holding up to `burst` tokens, refilled at `rate` per second,
+    one per key.
+
+    Keys are swept `sweep_slice` at a time, so that no sweep holds up the
+    event loop for long, however many keys there are.
+    """
+
+    def __init__(
+        self, rate, burst, max_keys=1000000, sweep_slice=1000, clock=time.monotonic
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.sweep_slice = sweep_slice
+        self._clock = clock
+        # seconds it takes to refill one token, and to refill a whole bucket
+        self._interval = 1.0 / rate
+        self._capacity = burst * self._interval
+        # maps keys to the time their bucket will be full again
+        self._full_at = {}
+        # keys as they were at the start of the sweep in progress,
+        # and the position of the next one to check
+        self._sweep_keys = []
+        self._sweep_position = 0
+
+        self.throttled = 0
+
+    def __len__(self):
+        return len(self._full_at)
+
+    def check(self, key):
+        """
+        Return 0 if argument key's bucket holds a token, the number of seconds
+        until it will otherwise.
+        """
+        now = self._clock()
+        full_at = max(self._full_at.get(key, now), now)
+        # the bucket holds a token as long as taking one would leave it
+        # no emptier than empty
+        wait = full_at + self._interval - now - self._capacity
+        if wait > 0:
+            self.throttled += 1
+            return wait
+        return 0.0
+
+    def take(self, key):
+        """
+        Take a token from argument key's bucket, whether it holds one or not.
+        """
+        now = self._clock()
+        self._full_at[key] = max(self._full_at.get(key, now), now) + self._interval
+        if len(self._full_at) > self.max_keys:
+            self._make_room(now)
+
+    def give_back(self, key):
+        """
+        Put a token taken from argument key's bucket back into it.
+        """
+        full_at = self._full_at.get(key)
+        if full_at is not None:
+            self._full_at[key] = full_at - self._interval
+
+    def _next_sweep_key(self):
+        """
+        Return the next key to check, starting another sweep
+        if the one in progress is over.
+        """
+        if self._sweep_position >= len(self._sweep_keys):
+            self._sweep_keys = list(self._full_at)
+            self._sweep_position = 0
+        key = self._sweep_keys[self._sweep_position]
+        self._sweep_position += 1
+        if self._sweep_position == len(self._sweep_keys):
+            # let go of the keys checked, some of which may be gone
+            self._sweep_keys = []
+        return key
+
+    def sweep(self, limit=None):
+        """
+        Drop the keys whose buckets are full, checking `limit` keys at most,
+        where the sweep in progress left off, every key if None.
+
+        Return True if the sweep in progress is over.
+        """
+        if limit is None:
+            self._sweep_keys = []
+            limit = len(self._full_at)
+        now = self._clock()
+        for _ in range(min(limit, len(self._full_at))):
+            key = self._next_sweep_key()
+            full_at = self._full_at.get(key)
+            if full_at is not None and full_at <= now:
+                del self._full_at[key]
+            if not self._sweep_keys:
+                return True
+        return not self._sweep_keys
+
+    def _make_room(self, now):
+        """
+        Drop keys down to nine tenths of `max_keys`, so that the next overflow
+        isn't due with the very next key, checking `sweep_slice` keys at most.
+
+        The keys whose buckets hold a token are dropped, full or not, so that
+        a flood of new keys can't wipe out the buckets being throttled. Only
+        should there be none of those among the keys checked are buckets being
+        throttled dropped, no more than needed to get down to `max_keys`.
+        """
+        excess = len(self._full_at) - self.max_keys + self.max_keys // 10
+        throttled = []
+        for _ in range(min(self.sweep_slice, len(self._full_at))):
+            if excess <= 0:
+                break
+            key = self._next_sweep_key()
+            full_at = self._full_at.get(key)
+            if full_at is None:
+                continue
+            if full_at + self._interval - self._capacity <= now:
+                del self._full_at[key]
+                excess -= 1
+            else:
+                throttled.append(key)
+
+        overflow = len(self._full_at) - self.max_keys
+        for key in throttled[:overflow]:
+            del self._full_at[key]
+
+
+async def _sweep_periodically(limiters, interval):
+    while True:
+        await asyncio.sleep(interval)
+        for limiter in limiters:
+            # a slice at a time, letting requests through in between
+            while not limiter.sweep(limiter.sweep_slice):
+                await asyncio.sleep(0)
+
+
+async def manage_login_throttling(app):
+    """
+    Initialize the rate limiters of login attempts for argument app, by client
+    address and by email, and sweep them periodically.
+
+    https://docs.aiohttp.org/en/stable/web_reference.html#aiohttp.web.Application.cleanup_ctx
+    """
+    app["LOGIN_THROTTLE_BY_CLIENT"] = RateLimiter(
+        *app["LOGIN_THROTTLE_CLIENT_RATE"], max_keys=app["LOGIN_THROTTLE_MAX_KEYS"]
+    )
+    app["LOGIN_THROTTLE_BY_EMAIL"] = RateLimiter(
+        *app["LOGIN_THROTTLE_EMAIL_RATE"], max_keys=app["LOGIN_THROTTLE_MAX_KEYS"]
+    )
+    sweeper = asyncio.ensure_future(
+        _sweep_periodically(
+            [app["LOGIN_THROTTLE_BY_CLIENT"], app["LOGIN_THROTTLE_BY_EMAIL"]],
+            app["LOGIN_THROTTLE_SWEEP_INTERVAL"],
+        )
+    )
+    yield
+    sweeper.cancel()
@@ -2,8 +2,9 @@ import aiosqlite
 
 import pytest
 
+from db.pool import ConnectionPool
 from src.config import basedir
-from src.db import stmts
+from src.db import migrations, stmts
 from src.db.utils import get_db_path
 
 
@@ -30,10 +31,11 @@ async def fixture_manage_users_table(test_db_path):
 
     NOT SO MUCH A TRICK:
     This fixture ensures that the test starts with a fresh table
-    by dropping stale table before test run, and creating fresh table afterwards.
+    by dropping stale table before test run, and migrating to a fresh table
+    afterwards.
     """
 
-    table_create_stmt, table_drop_stmt = stmts.get_create_drop_stmts(
+    _, table_drop_stmt = stmts.get_create_drop_stmts(
         stmts.users_table_create_template, table_name="users", mode="test"
     )
 
@@ -41,12 +43,32 @@ async def fixture_manage_users_table(test_db_path):
         conn.row_factory = aiosqlite.Row
         cursor = await conn.cursor()
         await cursor.execute(table_drop_stmt)
+        await cursor.execute("DROP TABLE IF EXISTS test_schema_migrations;")
         await conn.commit()
-        await cursor.execute(table_create_stmt)
-        await conn.commit()
+        await migrations.migrate(conn, mode="test")
         yield cursor
 
 
+@pytest.fixture(name="pool")
+async def fixture_pool(tmp_path):
+    """
+    Return an open pool over a scratch database,
+    holding a table of things along with the users table.
+    """
+    pool = ConnectionPool(
+        tmp_path.joinpath("db.sqlite3"), readers=2, acquire_timeout=0.1
+    )
+    await pool.open()
+    async with pool.writer() as conn:
+        await conn.execute(
+            "CREATE TABLE things (id INTEGER PRIMARY KEY, name TEXT UNIQUE)"
+        )
+        await conn.commit()
+        await migrations.migrate(conn)
+    yield pool
+    await pool.close()
+
+
 @pytest.fixture(name="base_url", scope="session")
 def fixture_base_url():
     return "http://localhost:8080"
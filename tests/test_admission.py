@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import admission
+from app import _init_app
+
+
+@pytest.fixture(name="make_client")
+async def fixture_make_client():
+    """
+    Return helper which serves an app with a single slow route, admitting
+    requests to it within argument limit, and returns a client to it.
+    """
+    clients = []
+
+    async def _make_client(limit):
+        routes = web.RouteTableDef()
+        release = asyncio.Event()
+
+        @routes.get("/slow/")
+        async def handle_slow(request):
+            await release.wait()
+            return web.json_response({"data": "done"})
+
+        @routes.get("/fast/")
+        async def handle_fast(request):
+            return web.json_response({"data": "done"})
+
+        app = _init_app(
+            ROUTER=routes,
+            CLEANUP_CTX=[admission.manage_admission_control],
+            MIDDLEWARES=[admission.admission_control_middleware],
+            SETTINGS={"ADMISSION_LIMITS": {"GET /slow/": limit}},
+        )
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        clients.append(client)
+        return client, app, release
+
+    yield _make_client
+
+    for client in clients:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_is_rejected_right_away(make_client):
+    client, app, release = await make_client((1, 1, 10))
+
+    first = asyncio.ensure_future(client.get("/slow/"))
+    second = asyncio.ensure_future(client.get("/slow/"))
+    await asyncio.sleep(0.1)
+
+    gate = app["ADMISSION"].gates["GET /slow/"]
+    assert gate.active == 1
+    assert gate.queue_length == 1
+
+    resp = await client.get("/slow/")
+    assert resp.status == 503
+    assert resp.headers["Retry-After"] == "10"
+    assert gate.rejected == 1
+
+    release.set()
+    assert [resp.status for resp in await asyncio.gather(first, second)] == [200, 200]
+    assert gate.admitted == 2
+    assert gate.active == 0
+
+
+@pytest.mark.asyncio
+async def test_waiting_past_deadline_is_rejected(make_client):
+    client, app, release = await make_client((1, 4, 0.1))
+
+    first = asyncio.ensure_future(client.get("/slow/"))
+    await asyncio.sleep(0.05)
+
+    resp = await client.get("/slow/")
+    assert resp.status == 503
+    gate = app["ADMISSION"].gates["GET /slow/"]
+    assert gate.timed_out == 1
+    assert gate.queue_length == 0
+
+    release.set()
+    assert (await first).status == 200
+
+
+@pytest.mark.asyncio
+async def test_unlimited_routes_are_let_through(make_client):
+    client, app, release = await make_client((0, 0, 1))
+
+    assert (await client.get("/slow/")).status == 503
+    assert (await client.get("/fast/")).status == 200
+    assert (await client.get("/nowhere/")).status == 404
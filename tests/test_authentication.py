@@ -0,0 +1,147 @@
+import datetime
+
+import jwt
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import auth
+import authentication
+from app import _init_app
+
+
+@pytest.fixture(name="client")
+async def fixture_client(monkeypatch):
+    """
+    Return a client to an app with routes echoing the uid of the user,
+    one open to anyone and one requiring authentication.
+    """
+    monkeypatch.setenv("JWT_SECRET", "sekrit")
+
+    routes = web.RouteTableDef()
+
+    @routes.get("/whoami/")
+    async def handle_whoami(request):
+        return web.json_response({"data": {"uid": request["uid"]}})
+
+    @routes.get("/me/")
+    @authentication.authentication_required
+    async def handle_me(request):
+        return web.json_response({"data": {"uid": request["uid"]}})
+
+    app = _init_app(
+        ROUTER=routes,
+        CLEANUP_CTX=[authentication.manage_token_verification],
+        MIDDLEWARES=[authentication.jwt_authentication_middleware],
+    )
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    yield client
+    await client.close()
+
+
+def _bearer(token):
+    return {"Authorization": "Bearer {}".format(token)}
+
+
+def _encode(claims, secret="sekrit"):
+    return jwt.encode(claims, secret, algorithm="HS256").decode("utf-8")
+
+
+@pytest.mark.asyncio
+async def test_anonymous_request_goes_through(client):
+    resp = await client.get("/whoami/")
+    assert resp.status == 200
+    assert (await resp.json())["data"]["uid"] is None
+
+
+@pytest.mark.asyncio
+async def test_access_token_authenticates(client, monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", "sekrit")
+    token = auth.gen_access_token(uid=1024)
+
+    resp = await client.get("/whoami/", headers=_bearer(token))
+    assert resp.status == 200
+    assert (await resp.json())["data"]["uid"] == 1024
+
+
+@pytest.mark.asyncio
+async def test_verified_token_is_cached(client, monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", "sekrit")
+    token = auth.gen_access_token(uid=1024)
+    cache = client.server.app["VERIFIED_TOKENS"]
+
+    for _ in range(3):
+        resp = await client.get("/whoami/", headers=_bearer(token))
+        assert resp.status == 200
+
+    assert cache.stats["size"] == 1
+    assert cache.stats["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_secret_is_read_once_at_startup(client, monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", "rotated")
+    token = auth.gen_access_token(uid=1024)
+
+    resp = await client.get("/me/", headers=_bearer(token))
+    assert resp.status == 401
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "header",
+    ["Bearer", "Bearer ", "Token abc", "Basic dXNlcjpwd2Q="],
+    ids=["no_token", "empty_token", "other_scheme", "basic"],
+)
+async def test_malformed_header_is_rejected(client, header):
+    resp = await client.get("/me/", headers={"Authorization": header})
+    assert resp.status == 401
+    assert resp.headers["WWW-Authenticate"] == "Bearer"
+    assert (await resp.json())["error"] == "malformed authorization header"
+
+
+@pytest.mark.asyncio
+async def test_expired_token_is_rejected(client):
+    exp = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    token = _encode({"uid": 1024, "type": "access", "exp": exp})
+
+    resp = await client.get("/me/", headers=_bearer(token))
+    assert resp.status == 401
+    assert len(client.server.app["VERIFIED_TOKENS"]) == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "claims, secret",
+    [
+        ({"uid": 1024, "type": "refresh"}, "sekrit"),
+        ({"uid": 1024, "type": "access"}, "not-the-sekrit"),
+        ({"type": "access"}, "sekrit"),
+    ],
+    ids=["refresh_token", "bad_signature", "no_uid"],
+)
+async def test_invalid_token_is_rejected(client, claims, secret):
+    exp = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+    token = _encode(dict(claims, exp=exp), secret)
+
+    resp = await client.get("/me/", headers=_bearer(token))
+    assert resp.status == 401
+
+
+@pytest.mark.asyncio
+async def test_token_without_expiry_is_rejected(client):
+    token = _encode({"uid": 1024, "type": "access"})
+
+    resp = await client.get("/me/", headers=_bearer(token))
+    assert resp.status == 401
+
+
+@pytest.mark.asyncio
+async def test_invalid_token_is_anonymous_on_open_routes(client):
+    exp = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    token = _encode({"uid": 1024, "type": "access", "exp": exp})
+
+    resp = await client.get("/whoami/", headers=_bearer(token))
+    assert resp.status == 200
+    assert (await resp.json())["data"]["uid"] is None
@@ -0,0 +1,163 @@
+import gzip
+
+import pytest
+
+import blocklist
+
+
+@pytest.fixture(name="make_blocklist")
+def fixture_make_blocklist(tmp_path):
+    """
+    Return helper which builds and loads a blocklist from a list of passwords.
+    """
+    opened = []
+
+    def _make_blocklist(passwords):
+        source_path = tmp_path.joinpath("passwords.txt.gz")
+        index_path = tmp_path.joinpath("passwords.idx")
+        with gzip.open(str(source_path), "wt", encoding="utf-8") as file:
+            file.write("\n".join(passwords) + "\n")
+        blocklist.build_index(source_path, index_path)
+        opened.append(blocklist.PasswordBlocklist(index_path))
+        return opened[-1]
+
+    yield _make_blocklist
+
+    for passwords in opened:
+        passwords.close()
+
+
+def test_membership(make_blocklist):
+    passwords = make_blocklist(["welcome", "mewtwo", "  sandy123 ", "", "mewtwo"])
+    assert len(passwords) == 3
+    assert [passwords[i] for i in range(len(passwords))] == [
+        "mewtwo",
+        "sandy123",
+        "welcome",
+    ]
+
+    for password in ["welcome", "mewtwo", "sandy123"]:
+        assert password in passwords
+
+    for password in ["", "welcom", "welcome1", "mewtw0", "sandy123sandy123"]:
+        assert password not in passwords
+
+
+def test_rejects_foreign_file(tmp_path):
+    index_path = tmp_path.joinpath("passwords.idx")
+    index_path.write_bytes(b"NOT AN INDEX\n")
+    with pytest.raises(ValueError):
+        blocklist.PasswordBlocklist(index_path)
+
+
+def test_common_passwords_match_source(basedir):
+    """
+    Assert that the shared blocklist holds every password of the gzipped list.
+    """
+    passwords = blocklist.get_common_passwords()
+    with gzip.open(
+        str(basedir.joinpath("common-passwords.txt.gz")), "rt", encoding="utf-8"
+    ) as file:
+        for line in file:
+            assert line.strip() in passwords
+
+
+def test_build_leaves_no_scratch_files(tmp_path):
+    source_path = tmp_path.joinpath("passwords.txt.gz")
+    index_path = tmp_path.joinpath("passwords.idx")
+    with gzip.open(str(source_path), "wt", encoding="utf-8") as file:
+        file.write("welcome\nmewtwo\n")
+
+    blocklist.build_index(source_path, index_path)
+    blocklist.build_index(source_path, index_path)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "passwords.idx",
+        "passwords.txt.gz",
+    ]
+
+
+@pytest.fixture(name="make_ngram_index")
+def fixture_make_ngram_index(make_blocklist, tmp_path):
+    """
+    Return helper which builds and loads an n-gram index over a list of passwords.
+    """
+    opened = []
+
+    def _make_ngram_index(passwords):
+        passwords = make_blocklist(passwords)
+        ngram_index_path = tmp_path.joinpath("passwords.ngrams")
+        blocklist.build_ngram_index(passwords, ngram_index_path)
+        opened.append(blocklist.NgramIndex(ngram_index_path, passwords))
+        return opened[-1]
+
+    yield _make_ngram_index
+
+    for index in opened:
+        index.close()
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("", ""),
+        ("", "abc"),
+        ("kitten", "sitting"),
+        ("flaw", "lawn"),
+        ("password", "p4ssw0rd"),
+        ("ab", "ba"),
+        ("☃x", "x☃"),
+    ],
+)
+def test_edit_distance(a, b):
+    def _edit_distance(a, b):
+        row = list(range(len(b) + 1))
+        for i, char in enumerate(a, 1):
+            previous, row[0] = row[0], i
+            for j, other in enumerate(b, 1):
+                previous, row[j] = row[j], min(
+                    row[j] + 1, row[j - 1] + 1, previous + (char != other)
+                )
+        return row[-1]
+
+    assert blocklist.get_edit_distance(a, b) == _edit_distance(a, b)
+    assert blocklist.get_edit_distance(b, a) == _edit_distance(a, b)
+
+
+def test_ngram_index_finds_variants(make_ngram_index):
+    index = make_ngram_index(["welcome", "mewtwo", "sandy123", "password", "ab"])
+
+    assert index.find_within("welcome") == "welcome"
+    assert index.find_within("welcome1") == "welcome"
+    assert index.find_within("we1come") == "welcome"
+    assert index.find_within("elcome") == "welcome"
+    assert index.find_within("passw0rd") == "password"
+    assert index.find_within("a") == "ab"
+    assert index.find_within("p4ssw0rd") is None
+    assert index.find_within("p4ssw0rd", max_distance=2) == "password"
+    assert index.find_within("y0u != n00b1e") is None
+
+
+def test_ngram_index_matches_brute_force():
+    passwords = blocklist.get_common_passwords()
+    index = blocklist.get_common_password_ngrams()
+
+    everything = [passwords[i] for i in range(len(passwords))]
+
+    for password in everything[::499]:
+        for variant in [password + "!", password[1:], "x" + password[:-1], "zz"]:
+            expected = any(
+                abs(len(other) - len(variant)) <= 1
+                and blocklist.get_edit_distance(variant, other) <= 1
+                for other in everything
+            )
+            assert (index.find_within(variant) is not None) is expected, variant
+
+
+def test_ngram_index_rejects_other_blocklist(make_blocklist, tmp_path):
+    passwords = make_blocklist(["welcome", "mewtwo"])
+    ngram_index_path = tmp_path.joinpath("passwords.ngrams")
+    blocklist.build_ngram_index(passwords, ngram_index_path)
+
+    others = make_blocklist(["welcome"])
+    with pytest.raises(ValueError):
+        blocklist.NgramIndex(ngram_index_path, others)
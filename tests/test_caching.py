@@ -0,0 +1,62 @@
+from caching import MISSING, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_and_set():
+    cache = TTLCache()
+    assert cache.get("tintin@gmail.com") is None
+    cache.set("tintin@gmail.com", 1)
+    cache.set("nobody@gmail.com", MISSING)
+    assert cache.get("tintin@gmail.com") == 1
+    assert cache.get("nobody@gmail.com") is MISSING
+    assert cache.stats == {"size": 2, "hits": 2, "misses": 1, "evictions": 0}
+
+
+def test_entries_expire():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set("tintin@gmail.com", 1)
+    cache.set("snowy@gmail.com", 2, expires_at=30)
+
+    clock.now = 9.9
+    assert cache.get("tintin@gmail.com") == 1
+    clock.now = 10
+    assert cache.get("tintin@gmail.com") is None
+    assert cache.get("snowy@gmail.com") == 2
+    clock.now = 30
+    assert cache.get("snowy@gmail.com") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_stale_lookups_are_not_cached():
+    """
+    Assert that a value looked up before an invalidation isn't cached after it.
+    """
+    cache = TTLCache()
+    generation = cache.generation
+    cache.invalidate("tintin@gmail.com")
+    cache.set("tintin@gmail.com", MISSING, generation=generation)
+    assert cache.get("tintin@gmail.com") is None
+
+    cache.set("tintin@gmail.com", 1, generation=cache.generation)
+    assert cache.get("tintin@gmail.com") == 1
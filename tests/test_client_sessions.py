@@ -14,6 +14,9 @@ async def test_test_client_session():
     """
     async with TestClientSession() as test_client:
         assert isinstance(test_client, aiohttp.ClientSession)
+        # and is open for requests until the end of the block
+        assert not test_client.closed
+    assert test_client.closed
 
 
 @pytest.mark.asyncio
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from coalescing import BatchLoader
+
+
+class FakeStore:
+    """
+    Store of values, counting the queries made to it.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.queries = []
+
+    async def load_many(self, keys):
+        self.queries.append(list(keys))
+        # values are read as the query starts, like a database snapshot
+        found = {key: self.values[key] for key in keys if key in self.values}
+        await asyncio.sleep(0.01)
+        return found
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_of_a_key_share_a_query():
+    store = FakeStore({"tintin": 1})
+    loader = BatchLoader(store.load_many)
+
+    values = await asyncio.gather(*[loader.load("tintin") for _ in range(10)])
+    assert values == [1] * 10
+    assert store.queries == [["tintin"]]
+    assert loader.coalesced == 9
+
+
+@pytest.mark.asyncio
+async def test_loads_of_distinct_keys_are_batched():
+    store = FakeStore({"tintin": 1, "snowy": 2})
+    loader = BatchLoader(store.load_many, window=0.01, max_batch_size=2)
+
+    values = await asyncio.gather(
+        loader.load("tintin"), loader.load("snowy"), loader.load("haddock")
+    )
+    assert values == [1, 2, None]
+    assert store.queries == [["tintin", "snowy"], ["haddock"]]
+
+
+@pytest.mark.asyncio
+async def test_completed_loads_are_not_reused():
+    store = FakeStore({"tintin": 1})
+    loader = BatchLoader(store.load_many)
+
+    assert await loader.load("tintin") == 1
+    store.values["tintin"] = 2
+    assert await loader.load("tintin") == 2
+    assert len(store.queries) == 2
+
+
+@pytest.mark.asyncio
+async def test_forgotten_loads_are_not_joined():
+    store = FakeStore({"tintin": 1})
+    loader = BatchLoader(store.load_many, window=0)
+
+    first = asyncio.ensure_future(loader.load("tintin"))
+    await asyncio.sleep(0.005)
+    loader.forget("tintin")
+    store.values["tintin"] = 2
+
+    assert await asyncio.gather(first, loader.load("tintin")) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_failed_query_fails_every_caller():
+    async def load_many(keys):
+        raise RuntimeError("database is gone")
+
+    loader = BatchLoader(load_many)
+    results = await asyncio.gather(
+        loader.load("tintin"), loader.load("snowy"), return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_close_waits_for_loads_in_flight():
+    store = FakeStore({"tintin": 1, "snowy": 2})
+    loader = BatchLoader(store.load_many, window=10)
+
+    # one caller gives up, leaving its load to the loader alone
+    abandoned = asyncio.ensure_future(loader.load("tintin"))
+    pending = asyncio.ensure_future(loader.load("snowy"))
+    await asyncio.sleep(0)
+    abandoned.cancel()
+
+    await loader.close()
+    assert store.queries == [["tintin", "snowy"]]
+    assert await pending == 2
@@ -0,0 +1,70 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from db.batching import WriteBatcher
+
+insert_stmt = "INSERT INTO things (name) VALUES (?)"
+
+
+async def count_things(pool):
+    async with pool.reader() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM things")
+        row = await cursor.fetchone()
+        await cursor.close()
+        return row[0]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_share_a_commit(pool):
+    batcher = WriteBatcher(pool, window=0.05)
+    results = await asyncio.gather(
+        *[batcher.execute(insert_stmt, ["thing{}".format(i)]) for i in range(10)]
+    )
+
+    assert sorted(result.lastrowid for result in results) == list(range(1, 11))
+    assert batcher.commits == 1
+    assert batcher.writes == 10
+    assert batcher.batch_sizes == {10: 1}
+    assert await count_things(pool) == 10
+
+
+@pytest.mark.asyncio
+async def test_max_batch_size(pool):
+    batcher = WriteBatcher(pool, window=10, max_batch_size=4)
+    await asyncio.gather(
+        *[batcher.execute(insert_stmt, ["thing{}".format(i)]) for i in range(8)]
+    )
+
+    assert batcher.commits == 2
+    assert batcher.batch_sizes == {4: 2}
+    assert batcher.mean_batch_size == 4
+
+
+@pytest.mark.asyncio
+async def test_integrity_error_fails_its_caller_alone(pool):
+    batcher = WriteBatcher(pool, window=0.05)
+    results = await asyncio.gather(
+        batcher.execute(insert_stmt, ["thing"]),
+        batcher.execute(insert_stmt, ["thing"]),
+        batcher.execute(insert_stmt, ["other thing"]),
+        return_exceptions=True,
+    )
+
+    assert results[0].lastrowid == 1
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert results[2].lastrowid == 2
+    assert batcher.commits == 1
+    assert await count_things(pool) == 2
+
+
+@pytest.mark.asyncio
+async def test_close_commits_pending_writes(pool):
+    batcher = WriteBatcher(pool, window=10)
+    write = asyncio.ensure_future(batcher.execute(insert_stmt, ["thing"]))
+    await asyncio.sleep(0)
+
+    await batcher.close()
+    assert write.done()
+    assert await count_things(pool) == 1
@@ -0,0 +1,87 @@
+import sqlite3
+
+import aiosqlite
+import pytest
+
+from db import migrations, stmts
+
+
+@pytest.fixture(name="conn")
+async def fixture_conn(tmp_path):
+    async with aiosqlite.connect(str(tmp_path.joinpath("db.sqlite3"))) as conn:
+        yield conn
+
+
+async def fetch_all(conn, sql, parameters=None):
+    cursor = await conn.execute(sql, parameters or [])
+    rows = await cursor.fetchall()
+    await cursor.close()
+    return rows
+
+
+@pytest.mark.asyncio
+async def test_migrate_applies_pending_migrations_once(conn):
+    versions = [migration.version for migration in migrations.migrations]
+    assert await migrations.migrate(conn, mode="dev") == versions
+    assert await migrations.migrate(conn, mode="dev") == []
+    assert await migrations.get_applied_versions(conn, mode="dev") == set(versions)
+
+
+@pytest.mark.asyncio
+async def test_login_lookup_uses_covering_index(conn):
+    await migrations.migrate(conn, mode="dev")
+    registry = stmts.StatementRegistry(mode="dev")
+    plan = await fetch_all(
+        conn,
+        "EXPLAIN QUERY PLAN " + registry["users_select_credentials"],
+        ["tintin@gmail.com"],
+    )
+    assert "COVERING INDEX dev_users_email_credentials" in plan[0][-1]
+
+
+@pytest.mark.asyncio
+async def test_only_indexes_used_are_kept(conn):
+    await migrations.migrate(conn, mode="dev")
+    rows = await fetch_all(
+        conn,
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL",
+    )
+    assert [row[0] for row in rows] == ["dev_users_email_credentials"]
+
+
+@pytest.mark.asyncio
+async def test_migrate_upgrades_populated_database(conn):
+    """
+    Assert that migrations added later are applied on top of existing data.
+    """
+    await migrations.migrate(conn, mode="dev", migrations=migrations.migrations[:1])
+    await conn.execute(
+        "INSERT INTO dev_users (email, username, pwd_hash) VALUES (?,?,?)",
+        ["tintin@gmail.com", "Tintin", "hash"],
+    )
+    await conn.commit()
+
+    added_column = migrations.Migration(
+        6, "add display names", ["ALTER TABLE {prefix}users ADD COLUMN display_name"]
+    )
+    assert await migrations.migrate(
+        conn, mode="dev", migrations=migrations.migrations + [added_column]
+    ) == [2, 3, 4, 5, 6]
+
+    rows = await fetch_all(conn, "SELECT username, display_name FROM dev_users")
+    assert [tuple(row) for row in rows] == [("Tintin", None)]
+
+
+@pytest.mark.asyncio
+async def test_failed_migration_is_rolled_back(conn):
+    broken = migrations.Migration(4, "broken", ["CREATE TABLE {prefix}users (id)"])
+    with pytest.raises(sqlite3.OperationalError):
+        await migrations.migrate(
+            conn, mode="dev", migrations=migrations.migrations + [broken]
+        )
+
+    assert await migrations.get_applied_versions(conn, mode="dev") == set()
+    rows = await fetch_all(
+        conn, "SELECT name FROM sqlite_master WHERE name = 'dev_users'"
+    )
+    assert rows == []
@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+from db.pool import PoolTimeout
+
+
+@pytest.mark.asyncio
+async def test_database_in_wal_mode(pool):
+    async with pool.reader() as conn:
+        cursor = await conn.execute("PRAGMA journal_mode")
+        row = await cursor.fetchone()
+        assert row[0] == "wal"
+
+
+@pytest.mark.asyncio
+async def test_readers_see_committed_writes(pool):
+    async with pool.writer() as conn:
+        await conn.execute("INSERT INTO things (name) VALUES ('thing')")
+        await conn.commit()
+
+    async with pool.reader() as conn:
+        cursor = await conn.execute("SELECT name FROM things")
+        row = await cursor.fetchone()
+        assert row["name"] == "thing"
+
+
+@pytest.mark.asyncio
+async def test_readers_are_read_only(pool):
+    async with pool.reader() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            await conn.execute("INSERT INTO things (name) VALUES ('thing')")
+
+
+@pytest.mark.asyncio
+async def test_reads_do_not_wait_on_writer(pool):
+    """
+    Assert that readers can be acquired while the writer is held
+    in the middle of a transaction.
+    """
+    async with pool.writer() as writer:
+        await writer.execute("INSERT INTO things (name) VALUES ('thing')")
+
+        async with pool.reader() as conn:
+            cursor = await conn.execute("SELECT COUNT(*) FROM things")
+            row = await cursor.fetchone()
+            assert row[0] == 0
+
+        await writer.commit()
+
+
+@pytest.mark.asyncio
+async def test_acquire_timeout(pool):
+    async with pool.reader(), pool.reader():
+        assert pool.idle_readers == 0
+        with pytest.raises(PoolTimeout):
+            async with pool.reader():
+                pass
+    assert pool.idle_readers == 2
+
+    async with pool.writer():
+        with pytest.raises(PoolTimeout):
+            async with pool.writer():
+                pass
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_rolled_back(pool):
+    with pytest.raises(RuntimeError):
+        async with pool.writer() as conn:
+            await conn.execute("INSERT INTO things (name) VALUES ('thing')")
+            raise RuntimeError
+
+    async with pool.writer() as conn:
+        await conn.commit()
+
+    async with pool.reader() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM things")
+        row = await cursor.fetchone()
+        assert row[0] == 0
+
+
+@pytest.mark.asyncio
+async def test_broken_connection_is_replaced(pool):
+    pool.health_check_interval = 0
+
+    async with pool.reader() as conn:
+        broken = conn
+    await broken.close()
+
+    async with pool.reader() as conn:
+        assert conn is not broken
+        cursor = await conn.execute("SELECT COUNT(*) FROM things")
+        row = await cursor.fetchone()
+        assert row[0] == 0
@@ -0,0 +1,42 @@
+import pytest
+
+from db import pragmas
+from db.pool import ConnectionPool
+
+
+async def read_pragma(conn, pragma):
+    cursor = await conn.execute("PRAGMA {}".format(pragma))
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row[0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("profile", ["prod", "dev", "test"])
+async def test_profile_applied_to_every_connection(tmp_path, profile):
+    pool = ConnectionPool(tmp_path.joinpath("db.sqlite3"), readers=1, profile=profile)
+    await pool.open()
+    try:
+        for acquire in [pool.reader, pool.writer]:
+            async with acquire() as conn:
+                settings = pragmas.get_profile(profile)
+                assert await read_pragma(conn, "journal_mode") == "wal"
+                assert await read_pragma(conn, "cache_size") == settings["cache_size"]
+                assert await read_pragma(conn, "mmap_size") == settings["mmap_size"]
+                assert (
+                    await read_pragma(conn, "busy_timeout") == settings["busy_timeout"]
+                )
+                # temp_store MEMORY reads back as 2, synchronous OFF and NORMAL
+                # as 0 and 1
+                assert await read_pragma(conn, "temp_store") == 2
+                assert await read_pragma(conn, "synchronous") == {
+                    "OFF": 0,
+                    "NORMAL": 1,
+                }[settings["synchronous"]]
+    finally:
+        await pool.close()
+
+
+def test_unknown_profile(tmp_path):
+    with pytest.raises(ValueError):
+        ConnectionPool(tmp_path.joinpath("db.sqlite3"), profile="turbo")
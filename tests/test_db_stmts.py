@@ -0,0 +1,64 @@
+import aiosqlite
+import pytest
+
+from db import stmts
+from db.batching import WriteBatcher
+from db.pool import ConnectionPool
+
+
+def test_statements_are_rendered_once_per_mode():
+    registry = stmts.StatementRegistry(mode="test")
+    assert "INSERT INTO test_users" in registry["users_insert"]
+    assert registry["users_insert"] is registry["users_insert"]
+
+    registry = stmts.StatementRegistry()
+    assert "FROM users" in registry["users_select_credentials"]
+
+
+def test_register():
+    registry = stmts.StatementRegistry(mode="dev", templates={})
+    registry.register("count", "SELECT COUNT(*) FROM {prefix}users;")
+    assert registry["count"] == "SELECT COUNT(*) FROM dev_users;"
+
+    with pytest.raises(KeyError):
+        registry["users_insert"]
+
+
+@pytest.mark.asyncio
+async def test_insert_returns_new_row(tmp_path):
+    """
+    Assert that the insert statement yields the new row in a single round trip,
+    where SQLite supports it.
+    """
+    db_path = tmp_path.joinpath("db.sqlite3")
+    create_stmt, _ = stmts.get_create_drop_stmts(
+        stmts.users_table_create_template, table_name="users", mode="test"
+    )
+    async with aiosqlite.connect(str(db_path)) as conn:
+        await conn.execute(create_stmt)
+        await conn.commit()
+
+    pool = ConnectionPool(db_path, readers=1)
+    await pool.open()
+    batcher = WriteBatcher(pool)
+    registry = stmts.StatementRegistry(mode="test")
+    try:
+        result = await batcher.execute(
+            registry["users_insert"], ("tintin@gmail.com", "Tintin", "hash")
+        )
+    finally:
+        await batcher.close()
+        await pool.close()
+
+    assert result.lastrowid == 1
+    if stmts.supports_returning:
+        assert tuple(result.row) == (1, "Tintin", "tintin@gmail.com")
+    else:
+        assert result.row is None
+
+
+def test_expand():
+    registry = stmts.StatementRegistry(mode="test")
+    statement = registry.expand("users_select_credentials_many", 3)
+    assert "IN (?,?,?)" in statement
+    assert registry.expand("users_select_credentials_many", 3) is statement
@@ -0,0 +1,259 @@
+import asyncio
+
+import pytest
+
+import auth
+import config
+import hashing
+from hashing import HashingService, Rehasher
+
+
+@pytest.fixture(name="hasher", params=["thread", "process"])
+def fixture_hasher(request):
+    """
+    Return a started hashing service, for each kind of executor.
+    """
+    service = HashingService(max_workers=2, executor=request.param)
+    service.start()
+    yield service
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hash_checks_out(hasher):
+    hash = await hasher.hash("y0u != n00b1e")
+    assert auth.check_password_hash("y0u != n00b1e", hash)
+    assert await hasher.verify("y0u != n00b1e", hash)
+    assert not await hasher.verify("wr0ngPa55w0rd!", hash)
+
+
+@pytest.mark.asyncio
+async def test_queue_depth(hasher):
+    """
+    Assert that calls in excess of the number of workers are reported
+    as queued, and that the queue drains once they complete.
+    """
+    tasks = [asyncio.ensure_future(hasher.hash("y0u != n00b1e")) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert hasher.pending == 5
+    assert hasher.queue_depth == 3
+
+    await asyncio.gather(*tasks)
+    assert hasher.pending == 0
+    assert hasher.queue_depth == 0
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        HashingService(executor="fibers")
+
+
+@pytest.mark.asyncio
+async def test_hashes_are_at_the_service_work_factor():
+    service = HashingService(max_workers=1, hasher=auth.BcryptHasher(5))
+    service.start()
+    try:
+        hash = await service.hash("y0u != n00b1e")
+    finally:
+        service.shutdown()
+
+    assert auth.get_hash_workfactor(hash) == 5
+    assert not service.needs_rehash(hash)
+    assert service.needs_rehash(auth.get_password_hash("y0u != n00b1e", 4))
+    # hashes at a higher cost are kept
+    assert not service.needs_rehash(auth.get_password_hash("y0u != n00b1e", 6))
+    assert service.needs_rehash("not a bcrypt hash")
+
+
+@pytest.mark.parametrize(
+    "seconds, budget, expected",
+    [(0.01, 0.05, 12), (0.01, 0.005, 10), (0.01, 100.0, 16), (0.01, 0.08, 13)],
+    ids=["within_budget", "floor", "ceiling", "exact_budget"],
+)
+def test_calibrate_workfactor(monkeypatch, seconds, budget, expected):
+    monkeypatch.setattr(hashing, "_time_hash", lambda workfactor: seconds)
+    calibrate = hashing.calibrate_workfactor.__wrapped__
+    assert calibrate(budget, minimum=10, maximum=16) == expected
+
+
+@pytest.mark.parametrize(
+    "settings, expected",
+    [
+        ({}, True),
+        ({"HASHER_WORKFACTOR": 12}, False),
+        ({"HASHER_PARAMS": {"bcrypt": {"workfactor": 12}}}, False),
+        ({"HASHER_SCHEME": "scrypt"}, False),
+    ],
+    ids=["unset", "workfactor", "params", "scrypt"],
+)
+def test_needs_calibration(settings, expected):
+    settings = dict(config.default_settings, **settings)
+    assert hashing.needs_calibration(settings) is expected
+
+
+class FakeWrites:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.executed = []
+
+    async def execute(self, sql, parameters):
+        if self.fail:
+            raise RuntimeError("database is gone")
+        self.executed.append((sql, parameters))
+
+
+@pytest.fixture(name="fast_hasher")
+def fixture_fast_hasher():
+    service = HashingService(max_workers=1, hasher=auth.BcryptHasher(5))
+    service.start()
+    yield service
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_rehasher_rehashes_outdated_hashes(fast_hasher):
+    writes = FakeWrites()
+    rehasher = Rehasher(fast_hasher, writes, "UPDATE", max_backlog=1)
+    rehashed = []
+    old_hash = auth.get_password_hash("y0u != n00b1e", 4)
+
+    current_hash = await fast_hasher.hash("y0u != n00b1e")
+    assert not rehasher.submit(1, "y0u != n00b1e", current_hash)
+
+    assert rehasher.submit(1, "y0u != n00b1e", old_hash, lambda: rehashed.append(1))
+    # a rehash already under way isn't started again
+    assert rehasher.submit(1, "y0u != n00b1e", old_hash)
+    # nor is one beyond the backlog
+    assert not rehasher.submit(2, "y0u != n00b1e", old_hash)
+    assert rehasher.stats["backlog"] == 1
+    assert rehasher.stats["dropped"] == 1
+
+    await rehasher.close()
+    assert rehashed == [1]
+    assert rehasher.stats == {"backlog": 0, "rehashed": 1, "dropped": 1, "failed": 0}
+
+    [(sql, (new_hash, uid, expected_hash))] = writes.executed
+    assert (uid, expected_hash) == (1, old_hash)
+    assert auth.get_hash_workfactor(new_hash) == 5
+    assert auth.check_password_hash("y0u != n00b1e", new_hash)
+
+
+@pytest.mark.asyncio
+async def test_rehasher_counts_failures(fast_hasher):
+    rehasher = Rehasher(fast_hasher, FakeWrites(fail=True), "UPDATE")
+    rehasher.submit(1, "y0u != n00b1e", auth.get_password_hash("y0u != n00b1e", 4))
+    await rehasher.close()
+    assert rehasher.stats["failed"] == 1
+    assert rehasher.stats["backlog"] == 0
+
+
+# hashers of every registered scheme, at their cheapest sensible parameters
+cheap_hashers = [
+    auth.BcryptHasher(workfactor=4),
+    auth.ScryptHasher(n=2 ** 10, r=8, p=1),
+    auth.PBKDF2Hasher(iterations=1000),
+]
+
+
+@pytest.mark.parametrize(
+    "hasher", cheap_hashers, ids=lambda hasher: hasher.scheme,
+)
+def test_hashes_are_dispatched_on_their_prefix(hasher):
+    hash = hasher.hash("y0u != n00b1e")
+    assert auth.identify_hash(hash) is type(hasher)
+    assert auth.check_password_hash("y0u != n00b1e", hash)
+    assert not auth.check_password_hash("wr0ngPa55w0rd!", hash)
+    assert not hasher.needs_rehash(hash)
+
+    for other in cheap_hashers:
+        if other is not hasher:
+            assert other.needs_rehash(hash)
+
+
+@pytest.mark.parametrize(
+    "hasher, other",
+    [
+        (auth.ScryptHasher(n=2 ** 10), auth.ScryptHasher(n=2 ** 11)),
+        (auth.ScryptHasher(n=2 ** 10, r=4), auth.ScryptHasher(n=2 ** 10, r=8)),
+        (auth.PBKDF2Hasher(iterations=1000), auth.PBKDF2Hasher(iterations=2000)),
+    ],
+    ids=["scrypt_n", "scrypt_r", "pbkdf2_iterations"],
+)
+def test_hashes_at_other_parameters_need_rehash(hasher, other):
+    hash = hasher.hash("y0u != n00b1e")
+    assert other.needs_rehash(hash)
+    # while still checking out
+    assert auth.check_password_hash("y0u != n00b1e", hash)
+
+
+@pytest.mark.parametrize(
+    "hash",
+    [
+        "not a hash",
+        "$argon2id$v=19$m=65536,t=3,p=4$c2FsdA$a2V5",
+        "$scrypt$ln=10,r=8,p=1$c2FsdA",
+        "$pbkdf2-sha256$i=many$c2FsdA$a2V5",
+        "$2b$04$short",
+    ],
+    ids=["plain", "unregistered", "scrypt", "pbkdf2", "bcrypt"],
+)
+def test_malformed_hashes_are_not_identified(hash):
+    assert auth.identify_hash(hash) is None
+
+
+# hashes at parameters past what their schemes can be computed at
+out_of_bounds_hashes = [
+    "$scrypt$ln=60,r=8,p=1$c2FsdA$a2V5",
+    "$scrypt$ln=10,r=999,p=999$c2FsdA$a2V5",
+    "$scrypt$ln=16,r=1,p=1$c2FsdA$a2V5",
+    "$scrypt$ln=0,r=8,p=1$c2FsdA$a2V5",
+    "$pbkdf2-sha256$i=9999999999$c2FsdA$a2V5",
+    "$pbkdf2-sha256$i=999999999$c2FsdA$a2V5",
+    "$pbkdf2-sha256$i=0$c2FsdA$a2V5",
+    "$pbkdf2-sha256$i=1000$c2FsdA$a",
+]
+out_of_bounds_ids = [
+    "scrypt_memory",
+    "scrypt_parallelization",
+    "scrypt_cost_for_block_size",
+    "scrypt_no_cost",
+    "pbkdf2_overflow",
+    "pbkdf2_too_many_iterations",
+    "pbkdf2_no_iterations",
+    "pbkdf2_bad_base64",
+]
+
+
+@pytest.mark.parametrize("hash", out_of_bounds_hashes, ids=out_of_bounds_ids)
+def test_hashes_out_of_bounds_are_not_identified(hash):
+    assert auth.identify_hash(hash) is None
+
+
+@pytest.mark.parametrize("hash", out_of_bounds_hashes, ids=out_of_bounds_ids)
+def test_hashes_out_of_bounds_fail_verification(hash):
+    assert auth.check_password_hash("y0u != n00b1e", hash) is False
+    hasher = auth.get_hasher(auth.hashers_by_identifier[hash.split("$")[1]].scheme)
+    assert hasher.verify("y0u != n00b1e", hash) is False
+    assert hasher.needs_rehash(hash)
+
+
+def test_unknown_scheme():
+    with pytest.raises(ValueError):
+        auth.get_hasher("md5")
+    assert auth.check_password_hash("y0u != n00b1e", "$md5$c2FsdA$a2V5") is False
+
+
+@pytest.mark.asyncio
+async def test_hashers_run_in_worker_processes():
+    service = HashingService(
+        max_workers=1, executor="process", hasher=auth.ScryptHasher(n=2 ** 10)
+    )
+    service.start()
+    try:
+        hash = await service.hash("y0u != n00b1e")
+        assert await service.verify("y0u != n00b1e", hash)
+    finally:
+        service.shutdown()
+
+    assert hash.startswith("$scrypt$ln=10,r=8,p=1$")
+    assert service.stats["scheme"] == "scrypt"
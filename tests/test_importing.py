@@ -0,0 +1,236 @@
+import json
+
+import aiohttp
+import aiosqlite
+import pytest
+
+import auth
+import config
+import importing
+from db import stmts
+from hashing import HashingService
+
+# at the lowest work factor within bounds by default
+pwd_hash = auth.get_password_hash("y0u != n00b1e", workfactor=10)
+
+
+def _line(**fields):
+    return json.dumps(fields)
+
+
+@pytest.fixture(name="hasher")
+def fixture_hasher():
+    hasher = HashingService(max_workers=2)
+    hasher.start()
+    yield hasher
+    hasher.shutdown()
+
+
+async def _iterate(lines):
+    for line in lines:
+        yield line
+
+
+async def _import(pool, hasher, lines, chunk_size=256):
+    results = importing.import_users(
+        _iterate(lines), pool, stmts.StatementRegistry(), hasher, chunk_size=chunk_size
+    )
+    return [result async for result in results]
+
+
+def _record(**fields):
+    return _line(**{"email": "tintin@gmail.com", "username": "Tintin", **fields})
+
+
+@pytest.mark.parametrize(
+    "line, error",
+    [
+        ("{", "invalid json"),
+        ("[]", "invalid record"),
+        (_record(username="Tin", pwd_hash=pwd_hash), "invalid username"),
+        (_record(email="tintin", pwd_hash=pwd_hash), "invalid email"),
+        (_record(email=1, pwd_hash=pwd_hash), "invalid email"),
+        (_record(), "either password or pwd_hash required"),
+        (
+            _record(password="y0u != n00b1e", pwd_hash=pwd_hash),
+            "either password or pwd_hash required",
+        ),
+        (_record(pwd_hash="$2b$04$short"), "invalid pwd_hash"),
+        (_record(password="Tintin"), "bad password"),
+    ],
+    ids=[
+        "json",
+        "record",
+        "username",
+        "email",
+        "email_type",
+        "no_password",
+        "both_passwords",
+        "pwd_hash",
+        "password",
+    ],
+)
+def test_invalid_record_is_turned_down(line, error):
+    assert importing.parse_record(1, line) == (None, error)
+
+
+@pytest.mark.parametrize(
+    "pwd_hash",
+    [
+        pwd_hash,
+        "$2a$12$R9h/cIPz0gi.URNNX3kh2OPST9/PgBkqquzi.Ss7KIUgO2t0jWMUW",
+        "$2y$10$" + "." * 53,
+        auth.ScryptHasher(n=2 ** 10).hash("y0u != n00b1e"),
+        auth.PBKDF2Hasher(iterations=1000).hash("y0u != n00b1e"),
+    ],
+    ids=["2b", "2a", "2y", "scrypt", "pbkdf2"],
+)
+def test_prehashed_record_is_accepted(pwd_hash):
+    record, error = importing.parse_record(1, _record(pwd_hash=pwd_hash))
+    assert error is None
+    assert record.pwd_hash == pwd_hash
+
+
+@pytest.mark.parametrize(
+    "pwd_hash",
+    [
+        "$2b$31$" + "." * 53,
+        "$2b$04$" + "." * 53,
+        "$scrypt$ln=20,r=8,p=1$c2FsdA$a2V5",
+        "$scrypt$ln=14,r=8,p=16$c2FsdA$a2V5",
+        "$pbkdf2-sha256$i=99999999$c2FsdA$a2V5",
+    ],
+    ids=["bcrypt_costly", "bcrypt_cheap", "scrypt_n", "scrypt_p", "pbkdf2"],
+)
+def test_prehashed_record_out_of_bounds_is_turned_down(pwd_hash):
+    assert importing.parse_record(1, _record(pwd_hash=pwd_hash)) == (
+        None,
+        "pwd_hash out of bounds",
+    )
+
+
+def test_hash_bounds_follow_settings():
+    settings = dict(
+        config.default_settings,
+        HASHER_WORKFACTOR_RANGE=(4, 31),
+        HASHER_PARAMS={"pbkdf2-sha256": {"iterations": 10 ** 8}},
+    )
+    hash_bounds = importing.get_hash_bounds(settings)
+    for pwd_hash in ["$2b$31$" + "." * 53, "$pbkdf2-sha256$i=99999999$c2FsdA$a2V5"]:
+        line = _record(pwd_hash=pwd_hash)
+        assert importing.parse_record(1, line, hash_bounds)[1] is None
+
+
+@pytest.mark.asyncio
+async def test_records_are_imported_in_order(pool, hasher):
+    lines = [
+        _line(email="tintin@gmail.com", username="Tintin", password="y0u != n00b1e"),
+        "",
+        _line(email="snowy", username="Snowy", pwd_hash=pwd_hash),
+        _line(email="haddock@gmail.com", username="Haddock", pwd_hash=pwd_hash),
+    ]
+    results = await _import(pool, hasher, lines)
+
+    assert [result["line"] for result in results] == [1, 3, 4]
+    assert results[1]["error"] == "invalid email"
+    assert "id" in results[0] and "id" in results[2]
+
+    async with pool.reader() as conn:
+        cursor = await conn.execute("SELECT id, email, pwd_hash FROM users")
+        rows = {row["email"]: row for row in await cursor.fetchall()}
+        await cursor.close()
+
+    tintin = rows["tintin@gmail.com"]
+    assert tintin["id"] == results[0]["id"]
+    assert auth.check_password_hash("y0u != n00b1e", tintin["pwd_hash"])
+    # prehashed passwords are taken as they are
+    assert rows["haddock@gmail.com"]["pwd_hash"] == pwd_hash
+
+
+@pytest.mark.asyncio
+async def test_conflicts_are_reported_per_record(pool, hasher):
+    await _import(pool, hasher, [_record(pwd_hash=pwd_hash)])
+
+    lines = [
+        _line(email="snowy@gmail.com", username="Snowy", pwd_hash=pwd_hash),
+        _line(email="tintin@gmail.com", username="Tintin2", pwd_hash=pwd_hash),
+        _line(email="haddock@gmail.com", username="Tintin", pwd_hash=pwd_hash),
+        _line(email="snowy@gmail.com", username="Snowy2", pwd_hash=pwd_hash),
+        _line(email="calculus@gmail.com", username="Calculus", pwd_hash=pwd_hash),
+    ]
+    results = await _import(pool, hasher, lines, chunk_size=2)
+
+    assert [result.get("error") for result in results] == [
+        None,
+        "user with that email already exists",
+        "user with that username already exists",
+        "user with that email already exists",
+        None,
+    ]
+
+    async with pool.reader() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM users")
+        assert (await cursor.fetchone())[0] == 3
+        await cursor.close()
+
+
+async def _add_user(test_db_path, uid, is_admin):
+    async with aiosqlite.connect(str(test_db_path)) as conn:
+        await conn.execute(
+            "INSERT INTO test_users (id, email, username, pwd_hash, is_admin) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [uid, "user{}@herge.be".format(uid), "user{}".format(uid), "x", is_admin],
+        )
+        await conn.commit()
+
+
+@pytest.mark.asyncio
+async def test_handle_users_import(manage_users_table, test_db_path, make_url):
+    await _add_user(test_db_path, 1024, is_admin=True)
+    lines = [
+        _line(email="tintin@gmail.com", username="Tintin", pwd_hash=pwd_hash),
+        _line(email="snowy", username="Snowy", pwd_hash=pwd_hash),
+    ]
+    headers = {
+        "Authorization": "Bearer {}".format(auth.gen_access_token(uid=1024)),
+        "Content-Type": "application/x-ndjson",
+    }
+
+    async with aiohttp.ClientSession() as test_client:
+        async with test_client.post(
+            make_url("/users/import/"), data="\n".join(lines), headers=headers
+        ) as resp:
+            assert resp.status == 200
+            results = [json.loads(line) async for line in resp.content]
+
+        assert "id" in results[0]
+        assert results[1]["error"] == "invalid email"
+
+        # imported users can log in right away
+        async with test_client.post(
+            make_url("/login/"),
+            json={"email": "tintin@gmail.com", "password": "y0u != n00b1e"},
+        ) as resp:
+            assert resp.status == 200
+
+
+@pytest.mark.asyncio
+async def test_users_import_requires_an_admin(
+    manage_users_table, test_db_path, make_url
+):
+    await _add_user(test_db_path, 1024, is_admin=False)
+    headers = {"Authorization": "Bearer {}".format(auth.gen_access_token(uid=1024))}
+    lines = [_line(email="tintin@gmail.com", username="Tintin", pwd_hash=pwd_hash)]
+
+    async with aiohttp.ClientSession() as test_client:
+        async with test_client.post(
+            make_url("/users/import/"), data="\n".join(lines), headers=headers
+        ) as resp:
+            assert resp.status == 403
+
+
+@pytest.mark.asyncio
+async def test_users_import_requires_authentication(make_url):
+    async with aiohttp.ClientSession() as test_client:
+        async with test_client.post(make_url("/users/import/"), data="") as resp:
+            assert resp.status == 401
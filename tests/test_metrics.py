@@ -0,0 +1,113 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import routes  # noqa, registers the routes
+from app import demo_options, init_test_app
+from metrics import Counter, Histogram, MetricsRegistry
+
+
+def _parse(text):
+    """
+    Return a mapping of the samples in argument Prometheus text to their values.
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            sample, _, value = line.rpartition(" ")
+            samples[sample] = float(value)
+    return samples
+
+
+def _sample(name, method, route, status=None):
+    labels = 'method="{}",route="{}"'.format(method, route)
+    if status is not None:
+        labels += ',status="{}"'.format(status)
+    return "{}{{{}}}".format(name, labels)
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+
+    registry = MetricsRegistry()
+    registry.register(histogram)
+    assert registry.render() == (
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{le="0.1"} 2\n'
+        'latency_seconds_bucket{le="1.0"} 3\n'
+        'latency_seconds_bucket{le="+Inf"} 4\n'
+        "latency_seconds_sum 2.65\n"
+        "latency_seconds_count 4\n"
+    )
+
+
+def test_label_values_are_escaped():
+    counter = Counter("hits_total", "Hits.", labels=("path",))
+    counter.inc(('a"b\\c\nd',))
+    [(name, labels, value)] = counter.samples()
+    assert labels == r'{path="a\"b\\c\nd"}'
+
+
+def test_collectors_are_rendered_after_metrics():
+    registry = MetricsRegistry()
+    registry.register(Counter("first_total", "First."))
+    registry.add_collector(lambda: [Counter("second_total", "Second.")])
+    assert [metric.name for metric in registry.collect()] == [
+        "first_total",
+        "second_total",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_requests_are_recorded(manage_users_table):
+    app = init_test_app(**demo_options)
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post(
+            "/users/",
+            json={
+                "email": "tintin@gmail.com",
+                "username": "Tintin",
+                "password": "y0u != n00b1e",
+            },
+        )
+        assert resp.status == 201
+        resp = await client.post(
+            "/login/", json={"email": "snowy@gmail.com", "password": "y0u != n00b1e"}
+        )
+        assert resp.status == 404
+        resp = await client.get("/nowhere/")
+        assert resp.status == 404
+
+        resp = await client.get("/metrics")
+        assert resp.status == 200
+        assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        samples = _parse(await resp.text())
+
+    users, login = ("POST", "/users/"), ("POST", "/login/")
+    assert samples[_sample("http_responses_total", *users, status=201)] == 1
+    assert samples[_sample("http_request_duration_seconds_count", *users)] == 1
+    assert samples[_sample("http_responses_total", *login, status=404)] == 1
+    assert samples[_sample("http_responses_total", "GET", "unmatched", 404)] == 1
+    # the scrape is in flight as it's rendered
+    assert samples["http_requests_in_flight"] == 1
+
+    assert samples['sqlite_connection_held_seconds_count{kind="writer"}'] >= 1
+    assert samples['sqlite_connection_held_seconds_count{kind="reader"}'] >= 1
+    assert samples['password_hashing_seconds_count{operation="hash"}'] == 1
+    assert samples['cache_misses_total{cache="credentials"}'] == 1
+    assert samples['loader_loads_total{loader="credentials"}'] == 1
+    assert samples["sqlite_writes_total"] >= 1
+    assert samples['admission_admitted_total{route="POST /login/"}'] == 1
+    assert samples['hasher_workfactor{scheme="bcrypt"}'] == (
+        app["HASHER"].stats["params"]["workfactor"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_metrics_can_be_turned_off():
+    app = init_test_app(**demo_options, SETTINGS={"METRICS_ENABLED": False})
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.get("/metrics")
+        assert resp.status == 404
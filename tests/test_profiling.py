@@ -0,0 +1,142 @@
+import cProfile
+import pstats
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import profiling
+import routes  # noqa, registers the routes
+from app import demo_options, init_prod_app, init_test_app
+
+login_payload = {"email": "tintin@gmail.com", "password": "y0u != n00b1e"}
+
+
+@pytest.fixture(name="client")
+async def fixture_client(manage_users_table):
+    app = init_test_app(**demo_options, SETTINGS={"PROFILES_MAXLEN": 2})
+    async with TestClient(TestServer(app)) as client:
+        yield client
+
+
+async def _download(client, profile_id, format):
+    resp = await client.get(
+        "/debug/profiles/{}".format(profile_id), params={"format": format}
+    )
+    assert resp.status == 200
+    return await resp.read()
+
+
+@pytest.mark.asyncio
+async def test_requests_not_opting_in_are_not_profiled(client):
+    resp = await client.post("/login/", json=login_payload)
+    assert resp.status == 404
+    assert "X-Profile-Id" not in resp.headers
+
+    resp = await client.get("/debug/profiles/")
+    assert (await resp.json())["data"] == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["wall", "cpu"])
+async def test_request_is_profiled(client, mode, tmp_path):
+    resp = await client.post(
+        "/login/", json=login_payload, headers={"X-Profile": mode}
+    )
+    assert resp.status == 404
+    profile_id = resp.headers["X-Profile-Id"]
+
+    resp = await client.get("/debug/profiles/")
+    [summary] = (await resp.json())["data"]
+    assert summary["id"] == int(profile_id)
+    assert (summary["mode"], summary["path"], summary["status"]) == (
+        mode,
+        "/login/",
+        404,
+    )
+
+    # pstats downloads load as profiles written by cProfile do
+    path = tmp_path.joinpath("login.pstats")
+    path.write_bytes(await _download(client, profile_id, "pstats"))
+    stats = pstats.Stats(str(path))
+    assert any(name == "handle_user_login" for _, _, name in stats.stats)
+
+    assert "handle_user_login" in (await _download(client, profile_id, "text")).decode()
+    collapsed = (await _download(client, profile_id, "collapsed")).decode()
+    assert any("(handle_user_login)" in line for line in collapsed.splitlines())
+
+
+@pytest.mark.asyncio
+async def test_request_is_profiled_for_memory(client):
+    resp = await client.get("/users/", params={"profile": "memory"})
+    assert resp.status == 401
+    profile_id = resp.headers["X-Profile-Id"]
+
+    assert await _download(client, profile_id, "text")
+    await _download(client, profile_id, "collapsed")
+    resp = await client.get(
+        "/debug/profiles/{}".format(profile_id), params={"format": "pstats"}
+    )
+    assert resp.status == 400
+
+
+@pytest.mark.asyncio
+async def test_only_the_latest_profiles_are_kept(client):
+    for _ in range(3):
+        resp = await client.post(
+            "/login/", json=login_payload, headers={"X-Profile": "wall"}
+        )
+    resp = await client.get("/debug/profiles/")
+    assert [summary["id"] for summary in (await resp.json())["data"]] == [2, 3]
+
+    resp = await client.get("/debug/profiles/1")
+    assert resp.status == 404
+
+
+@pytest.mark.asyncio
+async def test_profiles_are_taken_one_at_a_time(client):
+    client.app["PROFILES"].busy = True
+    resp = await client.post(
+        "/login/", json=login_payload, headers={"X-Profile": "wall"}
+    )
+    assert resp.status == 409
+
+
+@pytest.mark.asyncio
+async def test_profile_being_taken_is_not_downloaded(client):
+    profile = client.app["PROFILES"].new("wall", "POST", "/login/")
+    resp = await client.get("/debug/profiles/{}".format(profile.id))
+    assert resp.status == 409
+
+
+@pytest.mark.asyncio
+async def test_unknown_mode_is_rejected(client):
+    resp = await client.post(
+        "/login/", json=login_payload, headers={"X-Profile": "gpu"}
+    )
+    assert resp.status == 400
+
+
+def _outer():
+    return sum(_inner(i) for i in range(1000))
+
+
+def _inner(i):
+    return i * i
+
+
+def test_call_graph_is_collapsed_into_stacks():
+    profiler = cProfile.Profile()
+    profiler.runcall(_outer)
+    collapsed = profiling._collapse_pstats(pstats.Stats(profiler))
+
+    stacks = [line.rpartition(" ")[0].split(";") for line in collapsed.splitlines()]
+    # the generator expression of `_outer` calls `_inner`
+    assert any(
+        stack[0].endswith("(_outer)") and stack[-1].endswith("(_inner)")
+        for stack in stacks
+    )
+
+
+def test_only_dev_and_test_apps_are_profiled():
+    assert profiling.profiling_middleware in init_test_app().middlewares
+    assert profiling.profiling_middleware not in init_prod_app().middlewares
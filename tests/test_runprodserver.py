@@ -0,0 +1,94 @@
+import os
+import signal
+import sys
+import time
+
+import pytest
+
+from runprodserver import Supervisor
+
+
+def _beat(heartbeat, fail_if_exists=None, hang=False):
+    """
+    Stand in for a worker, beating every 50ms until sent SIGTERM.
+    """
+    if fail_if_exists is not None and os.path.exists(fail_if_exists):
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    while True:
+        heartbeat.value = time.time()
+        time.sleep(60 if hang else 0.05)
+
+
+@pytest.fixture(name="make_supervisor")
+def fixture_make_supervisor():
+    """
+    Return a factory of supervisors over fake workers, stopped at teardown.
+    """
+    supervisors = []
+
+    def _make_supervisor(**kwargs):
+        options = {"workers": 2, "shutdown_timeout": 5.0, "boot_timeout": 30.0}
+        supervisor = Supervisor(_beat, **{**options, **kwargs})
+        supervisors.append(supervisor)
+        return supervisor
+
+    yield _make_supervisor
+    for supervisor in supervisors:
+        supervisor.stop()
+
+
+def test_workers_that_exit_are_respawned(make_supervisor):
+    supervisor = make_supervisor()
+    assert supervisor.start()
+    dead, alive = supervisor.workers
+    os.kill(dead.pid, signal.SIGKILL)
+    dead.process.join()
+
+    supervisor.check()
+    assert supervisor.respawned == 1
+    assert supervisor.workers[1] is alive
+    assert supervisor.workers[0].wait_ready(30.0)
+
+
+def test_unresponsive_workers_are_killed_and_respawned(make_supervisor):
+    supervisor = make_supervisor(args=(None, True), heartbeat_timeout=0.2)
+    assert supervisor.start()
+    hung = list(supervisor.workers)
+    time.sleep(0.3)
+
+    supervisor.check()
+    assert supervisor.respawned == 2
+    assert all(worker.process.exitcode == -signal.SIGKILL for worker in hung)
+
+
+def test_restart_replaces_workers_gracefully(make_supervisor):
+    supervisor = make_supervisor()
+    assert supervisor.start()
+    old_workers = list(supervisor.workers)
+
+    assert supervisor.restart()
+    assert all(worker.is_ready() for worker in supervisor.workers)
+    assert not set(supervisor.workers) & set(old_workers)
+    # the old workers were asked to exit, rather than killed
+    assert [worker.process.exitcode for worker in old_workers] == [0, 0]
+
+
+def test_restart_is_aborted_if_replacements_fail(make_supervisor, tmp_path):
+    flag = tmp_path.joinpath("fail")
+    supervisor = make_supervisor(args=(str(flag),))
+    assert supervisor.start()
+    old_workers = list(supervisor.workers)
+
+    flag.touch()
+    assert not supervisor.restart()
+    assert supervisor.workers == old_workers
+    assert all(worker.is_alive() for worker in old_workers)
+
+
+def test_start_fails_if_workers_fail(make_supervisor, tmp_path):
+    flag = tmp_path.joinpath("fail")
+    flag.touch()
+    supervisor = make_supervisor(args=(str(flag),))
+    assert not supervisor.start()
+    assert supervisor.workers == []
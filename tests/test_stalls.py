@@ -0,0 +1,90 @@
+import asyncio
+import time
+from pathlib import Path
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import routes  # noqa, registers the routes
+import stalls
+from app import demo_options, init_prod_app, init_test_app
+from stalls import StallDetector
+
+
+def _block(seconds):
+    time.sleep(seconds)
+
+
+@pytest.fixture(name="detector")
+async def fixture_detector():
+    detector = StallDetector(threshold=0.05, interval=0.005, root=Path(__file__))
+    detector.start(asyncio.get_event_loop())
+    yield detector
+    detector.stop()
+
+
+@pytest.mark.asyncio
+async def test_stalls_are_put_down_to_their_call_site(detector):
+    for seconds in [0.2, 0.1]:
+        _block(seconds)
+        await asyncio.sleep(0.05)
+    _block(0.02)
+    await asyncio.sleep(0.05)
+
+    [entry] = detector.report()
+    assert entry["site"].endswith("in _block")
+    assert entry["stalls"] == 2
+    assert 0.28 <= entry["total"] < 0.4
+    assert 0.19 <= entry["max"] < 0.3
+    # the stack runs from the outermost frame to the blocking call
+    assert entry["stack"][-1].endswith("in _block")
+    assert "test_stalls_are_put_down_to_their_call_site" in entry["stack"][-2]
+    assert "s blocked over 2 stalls" in detector.format_report().splitlines()[0]
+
+
+@pytest.mark.asyncio
+async def test_stalls_are_ranked_by_time_blocked(detector):
+    def _block_briefly():
+        time.sleep(0.06)
+
+    for _ in range(3):
+        _block_briefly()
+        await asyncio.sleep(0.05)
+    _block(0.4)
+    await asyncio.sleep(0.05)
+
+    report = detector.report()
+    assert [entry["site"].rpartition(" in ")[2] for entry in report] == [
+        "_block",
+        "_block_briefly",
+    ]
+    assert report[1]["stalls"] == 3
+
+
+@pytest.mark.asyncio
+async def test_yielding_loop_is_not_stalled(detector):
+    for _ in range(20):
+        _block(0.01)
+        await asyncio.sleep(0)
+    assert detector.report() == []
+
+
+@pytest.mark.asyncio
+async def test_handle_stalls(caplog):
+    app = init_test_app(**demo_options, SETTINGS={"STALL_THRESHOLD": 0.05})
+    async with TestClient(TestServer(app)) as client:
+        _block(0.1)
+        await asyncio.sleep(0.05)
+        resp = await client.get("/debug/stalls")
+        assert resp.status == 200
+        [entry] = (await resp.json())["data"]
+    assert entry["stalls"] == 1
+    # and are reported once the app is done
+    [record] = [r for r in caplog.records if r.name == "stalls"]
+    assert record.levelname == "WARNING"
+    assert entry["site"] in record.getMessage()
+
+
+def test_only_dev_and_test_apps_are_watched():
+    assert stalls.manage_stall_detection in init_test_app().cleanup_ctx
+    assert stalls.manage_stall_detection not in init_prod_app().cleanup_ctx
@@ -0,0 +1,128 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import routes  # noqa, registers the routes
+from app import demo_options, init_test_app
+from throttling import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_rate():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=1, burst=3, clock=clock)
+
+    for _ in range(3):
+        assert limiter.check("tintin") == 0
+        limiter.take("tintin")
+    assert limiter.check("tintin") == pytest.approx(1)
+    assert limiter.throttled == 1
+
+    clock.now += 0.5
+    assert limiter.check("tintin") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.check("tintin") == 0
+
+    # other keys have buckets of their own
+    assert limiter.check("snowy") == 0
+
+
+def test_give_back():
+    limiter = RateLimiter(rate=1, burst=1, clock=FakeClock())
+    limiter.take("tintin")
+    assert limiter.check("tintin") > 0
+    limiter.give_back("tintin")
+    assert limiter.check("tintin") == 0
+
+
+def test_sweep_drops_full_buckets():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=1, burst=5, clock=clock)
+    limiter.take("tintin")
+    clock.now += 0.5
+    limiter.take("snowy")
+
+    clock.now += 0.6
+    limiter.sweep()
+    assert len(limiter) == 1
+    assert limiter.check("snowy") == 0
+
+
+def test_keys_are_bounded():
+    limiter = RateLimiter(rate=1, burst=5, max_keys=100, clock=FakeClock())
+    for i in range(1000):
+        limiter.take(i)
+        assert len(limiter) <= 100
+
+
+def test_sweep_in_slices():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=1, burst=5, clock=clock)
+    for i in range(10):
+        limiter.take(i)
+    clock.now += 1
+
+    assert limiter.sweep(4) is False
+    assert len(limiter) == 6
+    assert limiter.sweep(4) is False
+    assert limiter.sweep(4) is True
+    assert len(limiter) == 0
+
+
+def test_throttled_buckets_outlive_floods_of_keys():
+    """
+    Assert that filling the limiter with new keys
+    doesn't reset the bucket of a key being throttled.
+    """
+    limiter = RateLimiter(rate=0.1, burst=5, max_keys=100, clock=FakeClock())
+    for _ in range(6):
+        limiter.take("tintin@gmail.com")
+    assert limiter.check("tintin@gmail.com") > 0
+
+    for i in range(1000):
+        limiter.take("user{}@example.com".format(i))
+    assert len(limiter) <= 100
+    assert limiter.check("tintin@gmail.com") > 0
+
+
+@pytest.mark.asyncio
+async def test_login_is_throttled_after_failed_attempts(manage_users_table):
+    app = init_test_app(
+        **demo_options,
+        SETTINGS={
+            "LOGIN_THROTTLE_CLIENT_RATE": (1.0, 100),
+            "LOGIN_THROTTLE_EMAIL_RATE": (0.001, 2),
+        },
+    )
+    credentials = {"email": "tintin@gmail.com", "password": "y0u != n00b1e"}
+
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post("/users/", json={"username": "Tintin", **credentials})
+        assert resp.status == 201
+
+        # successful attempts aren't counted
+        for _ in range(3):
+            resp = await client.post("/login/", json=credentials)
+            assert resp.status == 200
+
+        for _ in range(2):
+            resp = await client.post(
+                "/login/", json={**credentials, "password": "wr0ngPa55w0rd!"}
+            )
+            assert resp.status == 404
+
+        resp = await client.post("/login/", json=credentials)
+        assert resp.status == 429
+        assert int(resp.headers["Retry-After"]) > 0
+
+        # other emails are left alone
+        resp = await client.post(
+            "/login/", json={**credentials, "email": "snowy@gmail.com"}
+        )
+        assert resp.status == 404
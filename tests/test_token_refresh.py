@@ -0,0 +1,137 @@
+import os
+
+import aiohttp
+import jwt
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import auth
+import routes  # noqa, registers the routes
+from app import demo_options, init_test_app
+
+credentials = {"email": "tintin@gmail.com", "password": "y0u != n00b1e"}
+
+
+async def _login(test_client, make_url):
+    async with test_client.post(
+        make_url("/users/"), json={"username": "Tintin", **credentials}
+    ) as resp:
+        assert resp.status == 201
+
+    async with test_client.post(make_url("/login/"), json=credentials) as resp:
+        assert resp.status == 200
+        return (await resp.json())["data"]
+
+
+def _encode(claims):
+    return jwt.encode(claims, os.getenv("JWT_SECRET"), algorithm="HS256").decode(
+        "utf-8"
+    )
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_renews_access_token(manage_users_table, make_url):
+    async with aiohttp.ClientSession() as test_client:
+        data = await _login(test_client, make_url)
+
+        async with test_client.post(
+            make_url("/token/refresh/"), json={"refresh_token": data["refresh_token"]}
+        ) as resp:
+            assert resp.status == 200
+            resp_json = await resp.json()
+
+    assert resp_json["data"]["id"] == data["id"]
+    claims = jwt.decode(
+        resp_json["data"]["access_token"], os.getenv("JWT_SECRET"), algorithms=["HS256"]
+    )
+    assert claims["type"] == "access"
+    assert claims["uid"] == data["id"]
+
+
+@pytest.mark.asyncio
+async def test_expired_access_token_does_not_stand_in_the_way(
+    manage_users_table, make_url
+):
+    """
+    Assert that clients attaching their expired access token
+    to every request can still refresh it.
+    """
+    async with aiohttp.ClientSession() as test_client:
+        data = await _login(test_client, make_url)
+        expired = _encode({"type": "access", "uid": data["id"], "exp": 0})
+
+        async with test_client.post(
+            make_url("/token/refresh/"),
+            json={"refresh_token": data["refresh_token"]},
+            headers={"Authorization": "Bearer {}".format(expired)},
+        ) as resp:
+            assert resp.status == 200
+
+
+@pytest.mark.asyncio
+async def test_access_token_cannot_refresh(manage_users_table, make_url):
+    async with aiohttp.ClientSession() as test_client:
+        data = await _login(test_client, make_url)
+
+        async with test_client.post(
+            make_url("/token/refresh/"), json={"refresh_token": data["access_token"]}
+        ) as resp:
+            assert resp.status == 401
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "make_token",
+    [
+        lambda uid: "not.a.token",
+        lambda uid: _encode({"type": "refresh", "uid": uid, "key": "0" * 64}),
+        lambda uid: _encode(
+            {
+                "type": "refresh",
+                "uid": uid + 1,
+                "key": auth._gen_refresh_key(uid + 1, ""),
+            }
+        ),
+        lambda uid: jwt.encode(
+            {"type": "refresh", "uid": uid, "key": "0" * 64}, "not-the-secret"
+        ).decode("utf-8"),
+    ],
+    ids=["garbage", "wrong_key", "no_such_user", "bad_signature"],
+)
+async def test_invalid_refresh_token_is_rejected(
+    manage_users_table, make_url, make_token
+):
+    async with aiohttp.ClientSession() as test_client:
+        data = await _login(test_client, make_url)
+
+        async with test_client.post(
+            make_url("/token/refresh/"), json={"refresh_token": make_token(data["id"])}
+        ) as resp:
+            assert resp.status == 401
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_is_required(make_url):
+    async with aiohttp.ClientSession() as test_client:
+        async with test_client.post(make_url("/token/refresh/"), json={}) as resp:
+            assert resp.status == 400
+
+
+@pytest.mark.asyncio
+async def test_refresh_keys_are_cached(manage_users_table):
+    app = init_test_app(**demo_options)
+
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post("/users/", json={"username": "Tintin", **credentials})
+        assert resp.status == 201
+        resp = await client.post("/login/", json=credentials)
+        refresh_token = (await resp.json())["data"]["refresh_token"]
+
+        for _ in range(3):
+            resp = await client.post(
+                "/token/refresh/", json={"refresh_token": refresh_token}
+            )
+            assert resp.status == 200
+
+        assert app["PWD_HASH_LOADER"].loads == 1
+        assert app["REFRESH_KEYS_CACHE"].stats["hits"] == 2
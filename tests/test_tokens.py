@@ -0,0 +1,71 @@
+import jwt
+import pytest
+
+import auth
+from tokens import TokenMinter
+
+secret = "sekrit"
+
+
+@pytest.fixture(name="minter")
+def fixture_minter():
+    return TokenMinter(secret)
+
+
+@pytest.mark.parametrize(
+    "claims",
+    [
+        {},
+        {"uid": 1024, "type": "access", "exp": 1600000000},
+        {"uid": "1024", "key": "deadbeef" * 8},
+        {"name": "Tintin à Moulinsart ☃", "roles": ["reporter", None]},
+        {"nested": {"a": [1, 2.5, True, False]}, "empty": ""},
+        {"x" * 100: "y" * 1000},
+    ],
+    ids=["empty", "access", "refresh", "unicode", "nested", "long"],
+)
+def test_token_is_identical_to_pyjwt(minter, claims):
+    expected = jwt.encode(claims, secret, algorithm="HS256").decode("utf-8")
+    assert minter.mint(claims) == expected
+
+
+def test_access_token_is_identical_to_auth(minter, monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", secret)
+    expected = auth.gen_access_token(uid=1024)
+    exp = jwt.decode(expected, secret, algorithms=["HS256"])["exp"]
+
+    token = minter.mint_access_token(1024, issued_at=exp - minter.lifetime)
+    assert token == expected
+
+
+def test_refresh_token_is_identical_to_auth(minter, monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", secret)
+    password_hash = auth.get_password_hash("y0u != n00b1e", workfactor=4)
+    expected = auth.gen_refresh_token(uid=1024, password_hash=password_hash)
+
+    assert minter.mint_refresh_token(1024, password_hash) == expected
+
+
+def test_minted_tokens_verify(minter):
+    access_token, refresh_token = minter.mint_login_tokens(1024, "hash")
+
+    access_claims = jwt.decode(access_token, secret, algorithms=["HS256"])
+    assert access_claims["type"] == "access"
+    assert access_claims["uid"] == 1024
+    refresh_claims = jwt.decode(refresh_token, secret, algorithms=["HS256"])
+    assert refresh_claims["type"] == "refresh"
+    assert refresh_claims["key"] == auth._gen_refresh_key(1024, "hash")
+
+    with pytest.raises(jwt.InvalidSignatureError):
+        jwt.decode(access_token, "not-the-sekrit", algorithms=["HS256"])
+
+
+def test_mint_many_matches_mint(minter):
+    claims_list = [{"uid": uid, "exp": 1600000000} for uid in range(50)]
+    assert minter.mint_many(claims_list) == [minter.mint(c) for c in claims_list]
+
+
+def test_hmac_state_isnt_shared_between_tokens(minter):
+    first = minter.mint({"uid": 1})
+    minter.mint({"uid": 2})
+    assert minter.mint({"uid": 1}) == first
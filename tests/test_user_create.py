@@ -1,10 +1,15 @@
+import asyncio
 import random
 import string
+from types import SimpleNamespace
 
 import aiohttp
 import pytest
+from aiohttp.test_utils import TestClient, TestServer
 
 import auth
+import routes
+from app import demo_options, init_test_app
 
 
 @pytest.mark.asyncio
@@ -256,3 +261,34 @@ async def test_cannot_create_user_with_invalid_email(
             assert resp.reason == "Bad Request"
             resp_json = await resp.json()
             assert resp_json["error"] == "invalid email"
+
+
+@pytest.mark.asyncio
+async def test_user_created_by_cancelled_request_can_login(manage_users_table):
+    """
+    Assert that a user whose creation was given up on once written
+    isn't still taken for unknown by the credentials cache.
+    """
+    payload = {"email": "tintin@gmail.com", "password": "y0u != n00b1e"}
+    app = init_test_app(**demo_options, SETTINGS={"DB_WRITE_BATCH_WINDOW": 0.1})
+    async with TestClient(TestServer(app)) as client:
+        # caches the email as unknown
+        resp = await client.post("/login/", json=payload)
+        assert resp.status == 404
+
+        pwd_hash = auth.get_password_hash(payload["password"], workfactor=4)
+        creation = asyncio.ensure_future(
+            routes.create_user(
+                SimpleNamespace(config_dict=client.app),
+                payload["email"],
+                "Tintin",
+                pwd_hash,
+            )
+        )
+        # the write is queued, awaiting the end of the batch window
+        await asyncio.sleep(0.02)
+        creation.cancel()
+        await asyncio.sleep(0.2)
+
+        resp = await client.post("/login/", json=payload)
+        assert resp.status == 200
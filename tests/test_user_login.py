@@ -1,5 +1,13 @@
+import uuid
+
 import aiohttp
+import aiosqlite
 import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import auth
+import routes  # noqa, registers the routes
+from app import demo_options, init_test_app
 
 
 @pytest.mark.asyncio
@@ -87,3 +95,101 @@ async def test_cannot_login_with_bad_credentials(manage_users_table, make_url):
             assert resp.status == 404
             resp_json = await resp.json()
             assert resp_json["error"] == "user with given credentials not found"
+
+
+@pytest.mark.asyncio
+async def test_can_login_after_failing_to_before_signup(manage_users_table, make_url):
+    """
+    Assert that a failed login with an email doesn't stop its owner from
+    logging in once they've signed up.
+
+    The email is one no other test run signs up with, as the server may still
+    remember the users of earlier tests.
+    """
+    login_user_payload = {
+        "email": "snowy.{}@gmail.com".format(uuid.uuid4().hex),
+        "password": "y0u != n00b1e",
+    }
+    create_user_payload = {"username": "Snowy", **login_user_payload}
+
+    async with aiohttp.ClientSession() as test_client:
+        async with test_client.post(
+            make_url("/login/"), json=login_user_payload
+        ) as resp:
+            assert resp.status == 404
+
+        async with test_client.post(
+            make_url("/users/"), json=create_user_payload
+        ) as resp:
+            assert resp.status == 201
+
+        async with test_client.post(
+            make_url("/login/"), json=login_user_payload
+        ) as resp:
+            assert resp.status == 200
+
+
+@pytest.mark.asyncio
+async def test_outdated_hash_is_rehashed_after_login(manage_users_table, test_db_path):
+    credentials = {"email": "tintin@gmail.com", "password": "y0u != n00b1e"}
+    async with aiosqlite.connect(str(test_db_path)) as conn:
+        await conn.execute(
+            "INSERT INTO test_users (email, username, pwd_hash) VALUES (?, ?, ?)",
+            ["tintin@gmail.com", "Tintin", auth.get_password_hash("y0u != n00b1e", 4)],
+        )
+        await conn.commit()
+
+    app = init_test_app(**demo_options, SETTINGS={"HASHER_WORKFACTOR": 5})
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post("/login/", json=credentials)
+        assert resp.status == 200
+        await app["REHASHER"].close()
+        assert app["REHASHER"].stats["rehashed"] == 1
+
+        # the new hash is picked up right away
+        resp = await client.post("/login/", json=credentials)
+        assert resp.status == 200
+        assert app["REHASHER"].stats["backlog"] == 0
+
+    async with aiosqlite.connect(str(test_db_path)) as conn:
+        cursor = await conn.execute("SELECT pwd_hash FROM test_users")
+        [(pwd_hash,)] = await cursor.fetchall()
+        await cursor.close()
+    assert auth.get_hash_workfactor(pwd_hash) == 5
+    assert auth.check_password_hash("y0u != n00b1e", pwd_hash)
+
+
+@pytest.mark.asyncio
+async def test_users_are_moved_to_the_preferred_scheme_on_login(
+    manage_users_table, test_db_path
+):
+    credentials = {"email": "tintin@gmail.com", "password": "y0u != n00b1e"}
+    async with aiosqlite.connect(str(test_db_path)) as conn:
+        await conn.execute(
+            "INSERT INTO test_users (email, username, pwd_hash) VALUES (?, ?, ?)",
+            ["tintin@gmail.com", "Tintin", auth.get_password_hash("y0u != n00b1e", 4)],
+        )
+        await conn.commit()
+
+    app = init_test_app(
+        **demo_options,
+        SETTINGS={
+            "HASHER_SCHEME": "scrypt",
+            "HASHER_PARAMS": {"scrypt": {"n": 2 ** 10, "r": 8, "p": 1}},
+        }
+    )
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post("/login/", json=credentials)
+        assert resp.status == 200
+        await app["REHASHER"].close()
+        assert app["REHASHER"].stats["rehashed"] == 1
+
+        resp = await client.post("/login/", json=credentials)
+        assert resp.status == 200
+
+    async with aiosqlite.connect(str(test_db_path)) as conn:
+        cursor = await conn.execute("SELECT pwd_hash FROM test_users")
+        [(pwd_hash,)] = await cursor.fetchall()
+        await cursor.close()
+    assert pwd_hash.startswith("$scrypt$ln=10,r=8,p=1$")
+    assert auth.check_password_hash("y0u != n00b1e", pwd_hash)
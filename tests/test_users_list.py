@@ -0,0 +1,126 @@
+import csv
+import io
+import itertools
+import json
+
+import aiosqlite
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import auth
+import routes  # noqa, registers the routes
+from app import demo_options, init_test_app
+
+users = [
+    ("user{:02}@{}".format(i, domain), "user{:02}".format(i))
+    for i, domain in zip(range(1, 26), itertools.cycle(["gmail.com", "herge.be"]))
+]
+
+
+@pytest.fixture(name="client")
+async def fixture_client(manage_users_table, test_db_path):
+    """
+    Return a client to a test app whose database holds 25 users,
+    authenticated as the first, an admin.
+    """
+    async with aiosqlite.connect(str(test_db_path)) as conn:
+        await conn.executemany(
+            "INSERT INTO test_users (email, username, pwd_hash) VALUES (?, ?, 'x')",
+            users,
+        )
+        await conn.execute("UPDATE test_users SET is_admin = 1 WHERE id = 1")
+        await conn.commit()
+
+    app = init_test_app(**demo_options, SETTINGS={"USERS_PAGE_SIZE_MAX": 10})
+    client = TestClient(
+        TestServer(app),
+        headers={"Authorization": "Bearer {}".format(auth.gen_access_token(uid=1))},
+    )
+    await client.start_server()
+    yield client
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_users_are_paged_by_id(client):
+    url, ids = "/users/?limit=10", []
+    while url is not None:
+        resp = await client.get(url)
+        assert resp.status == 200
+        resp_json = await resp.json()
+        ids.extend(user["id"] for user in resp_json["data"])
+        url = resp_json["next"]
+
+    assert ids == list(range(1, 26))
+
+
+@pytest.mark.asyncio
+async def test_users_page_hides_password_hashes(client):
+    resp = await client.get("/users/?limit=1")
+    assert (await resp.json())["data"] == [
+        {"id": 1, "username": "user01", "email": "user01@gmail.com"}
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("username_prefix=user1", list(range(10, 20))),
+        ("email_domain=herge.be&limit=5", list(range(2, 12, 2))),
+        ("email_domain=herge.be&after=20", [22, 24]),
+        ("email_domain=%25.be", []),
+    ],
+    ids=["username_prefix", "email_domain", "after", "wildcards"],
+)
+async def test_users_are_filtered(client, query, expected):
+    resp = await client.get("/users/?" + query)
+    assert resp.status == 200
+    assert [user["id"] for user in (await resp.json())["data"]] == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query", ["limit=0", "limit=11", "after=one", "format=xml"],
+)
+async def test_invalid_query_is_rejected(client, query):
+    resp = await client.get("/users/?" + query)
+    assert resp.status == 400
+
+
+@pytest.mark.asyncio
+async def test_users_export_as_ndjson(client):
+    resp = await client.get("/users/?format=ndjson&email_domain=gmail.com")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"] == "application/x-ndjson"
+
+    exported = [json.loads(line) for line in (await resp.text()).splitlines()]
+    # exports run past the page size, a page at a time
+    assert [user["id"] for user in exported] == list(range(1, 26, 2))
+
+
+@pytest.mark.asyncio
+async def test_users_export_as_csv(client):
+    resp = await client.get("/users/?format=csv")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"].startswith("text/csv")
+
+    rows = list(csv.reader(io.StringIO(await resp.text())))
+    assert rows[0] == ["id", "username", "email"]
+    assert rows[1:] == [
+        [str(i), username, email] for i, (email, username) in enumerate(users, 1)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_users_listing_requires_authentication(client):
+    resp = await client.get("/users/", headers={"Authorization": ""})
+    assert resp.status == 401
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("query", ["", "format=csv"], ids=["page", "export"])
+async def test_users_listing_requires_an_admin(client, query):
+    headers = {"Authorization": "Bearer {}".format(auth.gen_access_token(uid=2))}
+    resp = await client.get("/users/?" + query, headers=headers)
+    assert resp.status == 403
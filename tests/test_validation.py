@@ -0,0 +1,62 @@
+import random
+import re
+from difflib import SequenceMatcher
+
+import pytest
+
+import auth
+import blocklist
+
+
+def _legacy_check_password_similarity(password, other):
+    for part in re.split(r"\W+", other) + [other]:
+        if SequenceMatcher(a=password, b=part).quick_ratio() >= 0.7:
+            return False
+    return True
+
+
+def test_similarity_matches_sequence_matcher():
+    rng = random.Random(1024)
+    alphabet = "abcde1.@_- "
+    for _ in range(5000):
+        password = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 16)))
+        other = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 24)))
+        assert auth._check_password_similarity(
+            password, other
+        ) == _legacy_check_password_similarity(password, other), (password, other)
+
+
+@pytest.mark.parametrize(
+    "password, username, email, rule",
+    [
+        ("a5exyMe", "Tintin", "tintin@gmail.com", "too_short"),
+        ("x" * 65, "Tintin", "tintin@gmail.com", "too_long"),
+        ("tintin1234", "Tintin", "snowy@gmail.com", "contains_username"),
+        ("TINTIN@GMAIL.COM!", "Haddock", "Tintin@Gmail.com", "contains_email"),
+        ("bigpimpin1", "Tintin", "tintin@gmail.com", "common"),
+        ("bigpimpin12", "Tintin", "tintin@gmail.com", "similar_to_common"),
+        ("b1gpimpin1", "Tintin", "tintin@gmail.com", "similar_to_common"),
+        ("IAmTinboo", "tinboobaby", "tintin@gmail.com", "similar_to_username"),
+        ("pypylee1", "Tintin", "pypyleecious@gmail.com", "similar_to_email"),
+        ("y0u != n00b1e", "Tintin", "tintin@gmail.com", None),
+    ],
+)
+def test_check_password_names_the_rule_broken(password, username, email, rule):
+    assert auth.check_password(password, username, email) == rule
+    assert auth.validate_password(password, username, email) is (rule is None)
+
+
+def test_checks_stop_at_the_first_rule_broken(monkeypatch):
+    def _fail():
+        raise AssertionError("common passwords looked up")
+
+    monkeypatch.setattr(blocklist, "get_common_passwords", _fail)
+    assert auth.check_password("short", "Tintin", "tintin@gmail.com") == "too_short"
+
+
+@pytest.mark.parametrize(
+    "name, valid",
+    [("Tintin", True), ("abcd", False), ("tin tin", False), ("t.in+t-i@n_", True)],
+)
+def test_validate_username(name, valid):
+    assert auth.validate_username(name) is valid